@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the NIA Engineering Portal server.
+Starts scripts/serve.py in-process on an ephemeral port and replays
+page-load request patterns against it.
+"""
+
+import argparse
+import asyncio
+import http.client
+import os
+import re
+import socket
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+import serve
+from serve import create_server, parse_args
+
+PROJECT_ROOT = Path(__file__).parent.parent
+
+# Scripts the service worker registration pulls in on every page
+SERVICE_WORKER_ASSETS = ["js/service-worker-register.js", "js/service-worker.js"]
+
+
+def page_assets(page: str) -> list[str]:
+    """Return the URL paths a browser fetches to load a portal page.
+
+    Args:
+        page: Page file name under pages/
+
+    Returns:
+        List of URL paths, HTML first
+    """
+    html = (PROJECT_ROOT / "pages" / page).read_text(encoding="utf-8")
+    refs = re.findall(r'(?:href|src)="([^":#?]+\.(?:css|js))"', html)
+    assets = []
+    for ref in refs + SERVICE_WORKER_ASSETS:
+        if ref not in assets and (PROJECT_ROOT / "pages" / ref).is_file():
+            assets.append(ref)
+    return [f"/pages/{page}"] + [f"/pages/{ref}" for ref in assets]
+
+
+def start_server(argv: list[str]):
+    """Start the portal server on an ephemeral port in a background thread."""
+    os.chdir(PROJECT_ROOT)
+    args = parse_args(
+        ["--host", "127.0.0.1", "--port", "0", "--access-log", "off", *argv]
+    )
+    httpd = create_server(args)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def stop_server(httpd) -> None:
+    """Stop a server started with start_server."""
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def marker(speedup: float) -> str:
+    """Return the summary marker: ✅ when the change is faster, ⚠️ when not."""
+    return "✅" if speedup > 1.0 else "⚠️ "
+
+
+def load_page(address, paths: list[str], keep_alive: bool) -> tuple[float, int]:
+    """Fetch every path of a page load.
+
+    Args:
+        address: (host, port) of the server
+        paths: URL paths to fetch
+        keep_alive: Reuse one connection instead of one per request
+
+    Returns:
+        Tuple of (elapsed seconds, TCP connections opened)
+    """
+    headers = {} if keep_alive else {"Connection": "close"}
+    connections = 0
+    conn = None
+    start = time.perf_counter()
+    for path in paths:
+        if conn is None:
+            conn = http.client.HTTPConnection(*address, timeout=10)
+            connections += 1
+        conn.request("GET", path, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f"{path} returned {response.status}")
+        if not keep_alive or response.will_close:
+            conn.close()
+            conn = None
+    elapsed = time.perf_counter() - start
+    if conn is not None:
+        conn.close()
+    return elapsed, connections
+
+
+def bench_keepalive(args) -> None:
+    """Compare page loads over fresh connections against one kept-alive one."""
+    paths = page_assets(args.page)
+    httpd = start_server(["--engine", args.engine])
+    address = httpd.server_address[:2]
+    try:
+        print(f"📄 Page load: {len(paths)} requests ({', '.join(paths)})")
+        results = {}
+        for keep_alive in (False, True):
+            for _ in range(args.warmup):
+                load_page(address, paths, keep_alive)
+            timings = []
+            for _ in range(args.iterations):
+                elapsed, connections = load_page(address, paths, keep_alive)
+                timings.append(elapsed * 1000)
+            results[keep_alive] = (timings, connections)
+    finally:
+        stop_server(httpd)
+
+    for keep_alive, (timings, connections) in results.items():
+        label = "keep-alive       " if keep_alive else "connection/request"
+        print(
+            f"  {label}: {connections} connections, "
+            f"mean {statistics.mean(timings):.3f} ms, "
+            f"p50 {statistics.median(timings):.3f} ms per page load"
+        )
+    fresh, kept = (statistics.mean(results[k][0]) for k in (False, True))
+    saved = fresh - kept
+    print(f"{marker(fresh / kept)} Keep-alive saves {saved:.3f} ms per page load")
+
+
+def request_loop(address, path: str, requests: int) -> float:
+    """Send GET requests back to back over one kept-alive connection.
+
+    Uses a raw socket so client-side parsing stays out of the measurement.
+
+    Args:
+        address: (host, port) of the server
+        path: URL path to fetch
+        requests: Number of requests to send
+
+    Returns:
+        Elapsed seconds
+    """
+    request = f"GET {path} HTTP/1.1\r\nHost: bench\r\n\r\n".encode()
+    with socket.create_connection(address, timeout=10) as sock:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        buffer = b""
+        start = time.perf_counter()
+        for _ in range(requests):
+            sock.sendall(request)
+            while b"\r\n\r\n" not in buffer:
+                buffer += receive(sock)
+            head, _, buffer = buffer.partition(b"\r\n\r\n")
+            length = int(re.search(rb"Content-Length: (\d+)", head).group(1))
+            while len(buffer) < length:
+                buffer += receive(sock)
+            buffer = buffer[length:]
+        return time.perf_counter() - start
+
+
+def receive(sock: socket.socket) -> bytes:
+    """Read from a socket, failing if the server closed the connection."""
+    data = sock.recv(65536)
+    if not data:
+        raise RuntimeError("server closed the connection")
+    return data
+
+
+def set_preserialize(enabled: bool) -> None:
+    """Switch pre-serialized responses on or off in every engine."""
+    serve.RedirectHandler.preserialize = enabled
+    serve.AsyncHTTPServer.preserialize = enabled
+
+
+def bench_serialize(args) -> None:
+    """Compare cached responses built per request against pre-serialized ones."""
+    path = f"/pages/{args.page}"
+    keepalive = str(max(args.requests, args.warmup) + 1)
+    httpd = start_server(["--engine", args.engine, "--keepalive-requests", keepalive])
+    address = httpd.server_address[:2]
+    results = {}
+    try:
+        for enabled in (False, True):
+            set_preserialize(enabled)
+            request_loop(address, path, args.warmup)
+            rates = []
+            for _ in range(args.rounds):
+                elapsed = request_loop(address, path, args.requests)
+                rates.append(args.requests / elapsed)
+            results[enabled] = rates
+    finally:
+        set_preserialize(True)
+        stop_server(httpd)
+
+    print(f"📄 GET {path} x {args.requests}, {args.rounds} rounds ({args.engine})")
+    for enabled, rates in results.items():
+        label = "pre-serialized" if enabled else "per-request   "
+        print(
+            f"  {label}: median {statistics.median(rates):,.0f} req/s, "
+            f"best {max(rates):,.0f} req/s"
+        )
+    gain = statistics.median(results[True]) / statistics.median(results[False])
+    print(f"{marker(gain)} Pre-serialized responses: {gain:.2f}x requests/sec")
+
+
+async def h1_get(reader, writer, path: str) -> None:
+    """Fetch one path over a kept-alive HTTP/1.1 connection."""
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: bench\r\n\r\n".encode())
+    head = await reader.readuntil(b"\r\n\r\n")
+    if not head.startswith(b"HTTP/1.1 200"):
+        raise RuntimeError(f"{path} returned {head.split(maxsplit=2)[1].decode()}")
+    length = int(re.search(rb"Content-Length: (\d+)", head).group(1))
+    await reader.readexactly(length)
+
+
+async def h1_page_load(address, paths: list[str], connections: int) -> float:
+    """Load a page the way a browser does over HTTP/1.1.
+
+    The HTML comes first on one connection; its assets are then spread over
+    up to ``connections`` parallel connections (browsers open six per host).
+
+    Returns:
+        Elapsed seconds
+    """
+    start = time.perf_counter()
+    streams = [await asyncio.open_connection(*address)]
+    await h1_get(*streams[0], paths[0])
+    assets = paths[1:]
+    while len(streams) < min(connections, len(assets)):
+        streams.append(await asyncio.open_connection(*address))
+
+    async def fetch_share(index: int) -> None:
+        for path in assets[index :: len(streams)]:
+            await h1_get(*streams[index], path)
+
+    await asyncio.gather(*(fetch_share(i) for i in range(len(streams))))
+    elapsed = time.perf_counter() - start
+    for _, writer in streams:
+        writer.close()
+    return elapsed
+
+
+async def h2_page_load(address, paths: list[str]) -> float:
+    """Load a page over one HTTP/2 (h2c) connection: HTML, then every asset.
+
+    Returns:
+        Elapsed seconds
+    """
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(*address)
+    config = serve.h2.config.H2Configuration(client_side=True)
+    conn = serve.h2.connection.H2Connection(config=config)
+    conn.initiate_connection()
+    for batch in (paths[:1], paths[1:]):
+        pending = set()
+        for path in batch:
+            stream_id = conn.get_next_available_stream_id()
+            headers = [
+                (":method", "GET"),
+                (":path", path),
+                (":scheme", "http"),
+                (":authority", "bench"),
+            ]
+            conn.send_headers(stream_id, headers, end_stream=True)
+            pending.add(stream_id)
+        writer.write(conn.data_to_send())
+        while pending:
+            data = await reader.read(65536)
+            if not data:
+                raise RuntimeError("server closed the connection")
+            for event in conn.receive_data(data):
+                if isinstance(event, serve.h2.events.ResponseReceived):
+                    status = dict(event.headers)[b":status"]
+                    if status != b"200":
+                        raise RuntimeError(f"stream returned {status.decode()}")
+                elif isinstance(event, serve.h2.events.DataReceived):
+                    conn.acknowledge_received_data(
+                        event.flow_controlled_length, event.stream_id
+                    )
+                elif isinstance(event, serve.h2.events.StreamEnded):
+                    pending.discard(event.stream_id)
+            writer.write(conn.data_to_send())
+    elapsed = time.perf_counter() - start
+    writer.close()
+    return elapsed
+
+
+def bench_http2(args) -> int:
+    """Compare page-complete time over HTTP/1.1 against HTTP/2."""
+    if serve.h2 is None:
+        print("❌ The h2 package is not installed (uv sync --extra server)")
+        return 1
+    paths = page_assets(args.page)
+    httpd = start_server(["--engine", "async", "--http2"])
+    address = httpd.server_address[:2]
+    loads = {
+        f"HTTP/1.1 ({args.connections} conns)": lambda: h1_page_load(
+            address, paths, args.connections
+        ),
+        "HTTP/2 (1 conn)   ": lambda: h2_page_load(address, paths),
+    }
+
+    async def run(load) -> list[float]:
+        for _ in range(args.warmup):
+            await load()
+        return [await load() * 1000 for _ in range(args.iterations)]
+
+    try:
+        results = {label: asyncio.run(run(load)) for label, load in loads.items()}
+    finally:
+        stop_server(httpd)
+
+    print(f"📄 Page load: {len(paths)} requests ({', '.join(paths)})")
+    for label, timings in results.items():
+        print(
+            f"  {label}: mean {statistics.mean(timings):.3f} ms, "
+            f"p50 {statistics.median(timings):.3f} ms, "
+            f"p95 {statistics.quantiles(timings, n=20)[-1]:.3f} ms"
+        )
+    h1, h2 = (statistics.median(timings) for timings in results.values())
+    speedup = h1 / h2
+    print(
+        f"{marker(speedup)} HTTP/2 page-complete p50 is "
+        f"{speedup:.2f}x HTTP/1.1's speed"
+    )
+    return 0
+
+
+def main(argv=None) -> int:
+    """Run a server benchmark."""
+    parser = argparse.ArgumentParser(description="Portal server benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    keepalive = subparsers.add_parser(
+        "keepalive", help="Connection setup cost per page load"
+    )
+    keepalive.add_argument("--page", default="cr21-operator.html")
+    keepalive.add_argument(
+        "--engine", default="threaded", choices=["threaded", "async"]
+    )
+    keepalive.add_argument("--iterations", type=int, default=500)
+    keepalive.add_argument("--warmup", type=int, default=20)
+    keepalive.set_defaults(func=bench_keepalive)
+
+    serialize = subparsers.add_parser(
+        "serialize", help="Requests/sec for cached responses"
+    )
+    serialize.add_argument("--page", default="cr21-operator.html")
+    serialize.add_argument(
+        "--engine", default="threaded", choices=["threaded", "async"]
+    )
+    serialize.add_argument("--requests", type=int, default=5000)
+    serialize.add_argument("--rounds", type=int, default=5)
+    serialize.add_argument("--warmup", type=int, default=500)
+    serialize.set_defaults(func=bench_serialize)
+
+    http2 = subparsers.add_parser(
+        "http2", help="Page-complete time over HTTP/1.1 and HTTP/2"
+    )
+    http2.add_argument("--page", default="cr21-operator.html")
+    http2.add_argument(
+        "--connections",
+        type=int,
+        default=6,
+        help="Parallel HTTP/1.1 connections, as a browser opens (default: 6)",
+    )
+    http2.add_argument("--iterations", type=int, default=300)
+    http2.add_argument("--warmup", type=int, default=20)
+    http2.set_defaults(func=bench_http2)
+
+    args = parser.parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
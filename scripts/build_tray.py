@@ -147,6 +147,11 @@ def main():
         print("Error: PyInstaller not available. Install with: uv add pyinstaller")
         sys.exit(1)
 
+    # Pack the site so the executable bundles one file instead of pages/
+    if not run_command(["uv", "run", "python", "scripts/pack_site.py"]):
+        print("Error: Could not pack the site")
+        sys.exit(1)
+
     # Build for current platform
     current_platform = platform.system().lower()
 
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Pack the NIA Engineering Portal site into one archive for serve.py.
+Writes every file under pages/ (and index.html) into a single indexed file,
+with gzip (and brotli when installed) variants of text assets and their
+ETags stored inline, so ``serve.py --site-pack`` can serve it through mmap
+and the tray app build can bundle one file instead of the pages/ tree.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+import serve
+from precompress import TEXT_EXTENSIONS, brotli, encoders
+
+DEFAULT_OUTPUT = "build/site.pack"
+# precompress.py variant suffix -> HTTP content coding
+CODINGS = {suffix: coding for coding, suffix in serve.PRECOMPRESSED_SUFFIXES}
+
+
+def iter_files(roots: list[Path]):
+    """Yield every file under the given files or directories.
+
+    Precompressed siblings left by precompress.py are skipped: the pack
+    holds its own variants. A ``.gz`` or ``.br`` file without an
+    uncompressed sibling is a real archive and is packed as is.
+    """
+    for root in roots:
+        if root.is_file():
+            candidates = [root]
+        else:
+            candidates = sorted(p for p in root.rglob("*") if p.is_file())
+        for path in candidates:
+            if path.name.endswith(serve.VARIANT_SUFFIXES):
+                if path.with_suffix("").is_file():
+                    continue
+            yield path
+
+
+def pack_entry(path: Path, root: Path) -> tuple[str, int, dict]:
+    """Read one file and compress it if it is a text asset.
+
+    A variant is only kept when it is smaller than the original, as with
+    precompress.py.
+
+    Args:
+        path: File to pack
+        root: Site root the URL path is relative to
+
+    Returns:
+        Tuple of (URL path, mtime_ns, bodies by content coding)
+    """
+    data = path.read_bytes()
+    bodies = {None: data}
+    if path.suffix.lower() in TEXT_EXTENSIONS:
+        for suffix, compress in encoders():
+            compressed = compress(data)
+            if len(compressed) < len(data):
+                bodies[CODINGS[suffix]] = compressed
+    url = "/" + path.relative_to(root).as_posix()
+    return url, path.stat().st_mtime_ns, bodies
+
+
+def main(argv=None) -> int:
+    """Pack portal assets."""
+    parser = argparse.ArgumentParser(description="Pack portal assets")
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        default=["pages", "index.html"],
+        help="Files or directories to pack (default: pages index.html)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=DEFAULT_OUTPUT,
+        help=f"Pack file to write, relative to the root (default: {DEFAULT_OUTPUT})",
+    )
+    parser.add_argument(
+        "--root",
+        type=Path,
+        default=Path(__file__).parent.parent,
+        help="Site root that URL paths start from (default: project root)",
+    )
+    args = parser.parse_args(argv)
+
+    root = args.root.resolve()
+    roots = [root / p for p in args.paths]
+    missing = [str(p) for p in roots if not p.exists()]
+    if missing:
+        print(f"❌ Not found: {', '.join(missing)}")
+        return 1
+
+    print("📦 Packing portal assets...")
+    if brotli is None:
+        print("  ⚠️  brotli not installed, packing .gz variants only")
+
+    entries = [pack_entry(path, root) for path in iter_files(roots)]
+    output = root / args.output
+    output.parent.mkdir(parents=True, exist_ok=True)
+    serve.write_site_pack(str(output), entries)
+
+    variants = sum(len(bodies) - 1 for _, _, bodies in entries)
+    size = output.stat().st_size
+    print(f"✅ Packed {len(entries)} files and {variants} variants")
+    print(f"  • {output} ({size // 1024} KiB)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
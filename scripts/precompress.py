@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Precompress text assets for the NIA Engineering Portal server.
+Writes .gz (and .br when the brotli package is installed) siblings next to
+every HTML/CSS/JS file so serve.py can send them without compressing on
+each request.
+"""
+
+import argparse
+import gzip
+import os
+import sys
+from collections.abc import Callable
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # Optional: .br variants are skipped without it
+    brotli = None
+
+TEXT_EXTENSIONS = {
+    ".css",
+    ".html",
+    ".js",
+    ".json",
+    ".map",
+    ".md",
+    ".svg",
+    ".txt",
+    ".webmanifest",
+    ".xml",
+}
+
+
+def compress_gzip(data: bytes) -> bytes:
+    """Compress with gzip at maximum level and a fixed header timestamp."""
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def compress_brotli(data: bytes) -> bytes:
+    """Compress with brotli at maximum quality in text mode."""
+    return brotli.compress(data, mode=brotli.MODE_TEXT, quality=11)
+
+
+def encoders() -> list[tuple[str, Callable[[bytes], bytes]]]:
+    """Return the (suffix, compress function) pairs available here."""
+    available = [(".gz", compress_gzip)]
+    if brotli is not None:
+        available.append((".br", compress_brotli))
+    return available
+
+
+def precompress_file(path: Path, force: bool = False) -> list[Path]:
+    """Write compressed siblings for one file.
+
+    A variant is only kept when it is smaller than the original; otherwise
+    any existing sibling is removed so the server falls back to identity.
+
+    Args:
+        path: File to compress
+        force: Rewrite variants even if they are newer than the source
+
+    Returns:
+        List of variant files written
+    """
+    data = path.read_bytes()
+    source_mtime = path.stat().st_mtime_ns
+    written = []
+
+    for suffix, compress in encoders():
+        target = path.with_name(path.name + suffix)
+        if not force and target.exists() and target.stat().st_mtime_ns >= source_mtime:
+            continue
+
+        compressed = compress(data)
+        if len(compressed) >= len(data):
+            target.unlink(missing_ok=True)
+            continue
+
+        target.write_bytes(compressed)
+        # Match the source mtime so serve.py can tell the variant is fresh
+        os.utime(target, ns=(source_mtime, source_mtime))
+        written.append(target)
+
+    return written
+
+
+def iter_assets(roots: list[Path]):
+    """Yield every text asset under the given files or directories."""
+    for root in roots:
+        if root.is_file():
+            candidates = [root]
+        else:
+            candidates = sorted(p for p in root.rglob("*") if p.is_file())
+        for path in candidates:
+            if path.suffix.lower() in TEXT_EXTENSIONS:
+                yield path
+
+
+def main(argv=None) -> int:
+    """Precompress portal assets."""
+    parser = argparse.ArgumentParser(description="Precompress portal assets")
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        default=["pages", "index.html"],
+        help="Files or directories to compress (default: pages index.html)",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Rewrite up-to-date variants"
+    )
+    args = parser.parse_args(argv)
+
+    project_root = Path(__file__).parent.parent
+    roots = [project_root / p for p in args.paths]
+    missing = [str(p) for p in roots if not p.exists()]
+    if missing:
+        print(f"❌ Not found: {', '.join(missing)}")
+        return 1
+
+    print("🗜️  Precompressing portal assets...")
+    if brotli is None:
+        print("  ⚠️  brotli not installed, writing .gz variants only")
+
+    files = 0
+    variants = 0
+    for path in iter_assets(roots):
+        written = precompress_file(path, force=args.force)
+        files += 1
+        variants += len(written)
+        for target in written:
+            print(f"  ✅ {target.relative_to(project_root)}")
+
+    print(f"✅ Checked {files} files, wrote {variants} variants")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,91 +2,5849 @@
 """
 Simple HTTP server for NIA Engineering Portal static site.
 Serves static files and handles root redirect to pages/ directory.
+
+Engines:
+    simple   - single-threaded ``socketserver.TCPServer`` (default)
+    threaded - fixed-size worker pool with a bounded accept queue
+    async    - single asyncio event loop (uses uvloop when installed)
+
+Any engine can run in several processes with ``--workers N`` and serve
+HTTPS with ``--tls-cert``; the async engine also speaks HTTP/2 (``--http2``).
 """
 
-import http.server
-import os
-import socketserver
-import sys
-from urllib.parse import urlparse
+import argparse
+import asyncio
+import bisect
+import datetime
+import email.utils
+import hashlib
+import heapq
+import http.server
+import io
+import ipaddress
+import itertools
+import json
+import marshal
+import mimetypes
+import mmap
+import os
+import posixpath
+import queue
+import random
+import signal
+import socket
+import socketserver
+import ssl
+import stat
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+from html.parser import HTMLParser
+from http import HTTPStatus
+from typing import NamedTuple
+from urllib.parse import parse_qs, unquote, urldefrag, urljoin, urlparse
+
+try:
+    import uvloop
+except ImportError:  # Optional: faster event loop for the async engine
+    uvloop = None
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.errors
+    import h2.events
+    import h2.exceptions
+except ImportError:  # Optional: --http2 needs it
+    h2 = None
+
+try:
+    import resource
+except ImportError:  # Not on Windows: peak RSS is reported as null there
+    resource = None
+
+ENGINES = ("simple", "threaded", "async")
+
+# Idle keep-alive connections hold a worker thread in the thread-based
+# engines, so they are closed quickly; the event loop can afford to keep
+# wall displays connected for minutes.
+DEFAULT_IDLE_TIMEOUTS = {"simple": 5.0, "threaded": 5.0, "async": 300.0}
+
+ROUTE_FILE = "file"
+ROUTE_REDIRECT = "redirect"
+ROUTE_NOT_FOUND = "not_found"
+
+
+# Precompressed siblings written by scripts/precompress.py, in preference order
+PRECOMPRESSED_SUFFIXES = (("br", ".br"), ("gzip", ".gz"))
+VARIANT_SUFFIXES = tuple(suffix for _, suffix in PRECOMPRESSED_SUFFIXES)
+
+# Site packs written by scripts/pack_site.py: a header (magic, file count,
+# bytes of path names), one index record per file sorted by URL path, the
+# names, then the bodies. A record holds the name's offset and length, the
+# mtime and, for identity and each precompressed coding, the body's offset,
+# length (-1 when absent) and ETag digest.
+PACK_MAGIC = b"NIAPACK1"
+PACK_HEADER = struct.Struct("<8sII")
+PACK_ENCODINGS = (None, *(encoding for encoding, _ in PRECOMPRESSED_SUFFIXES))
+PACK_RECORD = struct.Struct("<IIq" + "Qq16s" * len(PACK_ENCODINGS))
+
+ACCESS_LOG_FORMATS = ("combined", "json")
+
+METRICS_PATH = "/metrics"
+HEALTH_PATH = "/healthz"
+READY_PATH = "/readyz"
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+TEXT_CONTENT_TYPE = "text/plain; charset=utf-8"
+# Diagnostics, only answered to clients on the loopback interface
+ADMIN_PREFIX = "/admin/"
+PROFILE_PATH = "/admin/profile"
+MEMORY_PATH = "/admin/memory"
+PROFILE_FORMATS = ("collapsed", "pstats")
+# Request latency histogram bounds in seconds
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+# Client connection preface that starts HTTP/2 with prior knowledge (h2c)
+HTTP2_PREFACE = b"PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n"
+
+# TLS 1.2 cipher policy: forward-secret AEAD suites only (TLS 1.3 suites
+# are all AEAD and are not configurable through the ssl module)
+DEFAULT_TLS_CIPHERS = "ECDHE+AESGCM:ECDHE+CHACHA20"
+TLS_VERSIONS = {"1.2": ssl.TLSVersion.TLSv1_2, "1.3": ssl.TLSVersion.TLSv1_3}
+
+# First descriptor passed by systemd socket activation (sd_listen_fds)
+SD_LISTEN_FDS_START = 3
+
+# Methods the server answers, for the Allow header of OPTIONS responses
+ALLOWED_METHODS = "GET, HEAD, OPTIONS"
+# Metrics route label for OPTIONS requests
+PREFLIGHT_LABEL = "preflight"
+CONNECTION_CLOSE = (("Connection", "close"),)
+CONNECTION_KEEP_ALIVE = (("Connection", "keep-alive"),)
+
+# Request classes of the threaded engine's scheduler, most urgent first
+PRIORITY_CLASSES = ("navigation", "critical", "precache", "api")
+PRIORITY_NAVIGATION, PRIORITY_CRITICAL, PRIORITY_PRECACHE, PRIORITY_API = range(
+    len(PRIORITY_CLASSES)
+)
+# Sec-Fetch-Dest values of a page the user navigated to
+NAVIGATION_DESTS = frozenset({"document", "frame", "iframe"})
+PRELOAD_HINTS = ("link", "early", "off")
+# Metrics label of the server's own root when virtual hosts are configured
+DEFAULT_SITE = "default"
+# A virtual host name is both a URL path prefix and a host name label
+SITE_NAME_CHARS = frozenset("abcdefghijklmnopqrstuvwxyz0123456789-")
+RESERVED_SITE_NAMES = frozenset({DEFAULT_SITE, "pages", "admin", "metrics"})
+
+
+def translate_path(path: str, root: str) -> str:
+    """Translate a /-separated URL path to a file path under root.
+
+    Mirrors ``SimpleHTTPRequestHandler.translate_path``: components that
+    would escape the root (``..``, drive names) are dropped.
+
+    Args:
+        path: URL path (query string allowed)
+        root: Site root directory
+
+    Returns:
+        Filesystem path
+    """
+    path = path.split("?", 1)[0].split("#", 1)[0]
+    trailing_slash = path.rstrip().endswith("/")
+    path = posixpath.normpath(unquote(path))
+    result = root
+    for word in filter(None, path.split("/")):
+        if os.path.dirname(word) or word in (os.curdir, os.pardir):
+            continue
+        result = os.path.join(result, word)
+    if trailing_slash:
+        result += "/"
+    return result
+
+
+def redirect_body(location: str) -> bytes:
+    """Return the HTML body of a redirect, linking to the same target."""
+    return f'Redirecting to <a href="{location}">NIA Engineering Portal</a>...'.encode()
+
+
+def guess_content_type(path: str) -> str:
+    """Return the Content-Type for a file path."""
+    content_type, encoding = mimetypes.guess_type(path)
+    if encoding == "gzip":
+        # A raw .gz file is an archive, not a compressed text/html body
+        return "application/gzip"
+    if encoding is not None:
+        return "application/octet-stream"
+    return content_type or "application/octet-stream"
+
+
+def select_encoding(accept_encoding: str | None, available) -> str | None:
+    """Pick the best content-coding the client accepts.
+
+    Args:
+        accept_encoding: Accept-Encoding header value, if present
+        available: Codings that have a precompressed variant
+
+    Returns:
+        Chosen coding (e.g. ``"br"``), or None for the identity body
+    """
+    if not accept_encoding or not available:
+        return None
+
+    weights = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        weight = 1.0
+        params = params.strip().lower()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        if coding:
+            weights[coding] = weight
+
+    wildcard = weights.get("*", 0.0)
+    best, best_weight = None, 0.0
+    for coding, _ in PRECOMPRESSED_SUFFIXES:
+        if coding not in available:
+            continue
+        weight = weights.get(coding, wildcard)
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def open_representation(path: str, accept_encoding: str | None):
+    """Open a file from disk, or the precompressed sibling the client prefers.
+
+    This is the uncached counterpart of ``CacheEntry.negotiate``: only
+    siblings at least as new as the file are considered.
+
+    Args:
+        path: Filesystem path of the requested file
+        accept_encoding: Accept-Encoding header value, if present
+
+    Returns:
+        Tuple of (open file to send, ``os.stat_result`` of the requested
+        file, content coding or None for identity, whether the file has
+        precompressed variants and so needs ``Vary: Accept-Encoding``)
+
+    Raises:
+        OSError: If the requested file cannot be opened
+    """
+    f = open(path, "rb")
+    try:
+        st = os.fstat(f.fileno())
+        variants = {}
+        for encoding, suffix in PRECOMPRESSED_SUFFIXES:
+            try:
+                if os.stat(path + suffix).st_mtime_ns >= st.st_mtime_ns:
+                    variants[encoding] = path + suffix
+            except OSError:
+                continue
+        encoding = select_encoding(accept_encoding, variants)
+        if encoding is not None:
+            try:
+                variant = open(variants[encoding], "rb")
+            except OSError:
+                encoding = None
+            else:
+                f.close()
+                f = variant
+    except BaseException:
+        f.close()
+        raise
+    return f, st, encoding, bool(variants)
+
+
+def file_response_headers(
+    path: str,
+    f,
+    st: os.stat_result,
+    encoding: str | None,
+    vary: bool,
+    if_modified_since: str | None,
+) -> tuple[HTTPStatus, list[tuple[str, str]]]:
+    """Return the status and headers for a file opened by open_representation.
+
+    Files read from disk have no ETag, so If-Modified-Since alone decides a
+    304; callers pass None when the request also has If-None-Match, which
+    takes precedence.
+
+    Args:
+        path: Filesystem path of the requested file
+        f: Open file to send (the requested file or its sibling)
+        st: ``os.stat_result`` of the requested file
+        encoding: Content coding of ``f``, or None for identity
+        vary: Whether the file has precompressed variants
+        if_modified_since: If-Modified-Since header value, if present
+
+    Returns:
+        Tuple of (200 or 304 status, response headers)
+    """
+    validators = [("Last-Modified", email.utils.formatdate(st.st_mtime, usegmt=True))]
+    if vary:
+        validators.append(("Vary", "Accept-Encoding"))
+    if is_not_modified(if_modified_since, st.st_mtime):
+        return HTTPStatus.NOT_MODIFIED, validators
+    headers = [
+        ("Content-Type", guess_content_type(path)),
+        ("Content-Length", str(os.fstat(f.fileno()).st_size)),
+        *validators,
+    ]
+    if encoding is not None:
+        headers.append(("Content-Encoding", encoding))
+    return HTTPStatus.OK, headers
+
+
+def http_date() -> str:
+    """Return the current time formatted for the Date header.
+
+    The string is recomputed at most once per second.
+    """
+    global _http_date
+    now = int(time.time())
+    cached = _http_date
+    if cached[0] != now:
+        cached = _http_date = (now, email.utils.formatdate(now, usegmt=True))
+    return cached[1]
+
+
+_http_date = (0, "")
+
+
+class SerializedResponse:
+    """An HTTP/1.1 response head serialized as bytes, plus its body.
+
+    Only the status line and headers are copied; ``body`` references the
+    cached file body or variant, so a response costs a few hundred bytes
+    however large the file is.
+    """
+
+    __slots__ = ("status", "date", "head", "body")
+
+    def __init__(
+        self, status: HTTPStatus, date: str, head: bytes, body: bytes | memoryview
+    ):
+        self.status = status
+        self.date = date
+        self.head = head
+        self.body = body
+
+    def buffers(self, head_only: bool = False) -> tuple[bytes | memoryview, ...]:
+        """Return the buffers to send, without the body for HEAD requests."""
+        if head_only or not self.body:
+            return (self.head,)
+        return (self.head, self.body)
+
+    def with_header(
+        self, name: str, value: str, head_only: bool = False
+    ) -> tuple[bytes | memoryview, ...]:
+        """Return the buffers with one more header, for per-request values."""
+        end = len(self.head) - 2
+        line = f"{name}: {value}\r\n".encode("latin-1")
+        head = self.head[:end] + line + self.head[end:]
+        if head_only or not self.body:
+            return (head,)
+        return (head, self.body)
+
+
+def send_buffers(sock: socket.socket, buffers: tuple[bytes | memoryview, ...]) -> None:
+    """Send several buffers without joining them, like ``sendall`` for one.
+
+    Plain sockets get the buffers in as few ``sendmsg`` calls as the kernel
+    allows; TLS sockets and platforms without ``sendmsg`` fall back to one
+    ``sendall`` per buffer.
+
+    Args:
+        sock: Connected socket
+        buffers: Data to send, in order
+    """
+    if isinstance(sock, ssl.SSLSocket) or not hasattr(sock, "sendmsg"):
+        for buffer in buffers:
+            sock.sendall(buffer)
+        return
+    views = [memoryview(buffer) for buffer in buffers]
+    while views:
+        sent = sock.sendmsg(views)
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if sent:
+            views[0] = views[0][sent:]
+
+
+def connection_headers(version: str, keep_alive: bool) -> tuple[tuple[str, str], ...]:
+    """Return the Connection header a pre-serialized response needs.
+
+    Serialized responses always carry an HTTP/1.1 status line, so closing
+    is announced explicitly, and an HTTP/1.0 client that asked for
+    keep-alive is told it got it.
+
+    Args:
+        version: Request HTTP version
+        keep_alive: Whether the connection stays open after the response
+
+    Returns:
+        Headers to append to the response's own
+    """
+    if not keep_alive:
+        return CONNECTION_CLOSE
+    if version != "HTTP/1.1":
+        return CONNECTION_KEEP_ALIVE
+    return ()
+
+
+def serialize_response(
+    status: HTTPStatus,
+    headers: list[tuple[str, str]],
+    body: bytes,
+    server: str,
+    date: str | None = None,
+) -> SerializedResponse:
+    """Serialize an HTTP/1.1 response head, keeping a reference to the body.
+
+    Args:
+        status: Response status
+        headers: Response headers
+        body: Response body
+        server: Server header value
+        date: Date header value (defaults to now)
+
+    Returns:
+        Serialized response
+    """
+    date = date or http_date()
+    lines = [
+        f"HTTP/1.1 {status.value} {status.phrase}",
+        f"Server: {server}",
+        f"Date: {date}",
+    ]
+    lines.extend(f"{name}: {value}" for name, value in headers)
+    head = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+    return SerializedResponse(status, date, head, body)
+
+
+class CorsPolicy:
+    """Which cross-origin pages may read the portal's responses.
+
+    With any origin allowed, every response carries
+    ``Access-Control-Allow-Origin: *``, so a copy cached from a same-origin
+    load also satisfies a cross-origin one. With a list of origins, every
+    response carries ``Vary: Origin``. The header tuples are built once, so a
+    request costs one dictionary lookup. OPTIONS preflights are answered
+    from a response serialized once per allowed origin and second, without
+    touching the filesystem, and ``Access-Control-Max-Age`` lets browsers
+    skip repeating them.
+    """
+
+    def __init__(
+        self,
+        origins=("*",),
+        methods=("GET", "HEAD"),
+        headers=("Content-Type",),
+        max_age: int = 7200,
+    ):
+        """Initialize the policy.
+
+        Args:
+            origins: Allowed origins such as ``https://host:port``, or
+                ``*`` for any; empty to send no CORS headers at all
+            methods: Methods cross-origin requests may use
+            headers: Request headers cross-origin requests may send
+            max_age: Seconds browsers may cache a preflight result
+        """
+        self.origins = frozenset(origins)
+        self.any_origin = "*" in self.origins
+        self.methods = tuple(methods)
+        self.headers = tuple(headers)
+        self.max_age = max_age
+
+        if self.any_origin:
+            self._allowed = {}
+            self._any = (("Access-Control-Allow-Origin", "*"),)
+            self._denied = ()
+        else:
+            self._allowed = {
+                origin: (("Access-Control-Allow-Origin", origin), ("Vary", "Origin"))
+                for origin in self.origins
+            }
+            # The answer depends on Origin, so shared caches must key on it
+            self._denied = (("Vary", "Origin"),) if self.origins else ()
+        self._preflight = (
+            ("Access-Control-Allow-Methods", ", ".join(self.methods)),
+            ("Access-Control-Allow-Headers", ", ".join(self.headers)),
+            ("Access-Control-Max-Age", str(max_age)),
+        )
+        self._responses: dict[tuple, SerializedResponse] = {}
+
+    def response_headers(self, origin: str | None) -> tuple[tuple[str, str], ...]:
+        """Return the CORS headers for a response to a request from origin.
+
+        Args:
+            origin: Origin request header value, if present
+
+        Returns:
+            Header (name, value) pairs; the same tuple object for every
+            request from an equivalent origin, so it can key a cache
+        """
+        if self.any_origin:
+            return self._any
+        return self._allowed.get(origin, self._denied)
+
+    def preflight_headers(self, origin: str | None) -> tuple[tuple[str, str], ...]:
+        """Return the headers of an OPTIONS response, after the CORS ones.
+
+        Args:
+            origin: Origin request header value, if present
+
+        Returns:
+            ``Allow`` plus the preflight grants when the origin is allowed
+        """
+        allowed = origin is not None and (self.any_origin or origin in self.origins)
+        if allowed:
+            return (("Allow", ALLOWED_METHODS),) + self._preflight
+        return (("Allow", ALLOWED_METHODS),)
+
+    def preflight(
+        self,
+        origin: str | None,
+        server: str,
+        connection: tuple[tuple[str, str], ...] = (),
+    ) -> SerializedResponse:
+        """Return the serialized ``204`` answer to an OPTIONS request.
+
+        Args:
+            origin: Origin request header value, if present
+            server: Server header value
+            connection: Headers from ``connection_headers``
+
+        Returns:
+            Serialized response
+        """
+        cors = self.response_headers(origin)
+        # Only requests with an Origin get the preflight grants
+        key = (cors, origin is None, server, connection)
+        date = http_date()
+        response = self._responses.get(key)
+        if response is None or response.date != date:
+            headers = list(cors + self.preflight_headers(origin) + connection)
+            response = serialize_response(
+                HTTPStatus.NO_CONTENT, headers, b"", server, date
+            )
+            self._responses[key] = response
+        return response
+
+    def memory(self) -> dict[str, int]:
+        """Return the number and size of pre-serialized preflight responses."""
+        responses = list(self._responses.values())
+        return {
+            "responses": len(responses),
+            "bytes": sum(len(response.head) for response in responses),
+        }
+
+
+class Route(NamedTuple):
+    """Result of resolving a request path.
+
+    ``label`` names the route in metrics: ``/pages/`` for top-level pages,
+    ``/pages/<dir>/`` for files in a subdirectory, ``other`` for files
+    outside ``pages/`` and ``not_found`` for misses.
+    """
+
+    kind: str
+    target: str
+    fs_path: str | None = None
+    label: str = "other"
+
+
+REDIRECT_ROUTE = Route(ROUTE_REDIRECT, "/pages/", label="/")
+
+
+class RouteTable:
+    """Precomputed map of request paths to files, redirects and fallbacks.
+
+    Every file under ``pages/`` is indexed at startup, so resolving a portal
+    URL is a dictionary lookup: ``/`` redirects to ``/pages/``, known files
+    map straight to their path on disk and unknown ``/pages/`` URLs map to
+    the ``pages/index.html`` fallback. The index is rebuilt when a watched
+    directory's mtime changes (checked at most once per
+    ``refresh_interval``).
+
+    Paths outside ``pages/`` are looked up on disk; misses are remembered
+    in a bounded negative cache for ``negative_ttl`` seconds so probe and
+    scanner traffic for nonexistent URLs costs no syscalls.
+    """
+
+    def __init__(
+        self,
+        root: str | None = None,
+        refresh_interval: float = 1.0,
+        negative_ttl: float = 30.0,
+        negative_cache_size: int = 4096,
+    ):
+        """Initialize and build the route table.
+
+        Args:
+            root: Site root directory (defaults to the working directory)
+            refresh_interval: Seconds between checks for changed directories
+            negative_ttl: Seconds a missing path is remembered
+            negative_cache_size: Maximum number of remembered missing paths
+        """
+        self.root = os.path.abspath(root or os.getcwd())
+        self.refresh_interval = refresh_interval
+        self.negative_ttl = negative_ttl
+        self.negative_cache_size = negative_cache_size
+        self.rebuilds = 0
+        self.negative_hits = 0
+        self._routes: dict[str, Route] = {}
+        self._fallback = Route(ROUTE_NOT_FOUND, "/pages/", label="not_found")
+        self._dir_mtimes: dict[str, int] = {}
+        self._missing: OrderedDict[str, float] = OrderedDict()
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.rebuild()
+
+    def resolve(self, path: str) -> Route:
+        """Resolve a URL path (without query string) to a route.
+
+        Args:
+            path: URL path
+
+        Returns:
+            Route to serve
+        """
+        if path == "/" or path == "":
+            return REDIRECT_ROUTE
+
+        self._maybe_refresh()
+        route = self._routes.get(path)
+        if route is not None:
+            return route
+        if path.startswith("/pages/"):
+            decoded = unquote(path)
+            return self._routes.get(decoded, self._fallback)
+        return self._resolve_outside_pages(path)
+
+    def rebuild(self) -> None:
+        """Re-index pages/ and reset the negative cache."""
+        pages_dir = os.path.join(self.root, "pages")
+        routes = {}
+        dir_mtimes = {self.root: _mtime_ns(self.root)}
+        for dirpath, dirnames, filenames in os.walk(pages_dir):
+            dirnames.sort()
+            dir_mtimes[dirpath] = _mtime_ns(dirpath)
+            for filename in filenames:
+                fs_path = os.path.join(dirpath, filename)
+                relative = os.path.relpath(fs_path, pages_dir).replace(os.sep, "/")
+                url = f"/pages/{relative}"
+                routes[url] = Route(ROUTE_FILE, url, fs_path, _route_label(url))
+
+        index = routes.get("/pages/index.html")
+        if index is not None:
+            routes["/pages/"] = index
+            fallback = index
+        else:
+            fallback = Route(ROUTE_NOT_FOUND, "/pages/", label="not_found")
+
+        with self._lock:
+            self._routes = routes
+            self._fallback = fallback
+            self._dir_mtimes = dir_mtimes
+            self._missing.clear()
+            self._checked = time.monotonic()
+            self.rebuilds += 1
+
+    def stats(self) -> dict[str, int]:
+        """Return route table counters.
+
+        Returns:
+            Dictionary of counter name to value
+        """
+        return {
+            "routes": len(self._routes),
+            "negative_entries": len(self._missing),
+            "negative_hits": self.negative_hits,
+            "rebuilds": self.rebuilds,
+        }
+
+    def memory(self) -> dict[str, int]:
+        """Return the table sizes and their approximate footprint in bytes."""
+        routes = self._routes
+        with self._lock:
+            missing = dict(self._missing)
+        return {
+            "routes": len(routes),
+            "negative_entries": len(missing),
+            "approx_bytes": _approx_size(routes) + _approx_size(missing),
+        }
+
+    def _maybe_refresh(self) -> None:
+        """Rebuild if a watched directory changed since the last check."""
+        now = time.monotonic()
+        if now - self._checked < self.refresh_interval:
+            return
+        with self._lock:
+            if now - self._checked < self.refresh_interval:
+                return
+            self._checked = now
+            dir_mtimes = self._dir_mtimes
+        if any(_mtime_ns(path) != mtime for path, mtime in dir_mtimes.items()):
+            self.rebuild()
+
+    def _resolve_outside_pages(self, path: str) -> Route:
+        """Resolve a path outside pages/, consulting the negative cache."""
+        now = time.monotonic()
+        with self._lock:
+            expires = self._missing.get(path)
+            if expires is not None:
+                if expires > now:
+                    self.negative_hits += 1
+                    return Route(ROUTE_NOT_FOUND, path, label="not_found")
+                del self._missing[path]
+
+        if os.path.exists(translate_path(path, self.root)):
+            return Route(ROUTE_FILE, path)
+
+        with self._lock:
+            self._missing[path] = now + self.negative_ttl
+            self._missing.move_to_end(path)
+            while len(self._missing) > self.negative_cache_size:
+                self._missing.popitem(last=False)
+        return Route(ROUTE_NOT_FOUND, path, label="not_found")
+
+
+def _approx_size(mapping: dict) -> int:
+    """Estimate a dictionary's memory from its own and its items' sizes."""
+    size = sys.getsizeof(mapping)
+    for key, value in mapping.items():
+        size += sys.getsizeof(key) + sys.getsizeof(value)
+        if isinstance(value, tuple):
+            size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
+def _mtime_ns(path: str) -> int:
+    """Return a path's mtime in nanoseconds, or -1 if it is missing."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return -1
+
+
+class CacheEntry:
+    """An in-memory copy of one file and its precompressed variants.
+
+    The file contents never change once loaded. ``responses`` holds the
+    serialized response heads built by ``SiteCache.response``, keyed by
+    representation, and is refreshed when the Date header changes.
+    """
+
+    __slots__ = (
+        "path",
+        "body",
+        "content_type",
+        "mtime_ns",
+        "size",
+        "variants",
+        "etag",
+        "variant_etags",
+        "nbytes",
+        "checked",
+        "responses",
+    )
+
+    def __init__(
+        self,
+        path: str,
+        body: bytes,
+        content_type: str,
+        mtime_ns: int,
+        variants: dict[str, bytes] | None = None,
+        etag: str | None = None,
+        variant_etags: dict[str, str] | None = None,
+    ):
+        self.path = path
+        self.body = body
+        self.content_type = content_type
+        self.mtime_ns = mtime_ns
+        self.size = len(body)
+        self.variants = variants or {}
+        # Strong validators, one per representation, hashed once at load time
+        # unless they were stored with the file (site packs)
+        self.etag = etag or make_etag(body)
+        self.variant_etags = variant_etags or {
+            encoding: make_etag(data) for encoding, data in self.variants.items()
+        }
+        self.nbytes = self.size + sum(len(v) for v in self.variants.values())
+        self.checked = time.monotonic()
+        self.responses: dict[tuple, SerializedResponse] = {}
+
+    @property
+    def mtime(self) -> float:
+        """Modification time in seconds since the epoch."""
+        return self.mtime_ns / 1e9
+
+    @property
+    def last_modified(self) -> str:
+        """Modification time formatted for the Last-Modified header."""
+        return email.utils.formatdate(self.mtime_ns // 1_000_000_000, usegmt=True)
+
+    def representation(
+        self, accept_encoding: str | None
+    ) -> tuple[bytes, list[tuple[str, str]]]:
+        """Choose the body to send for a request's Accept-Encoding.
+
+        Args:
+            accept_encoding: Accept-Encoding header value, if present
+
+        Returns:
+            Tuple of (body, encoding-related response headers)
+        """
+        if not self.variants:
+            return self.body, []
+        headers = [("Vary", "Accept-Encoding")]
+        encoding = select_encoding(accept_encoding, self.variants)
+        if encoding is None:
+            return self.body, headers
+        headers.append(("Content-Encoding", encoding))
+        return self.variants[encoding], headers
+
+    def respond(
+        self,
+        accept_encoding: str | None = None,
+        if_none_match: str | None = None,
+        if_modified_since: str | None = None,
+    ) -> tuple[HTTPStatus, list[tuple[str, str]], bytes]:
+        """Build the status, headers and body for a GET of this file.
+
+        Conditional requests are answered from the precomputed validators;
+        a 304 never touches the body. If-None-Match takes precedence over
+        If-Modified-Since, as RFC 9110 requires.
+
+        Args:
+            accept_encoding: Accept-Encoding header value, if present
+            if_none_match: If-None-Match header value, if present
+            if_modified_since: If-Modified-Since header value, if present
+
+        Returns:
+            Tuple of (status, response headers, body)
+        """
+        return self.build(
+            *self.negotiate(accept_encoding, if_none_match, if_modified_since)
+        )
+
+    def negotiate(
+        self,
+        accept_encoding: str | None = None,
+        if_none_match: str | None = None,
+        if_modified_since: str | None = None,
+    ) -> tuple[str | None, bool]:
+        """Pick the representation and decide whether it is not modified.
+
+        Args:
+            accept_encoding: Accept-Encoding header value, if present
+            if_none_match: If-None-Match header value, if present
+            if_modified_since: If-Modified-Since header value, if present
+
+        Returns:
+            Tuple of (content coding or None for identity, not modified)
+        """
+        encoding = None
+        if self.variants:
+            encoding = select_encoding(accept_encoding, self.variants)
+        if if_none_match is not None:
+            etag = self.variant_etags[encoding] if encoding else self.etag
+            return encoding, etag_matches(if_none_match, etag)
+        return encoding, is_not_modified(if_modified_since, self.mtime)
+
+    def build(
+        self, encoding: str | None, not_modified: bool
+    ) -> tuple[HTTPStatus, list[tuple[str, str]], bytes]:
+        """Build the response for a negotiated representation.
+
+        Args:
+            encoding: Content coding, or None for identity
+            not_modified: Whether to answer 304 Not Modified
+
+        Returns:
+            Tuple of (status, response headers, body)
+        """
+        if encoding is None:
+            body, etag = self.body, self.etag
+        else:
+            body, etag = self.variants[encoding], self.variant_etags[encoding]
+        encoding_headers = [("Vary", "Accept-Encoding")] if self.variants else []
+
+        validators = [("ETag", etag), ("Last-Modified", self.last_modified)]
+        if not_modified:
+            return HTTPStatus.NOT_MODIFIED, validators + encoding_headers, b""
+
+        if encoding is not None:
+            encoding_headers.append(("Content-Encoding", encoding))
+        headers = [
+            ("Content-Type", self.content_type),
+            ("Content-Length", str(len(body))),
+            *validators,
+            *encoding_headers,
+        ]
+        return HTTPStatus.OK, headers, body
+
+
+class SiteCache:
+    """Byte-budgeted LRU cache of site files, revalidated by mtime.
+
+    Entries are revalidated with a single ``stat`` at most once every
+    ``revalidate_interval`` seconds, so a hit normally costs no syscalls at
+    all. When the total size of cached bodies would exceed ``max_bytes`` the
+    least recently used entries are evicted.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 32 * 1024 * 1024,
+        max_entry_bytes: int = 1024 * 1024,
+        revalidate_interval: float = 1.0,
+    ):
+        """Initialize the cache.
+
+        Args:
+            max_bytes: Total byte budget for cached bodies
+            max_entry_bytes: Files larger than this are never cached
+            revalidate_interval: Seconds between mtime checks of an entry
+        """
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.revalidate_interval = revalidate_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.current_bytes = 0
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def preload(self, directory: str) -> int:
+        """Load every file under a directory until the budget is reached.
+
+        Args:
+            directory: Directory to walk
+
+        Returns:
+            Number of files cached
+        """
+        loaded = 0
+        for dirpath, _, filenames in os.walk(directory):
+            for filename in sorted(filenames):
+                if filename.endswith(VARIANT_SUFFIXES):
+                    continue  # Loaded alongside their source file
+                path = os.path.abspath(os.path.join(dirpath, filename))
+                if self.current_bytes >= self.max_bytes:
+                    return loaded
+                if self._load(path) is not None:
+                    loaded += 1
+        return loaded
+
+    def get(self, path: str) -> CacheEntry | None:
+        """Return the cached entry for a file, loading it on a miss.
+
+        Args:
+            path: Filesystem path of the file
+
+        Returns:
+            Cache entry, or None if the file is missing, is not a regular
+            file or is too large to cache
+        """
+        path = os.path.abspath(path)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                self._entries.move_to_end(path)
+                if now - entry.checked < self.revalidate_interval:
+                    self.hits += 1
+                    return entry
+
+        if entry is not None:
+            try:
+                current = os.stat(path).st_mtime_ns
+            except OSError:
+                current = None
+            with self._lock:
+                if current == entry.mtime_ns:
+                    entry.checked = now
+                    self.hits += 1
+                    return entry
+                self.invalidations += 1
+                if self._entries.get(path) is entry:
+                    del self._entries[path]
+                    self.current_bytes -= entry.nbytes
+
+        with self._lock:
+            self.misses += 1
+        return self._load(path)
+
+    def response(
+        self,
+        entry: CacheEntry,
+        server: str,
+        accept_encoding: str | None = None,
+        if_none_match: str | None = None,
+        if_modified_since: str | None = None,
+        extra_headers: tuple[tuple[str, str], ...] = (),
+    ) -> SerializedResponse:
+        """Return the serialized response for a GET of an entry.
+
+        Response heads are serialized once per representation and second
+        (the Date header is the only part that changes) and kept on the
+        entry. They reference the entry's body rather than copying it, so
+        they are not charged against the byte budget.
+
+        Args:
+            entry: Entry returned by ``get``
+            server: Server header value
+            accept_encoding: Accept-Encoding header value, if present
+            if_none_match: If-None-Match header value, if present
+            if_modified_since: If-Modified-Since header value, if present
+            extra_headers: Headers appended to the entry's own, such as
+                ``CorsPolicy.response_headers()``
+
+        Returns:
+            Serialized response
+        """
+        encoding, not_modified = entry.negotiate(
+            accept_encoding, if_none_match, if_modified_since
+        )
+        key = (encoding, not_modified, server, extra_headers)
+        date = http_date()
+        response = entry.responses.get(key)
+        if response is not None and response.date == date:
+            return response
+
+        status, headers, body = entry.build(encoding, not_modified)
+        headers = headers + list(extra_headers)
+        response = serialize_response(status, headers, body, server, date)
+        entry.responses[key] = response
+        return response
+
+    def discard(self, path: str) -> None:
+        """Drop a file from the cache."""
+        with self._lock:
+            entry = self._entries.pop(os.path.abspath(path), None)
+            if entry is not None:
+                self.current_bytes -= entry.nbytes
+
+    def clear(self) -> None:
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict[str, int | float]:
+        """Return cache counters for tuning the byte budget.
+
+        Returns:
+            Dictionary of counter name to value
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def memory(self) -> dict[str, int]:
+        """Return how the cached bytes split between kinds of data.
+
+        Returns:
+            Dictionary with the total and the bytes held in file bodies,
+            precompressed variants and pre-serialized response heads (which
+            are outside the byte budget)
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+            total = self.current_bytes
+        return {
+            "entries": len(entries),
+            "bytes": total,
+            "bodies": sum(entry.size for entry in entries),
+            "variants": sum(
+                len(data) for entry in entries for data in entry.variants.values()
+            ),
+            "responses": sum(
+                len(response.head)
+                for entry in entries
+                for response in list(entry.responses.values())
+            ),
+        }
+
+    def _load(self, path: str) -> CacheEntry | None:
+        """Read a file (and any fresh variants) from disk into the cache."""
+        try:
+            with open(path, "rb") as f:
+                st = os.fstat(f.fileno())
+                if not stat.S_ISREG(st.st_mode) or st.st_size > self.max_entry_bytes:
+                    return None
+                body = f.read()
+        except OSError:
+            return None
+
+        variants = self._load_variants(path, st.st_mtime_ns)
+        entry = CacheEntry(
+            path, body, guess_content_type(path), st.st_mtime_ns, variants
+        )
+        if entry.nbytes > self.max_bytes:
+            return None
+        with self._lock:
+            previous = self._entries.pop(path, None)
+            if previous is not None:
+                self.current_bytes -= previous.nbytes
+            self._entries[path] = entry
+            self.current_bytes += entry.nbytes
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+                self.evictions += 1
+        return entry
+
+    @staticmethod
+    def _load_variants(path: str, mtime_ns: int) -> dict[str, bytes]:
+        """Read precompressed siblings that are at least as new as the file."""
+        variants = {}
+        for encoding, suffix in PRECOMPRESSED_SUFFIXES:
+            try:
+                with open(path + suffix, "rb") as f:
+                    if os.fstat(f.fileno()).st_mtime_ns < mtime_ns:
+                        continue  # Stale: the source changed after the build
+                    variants[encoding] = f.read()
+            except OSError:
+                continue
+        return variants
+
+
+def write_site_pack(path: str, files) -> int:
+    """Write files into a site pack (see ``SitePack`` for the layout).
+
+    The pack is written next to ``path`` and renamed over it, so a running
+    server keeps the mapping of the old one.
+
+    Args:
+        path: Output file
+        files: (URL path, mtime_ns, bodies) tuples, where bodies maps a
+            content coding (None for identity, which is required) to bytes
+
+    Returns:
+        Number of files written
+    """
+    files = sorted(files, key=lambda item: item[0])
+    names = [url.encode("utf-8") for url, _, _ in files]
+    data_offset = PACK_HEADER.size + PACK_RECORD.size * len(files)
+    data_offset += sum(map(len, names))
+    records = []
+    bodies_out = []
+    name_offset = 0
+    for (_, mtime_ns, bodies), name in zip(files, names, strict=True):
+        fields = [name_offset, len(name), mtime_ns]
+        name_offset += len(name)
+        for encoding in PACK_ENCODINGS:
+            body = bodies.get(encoding)
+            if body is None:
+                fields += [0, -1, b""]
+                continue
+            fields += [data_offset, len(body), _content_hash(body)]
+            bodies_out.append(body)
+            data_offset += len(body)
+        records.append(PACK_RECORD.pack(*fields))
+
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(PACK_HEADER.pack(PACK_MAGIC, len(files), name_offset))
+        f.writelines(records)
+        f.writelines(names)
+        f.writelines(bodies_out)
+    os.replace(temporary, path)
+    return len(files)
+
+
+class SitePack:
+    """A packed copy of the site, served from one memory-mapped file.
+
+    ``scripts/pack_site.py`` writes every file under ``pages/`` (and
+    ``index.html``) into one archive: a header, an index of fixed-size
+    records sorted by URL path, the path names, then the bodies. Each record
+    holds the file's mtime and the offset, length and ETag digest of its
+    identity body and precompressed variants.
+
+    The file is mapped once. A lookup is a binary search of the index and
+    a body is a memoryview of the mapping, so serving needs no file opens,
+    stats or hashing, and the page cache holds the only copy of the site
+    (shared by every ``--workers`` process). The pack stands in for both
+    the RouteTable and the SiteCache, with the same routing rules. It is
+    not watched for changes: restart the server to serve a new pack.
+    """
+
+    def __init__(self, path: str):
+        """Map a pack and read its index.
+
+        Args:
+            path: Pack file written by ``write_site_pack``
+
+        Raises:
+            OSError: The file cannot be read
+            ValueError: The file is not a valid pack
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError(f"{path} is not a site pack") from None
+        view = memoryview(self._map)
+        size = len(view)
+        if size < PACK_HEADER.size:
+            raise ValueError(f"{path} is not a site pack")
+        magic, count, names_length = PACK_HEADER.unpack_from(view)
+        names_start = PACK_HEADER.size + PACK_RECORD.size * count
+        if magic != PACK_MAGIC or names_start + names_length > size:
+            raise ValueError(f"{path} is not a site pack")
+
+        self.hits = 0
+        self.misses = 0
+        self._names: list[str] = []
+        self._entries: list[CacheEntry] = []
+        self._routes: list[Route] = []
+        for index in range(count):
+            name_offset, name_length, mtime_ns, *slots = PACK_RECORD.unpack_from(
+                view, PACK_HEADER.size + PACK_RECORD.size * index
+            )
+            start = names_start + name_offset
+            name = bytes(view[start : start + name_length]).decode("utf-8")
+            bodies = {}
+            etags = {}
+            for encoding, offset, length, digest in zip(
+                PACK_ENCODINGS, slots[::3], slots[1::3], slots[2::3], strict=True
+            ):
+                if length < 0:
+                    continue
+                if offset + length > size:
+                    raise ValueError(f"{path} is truncated")
+                bodies[encoding] = view[offset : offset + length]
+                etags[encoding] = _format_etag(digest)
+            identity = etags.pop(None)
+            self._names.append(name)
+            self._entries.append(
+                CacheEntry(
+                    name,
+                    bodies.pop(None),
+                    guess_content_type(name),
+                    mtime_ns,
+                    bodies,
+                    identity,
+                    etags,
+                )
+            )
+            self._routes.append(Route(ROUTE_FILE, name, name, _route_label(name)))
+        if self._names != sorted(self._names):
+            raise ValueError(f"{path} has an unsorted index")
+
+        index = self._find("/pages/index.html")
+        if index is not None:
+            self._fallback = self._routes[index]
+        else:
+            self._fallback = Route(ROUTE_NOT_FOUND, "/pages/", label="not_found")
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, path: str) -> bool:
+        return self._find(path) is not None
+
+    def names(self) -> list[str]:
+        """Return the URL paths in the pack, sorted."""
+        return list(self._names)
+
+    def read(self, path: str) -> memoryview:
+        """Return the identity body of a file in the pack.
+
+        Raises:
+            KeyError: The path is not in the pack
+        """
+        index = self._find(path)
+        if index is None:
+            raise KeyError(path)
+        return self._entries[index].body
+
+    def resolve(self, path: str) -> Route:
+        """Resolve a URL path (without query string) to a route.
+
+        Same rules as ``RouteTable.resolve``: ``/`` redirects, a directory
+        URL serves its ``index.html`` and unknown ``/pages/`` URLs get the
+        ``pages/index.html`` fallback.
+
+        Args:
+            path: URL path
+
+        Returns:
+            Route to serve
+        """
+        if path == "/" or path == "":
+            return REDIRECT_ROUTE
+        if path.endswith("/"):
+            path += "index.html"
+        index = self._find(path)
+        if index is None and "%" in path:
+            index = self._find(unquote(path))
+        if index is not None:
+            return self._routes[index]
+        if path.startswith("/pages/"):
+            return self._fallback
+        return Route(ROUTE_NOT_FOUND, path, label="not_found")
+
+    def get(self, path: str) -> CacheEntry | None:
+        """Return the entry for a URL path resolved by ``resolve``.
+
+        Args:
+            path: URL path of a file in the pack
+
+        Returns:
+            Entry whose bodies are views of the mapping, or None
+        """
+        index = self._find(path)
+        if index is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._entries[index]
+
+    def response(
+        self,
+        entry: CacheEntry,
+        server: str,
+        accept_encoding: str | None = None,
+        if_none_match: str | None = None,
+        if_modified_since: str | None = None,
+        extra_headers: tuple[tuple[str, str], ...] = (),
+    ) -> SerializedResponse:
+        """Return the serialized response for a GET of an entry.
+
+        Same as ``SiteCache.response``, without a byte budget: the pack
+        never evicts.
+        """
+        encoding, not_modified = entry.negotiate(
+            accept_encoding, if_none_match, if_modified_since
+        )
+        key = (encoding, not_modified, server, extra_headers)
+        date = http_date()
+        response = entry.responses.get(key)
+        if response is not None and response.date == date:
+            return response
+        status, headers, body = entry.build(encoding, not_modified)
+        headers = headers + list(extra_headers)
+        response = serialize_response(status, headers, body, server, date)
+        entry.responses[key] = response
+        return response
+
+    def stats(self) -> dict[str, int | float]:
+        """Return counters in the shape of ``SiteCache.stats``."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._names),
+            "bytes": len(self._map),
+            "max_bytes": len(self._map),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": 0,
+            "invalidations": 0,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def memory(self) -> dict[str, int]:
+        """Return the mapped size and the heap held by serialized heads."""
+        return {
+            "entries": len(self._names),
+            "mapped": len(self._map),
+            "responses": sum(
+                len(response.head)
+                for entry in self._entries
+                for response in list(entry.responses.values())
+            ),
+        }
+
+    def _find(self, path: str) -> int | None:
+        """Return the index position of a URL path, or None."""
+        index = bisect.bisect_left(self._names, path)
+        if index < len(self._names) and self._names[index] == path:
+            return index
+        return None
+
+
+def _route_label(url: str) -> str:
+    """Return the metrics label of a URL path, as RouteTable assigns them."""
+    if not url.startswith("/pages/"):
+        return "other"
+    top, _, rest = url[len("/pages/") :].partition("/")
+    return f"/pages/{top}/" if rest else "/pages/"
+
+
+def _content_hash(body: bytes) -> bytes:
+    """Return the content hash an ETag is made from."""
+    return hashlib.blake2b(body, digest_size=16).digest()
+
+
+def _format_etag(digest: bytes) -> str:
+    """Return the strong ETag for a content hash."""
+    return f'"{digest.hex()}"'
+
+
+def make_etag(body: bytes) -> str:
+    """Return a strong ETag derived from a body's content hash."""
+    return _format_etag(_content_hash(body))
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Return True if an If-None-Match header matches an ETag.
+
+    Uses the weak comparison RFC 9110 specifies for If-None-Match, so a
+    ``W/`` prefix on the client's tag is ignored.
+
+    Args:
+        if_none_match: Header value
+        etag: Current strong ETag, including quotes
+
+    Returns:
+        True if the client's copy is current
+    """
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def is_not_modified(if_modified_since: str | None, mtime: float) -> bool:
+    """Return True if an If-Modified-Since header matches a file's mtime.
+
+    Args:
+        if_modified_since: Header value, if present
+        mtime: File modification time in seconds since the epoch
+
+    Returns:
+        True if the client's copy is current
+    """
+    if not if_modified_since:
+        return False
+    try:
+        ims = email.utils.parsedate_to_datetime(if_modified_since)
+    except (TypeError, IndexError, OverflowError, ValueError):
+        return False
+    if ims.tzinfo is None:
+        ims = ims.replace(tzinfo=datetime.UTC)
+    return int(mtime) <= ims.timestamp()
+
+
+class _SubresourceParser(HTMLParser):
+    """Collect a page's stylesheet and script URLs in document order."""
+
+    def __init__(self):
+        super().__init__()
+        self.styles: list[str] = []
+        self.scripts: list[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        attributes = dict(attrs)
+        if tag == "link":
+            rel = (attributes.get("rel") or "").lower().split()
+            if "stylesheet" in rel and "alternate" not in rel:
+                if attributes.get("href"):
+                    self.styles.append(attributes["href"])
+        elif tag == "script" and attributes.get("src"):
+            self.scripts.append(attributes["src"])
+
+
+class PreloadMap:
+    """Critical subresources of each page, announced as preload hints.
+
+    Every HTML file under ``pages/`` is parsed once for its stylesheets and
+    scripts, and each page gets a ready-made ``Link`` header value with one
+    ``rel=preload`` entry per file: stylesheets first, since they block
+    rendering, then scripts. Only same-origin files that exist are listed.
+    The map is rebuilt when a page or a watched directory's mtime changes
+    (checked at most once per ``refresh_interval``). Pages served from a
+    ``SitePack`` are read from the pack, once.
+    """
+
+    def __init__(
+        self,
+        root: str | None = None,
+        refresh_interval: float = 1.0,
+        pack: SitePack | None = None,
+    ):
+        """Initialize and build the map.
+
+        Args:
+            root: Site root directory (defaults to the working directory)
+            refresh_interval: Seconds between checks for changed pages
+            pack: Read pages from this pack instead of root
+        """
+        self.root = os.path.abspath(root or os.getcwd())
+        self.refresh_interval = refresh_interval
+        self.pack = pack
+        self.rebuilds = 0
+        self.early_hints = 0
+        # Page path on disk -> (mtime_ns, Link header value or None)
+        self._pages: dict[str, tuple[int, str | None]] = {}
+        self._dir_mtimes: dict[str, int] = {}
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.rebuild()
+
+    def link(self, route: Route, path: str, prefix: str = "") -> str | None:
+        """Return the Link header value for a request, if its page has one.
+
+        Pages reference their subresources relatively, so a page served for
+        a URL in another directory (the ``index.html`` fallback) gets none:
+        the browser would request them from somewhere else.
+
+        Args:
+            route: Resolved route of the request
+            path: URL path of the request, within the site
+            prefix: URL path prefix the site is served under, if any
+
+        Returns:
+            Header value, or None
+        """
+        if route.fs_path is None:
+            return None
+        if posixpath.dirname(path) != posixpath.dirname(route.target):
+            return None
+        self._maybe_refresh()
+        page = self._pages.get(route.fs_path)
+        if page is None or page[1] is None:
+            return None
+        return page[1].replace("</", f"<{prefix}/") if prefix else page[1]
+
+    def early_hints_response(self, link: str) -> bytes:
+        """Return a serialized 103 Early Hints response and count it."""
+        self.early_hints += 1
+        return f"HTTP/1.1 103 Early Hints\r\nLink: {link}\r\n\r\n".encode("latin-1")
+
+    def rebuild(self) -> None:
+        """Re-parse every page under pages/ (or in the pack)."""
+        pages = {}
+        dir_mtimes = {}
+        if self.pack is not None:
+            for url in self.pack.names():
+                if url.endswith(".html"):
+                    html = str(self.pack.read(url), "utf-8", "replace")
+                    pages[url] = (0, self._links(url, html))
+        else:
+            pages_dir = os.path.join(self.root, "pages")
+            for dirpath, dirnames, filenames in os.walk(pages_dir):
+                dirnames.sort()
+                dir_mtimes[dirpath] = _mtime_ns(dirpath)
+                for filename in filenames:
+                    if filename.endswith(".html"):
+                        fs_path = os.path.join(dirpath, filename)
+                        pages[fs_path] = (_mtime_ns(fs_path), self._parse(fs_path))
+
+        with self._lock:
+            self._pages = pages
+            self._dir_mtimes = dir_mtimes
+            self._checked = time.monotonic()
+            self.rebuilds += 1
+
+    def stats(self) -> dict[str, int]:
+        """Return map counters.
+
+        Returns:
+            Dictionary of counter name to value
+        """
+        pages = self._pages
+        return {
+            "pages": sum(1 for _, link in pages.values() if link is not None),
+            "rebuilds": self.rebuilds,
+            "early_hints": self.early_hints,
+        }
+
+    def memory(self) -> dict[str, int]:
+        """Return the map size and its approximate footprint in bytes."""
+        pages = self._pages
+        return {"pages": len(pages), "approx_bytes": _approx_size(pages)}
+
+    def _maybe_refresh(self) -> None:
+        """Rebuild if a page or watched directory changed since the last check."""
+        now = time.monotonic()
+        if self.pack is not None or now - self._checked < self.refresh_interval:
+            return
+        with self._lock:
+            if now - self._checked < self.refresh_interval:
+                return
+            self._checked = now
+            dir_mtimes = self._dir_mtimes
+            pages = self._pages
+        if any(_mtime_ns(path) != mtime for path, mtime in dir_mtimes.items()) or any(
+            _mtime_ns(path) != page[0] for path, page in pages.items()
+        ):
+            self.rebuild()
+
+    def _parse(self, fs_path: str) -> str | None:
+        """Return the Link header value for one page, or None if it has none."""
+        try:
+            with open(fs_path, encoding="utf-8", errors="replace") as f:
+                html = f.read()
+        except OSError:
+            return None
+        page_url = "/" + os.path.relpath(fs_path, self.root).replace(os.sep, "/")
+        return self._links(page_url, html)
+
+    def _links(self, page_url: str, html: str) -> str | None:
+        """Return the Link header value for a page's HTML, or None."""
+        parser = _SubresourceParser()
+        parser.feed(html)
+        parser.close()
+        links = []
+        seen = set()
+        for kind, references in (("style", parser.styles), ("script", parser.scripts)):
+            for reference in references:
+                url = urldefrag(urljoin(page_url, reference.strip())).url
+                parsed = urlparse(url)
+                if parsed.scheme or parsed.netloc or url in seen:
+                    continue
+                if self.pack is not None:
+                    if parsed.path not in self.pack:
+                        continue
+                elif not os.path.isfile(translate_path(parsed.path, self.root)):
+                    continue
+                seen.add(url)
+                links.append(f"<{url}>; rel=preload; as={kind}")
+        return ", ".join(links) or None
+
+
+class Site:
+    """One site root served by a virtual host, with its own caches.
+
+    Servers carry the same attributes (``root``, ``route_table``,
+    ``site_cache`` and ``preloads``) for their own root, so the handlers
+    serve a request from whichever of the two ``select_site`` picks.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        root: str,
+        route_table: RouteTable | SitePack,
+        site_cache: SiteCache | SitePack | None = None,
+        preloads: PreloadMap | None = None,
+    ):
+        """Initialize the site.
+
+        Args:
+            name: Host name label and URL path prefix of the site
+            root: Site root directory (or site pack file)
+            route_table: Routes of the site
+            site_cache: Cache of the site's files, if caching is enabled
+            preloads: Preload hints of the site's pages, if enabled
+        """
+        self.name = name
+        self.root = root
+        self.route_table = route_table
+        self.site_cache = site_cache
+        self.preloads = preloads
+
+
+class VirtualHosts:
+    """Sites served next to the server's own root, by Host or path prefix.
+
+    A request for ``/NAME/...`` goes to site NAME with the prefix removed;
+    otherwise a Host header whose host name is NAME, or whose first label
+    is NAME (``chamber.portal.local``), selects it. IP addresses never
+    select a site by Host. Everything else is served from the server's own
+    root as before.
+    """
+
+    def __init__(self, sites: list[Site]):
+        """Initialize the lookup tables.
+
+        Args:
+            sites: Sites with distinct names
+        """
+        self.sites = {site.name: site for site in sites}
+
+    def __iter__(self):
+        return iter(self.sites.values())
+
+    def __len__(self) -> int:
+        return len(self.sites)
+
+    def select(self, host: str | None, path: str) -> tuple[Site, str, str] | None:
+        """Pick the site for a request.
+
+        Args:
+            host: Host header value, if any
+            path: URL path of the request
+
+        Returns:
+            Tuple of (site, path within the site, URL prefix to put back on
+            redirects and links), or None for the server's own root
+        """
+        name, _, rest = path[1:].partition("/")
+        site = self.sites.get(name)
+        if site is not None:
+            return site, "/" + rest, "/" + name
+        if not host or host.startswith("["):
+            return None
+        hostname = host.partition(":")[0].rstrip(".").lower()
+        try:
+            ipaddress.ip_address(hostname)
+        except ValueError:
+            pass
+        else:
+            return None
+        site = self.sites.get(hostname) or self.sites.get(hostname.partition(".")[0])
+        if site is not None:
+            return site, path, ""
+        return None
+
+
+def select_site(
+    server, host: str | None, path: str
+) -> tuple[object, str, str, str | None]:
+    """Pick the site serving a request: a virtual host or the server itself.
+
+    Args:
+        server: Server that received the request
+        host: Host header value, if any
+        path: URL path of the request
+
+    Returns:
+        Tuple of (site, path within the site, URL prefix of the site, site
+        metrics label or None when no virtual hosts are configured)
+    """
+    vhosts = getattr(server, "vhosts", None)
+    if vhosts is None:
+        return server, path, "", None
+    selected = vhosts.select(host, path)
+    if selected is None:
+        return server, path, "", DEFAULT_SITE
+    site, path, prefix = selected
+    return site, path, prefix, site.name
+
+
+class RequestTimer:
+    """Durations of the phases of one request.
+
+    Phases are ``queue`` (waiting for a ``--priority-slots`` slot, when
+    enabled), ``route`` (path resolution), ``cache`` (cache lookup),
+    ``disk`` (opening an uncached file), ``negotiate`` (choosing the
+    encoding and conditional response) and ``write`` (sending it). All but
+    ``write`` go out in the ``Server-Timing`` header, which is sent before
+    the body; the access log gets every phase. Timers only exist with
+    ``--server-timing``, so handlers skip timing entirely when it is off.
+    """
+
+    __slots__ = ("phases", "_last")
+
+    def __init__(self):
+        self.phases: list[tuple[str, float]] = []
+        self._last = time.perf_counter()
+
+    def mark(self, phase: str) -> None:
+        """End a phase: charge the time since the previous mark to it."""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def header(self) -> str:
+        """Return the Server-Timing header value for the phases so far."""
+        return ", ".join(
+            f"{phase};dur={seconds * 1000:.3f}" for phase, seconds in self.phases
+        )
+
+
+def classify_request(method: str, path: str, headers) -> int | None:
+    """Return the PRIORITY_* class of a request for the scheduler.
+
+    Browsers say what a request is for in ``Sec-Fetch-Dest``: ``document``
+    for navigations, ``style``/``script``/``font``/``image`` for resources
+    a page is waiting on and ``empty`` for ``fetch()``, which on this site
+    means a service worker filling its cache. Without the header (older
+    browsers, scripts) pages and extensionless paths count as navigations
+    and other files as critical.
+
+    Args:
+        method: Request method
+        path: URL path, without the query string
+        headers: Request headers
+
+    Returns:
+        Priority class, or None for health probes, which skip the queue
+    """
+    if path in (HEALTH_PATH, READY_PATH):
+        return None
+    if method == "OPTIONS" or path == METRICS_PATH or path.startswith(ADMIN_PREFIX):
+        return PRIORITY_API
+    if headers.get("Service-Worker") or "prefetch" in (
+        headers.get("Sec-Purpose") or headers.get("Purpose") or ""
+    ):
+        return PRIORITY_PRECACHE
+    dest = headers.get("Sec-Fetch-Dest")
+    if dest is None:
+        extension = posixpath.splitext(path)[1].lower()
+        if extension in ("", ".htm", ".html"):
+            return PRIORITY_NAVIGATION
+        return PRIORITY_CRITICAL
+    if dest in NAVIGATION_DESTS:
+        return PRIORITY_NAVIGATION
+    if dest in ("empty", "serviceworker"):
+        return PRIORITY_PRECACHE
+    return PRIORITY_CRITICAL
+
+
+class PriorityScheduler:
+    """Admits requests to a fixed number of slots, most urgent class first.
+
+    Waiting requests are ordered by a deadline: arrival time plus
+    ``aging`` seconds per class below ``navigation``. A click is served
+    ahead of precache fetches that arrived up to ``2 * aging`` earlier, but
+    a precache fetch that has waited longer than that goes first, so low
+    classes are delayed under load and never starved.
+    """
+
+    def __init__(self, slots: int, aging: float = 0.5):
+        """Initialize the scheduler.
+
+        Args:
+            slots: Requests handled at the same time
+            aging: Seconds of waiting that make up one class of priority
+        """
+        if slots < 1:
+            raise ValueError("slots must be at least 1")
+        self.slots = slots
+        self.aging = aging
+        self.active = 0
+        self.peak_waiting = 0
+        self.admitted = [0] * len(PRIORITY_CLASSES)
+        self.wait_seconds = [0.0] * len(PRIORITY_CLASSES)
+        self._waiting: list[tuple[float, int]] = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, priority: int) -> float:
+        """Block until a slot is free and no more urgent request is waiting.
+
+        Args:
+            priority: PRIORITY_* class of the request
+
+        Returns:
+            Seconds spent waiting
+        """
+        with self._cond:
+            waited = 0.0
+            if self.active >= self.slots or self._waiting:
+                start = time.monotonic()
+                ticket = (start + priority * self.aging, next(self._sequence))
+                heapq.heappush(self._waiting, ticket)
+                self.peak_waiting = max(self.peak_waiting, len(self._waiting))
+                while self.active >= self.slots or self._waiting[0] is not ticket:
+                    self._cond.wait()
+                heapq.heappop(self._waiting)
+                waited = time.monotonic() - start
+                if self._waiting and self.active + 1 < self.slots:
+                    self._cond.notify_all()
+            self.active += 1
+            self.admitted[priority] += 1
+            self.wait_seconds[priority] += waited
+            return waited
+
+    def release(self) -> None:
+        """Free the slot taken by acquire."""
+        with self._cond:
+            self.active -= 1
+            if self._waiting:
+                self._cond.notify_all()
+
+    def snapshot(self) -> dict:
+        """Return a consistent copy of the counters.
+
+        Returns:
+            Dictionary with slot usage and per-class admitted requests and
+            total wait, keyed by class name
+        """
+        with self._cond:
+            return {
+                "slots": self.slots,
+                "active": self.active,
+                "waiting": len(self._waiting),
+                "peak_waiting": self.peak_waiting,
+                "admitted": dict(zip(PRIORITY_CLASSES, self.admitted, strict=True)),
+                "wait_seconds": dict(
+                    zip(PRIORITY_CLASSES, self.wait_seconds, strict=True)
+                ),
+            }
+
+
+class AccessLog:
+    """Structured access log written by a background thread.
+
+    Request handlers only put a tuple on a bounded queue; formatting,
+    writing and rotation happen on the ``portal-access-log`` thread. When
+    the destination stalls (an unread stderr pipe, a slow disk) the queue
+    fills and further records are dropped and counted rather than blocking
+    a request.
+    """
+
+    def __init__(
+        self,
+        path: str = "-",
+        log_format: str = "combined",
+        max_bytes: int = 0,
+        backups: int = 5,
+        sample_rate: float = 1.0,
+        queue_size: int = 8192,
+    ):
+        """Initialize the log and start its writer thread.
+
+        Args:
+            path: Log file, or "-" for stderr
+            log_format: "combined" (Apache/nginx style) or "json" (one
+                object per line)
+            max_bytes: Rotate the file once it would exceed this size;
+                0 disables rotation
+            backups: Rotated files to keep (path.1 is the newest)
+            sample_rate: Fraction of requests to log, between 0 and 1
+            queue_size: Records buffered before new ones are dropped
+        """
+        if log_format not in ACCESS_LOG_FORMATS:
+            raise ValueError(f"unknown access log format: {log_format}")
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate must be between 0 and 1")
+        self.path = path
+        self.log_format = log_format
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.sample_rate = sample_rate
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self._queue: queue.Queue = queue.Queue(queue_size)
+        self._stream = None
+        self._size = 0
+        self._thread = threading.Thread(
+            target=self._run, name="portal-access-log", daemon=True
+        )
+        self._thread.start()
+
+    def record(
+        self,
+        remote: str,
+        method: str,
+        target: str,
+        version: str,
+        status: int,
+        nbytes: int,
+        duration: float,
+        referer: str | None = None,
+        user_agent: str | None = None,
+        timings: list[tuple[str, float]] | None = None,
+    ) -> None:
+        """Queue one request for logging.
+
+        Args:
+            remote: Client address
+            method: Request method
+            target: Request target (path and query)
+            version: HTTP version of the request
+            status: Response status code
+            nbytes: Response body bytes
+            duration: Seconds spent handling the request
+            referer: Referer header value, if present
+            user_agent: User-Agent header value, if present
+            timings: (phase, seconds) pairs from a RequestTimer
+        """
+        if self.sample_rate < 1.0:
+            # Sampling needs a cheap coin flip, not an unpredictable one
+            if random.random() >= self.sample_rate:  # noqa: S311
+                self.sampled_out += 1
+                return
+        self._put(
+            (
+                time.time(),
+                remote,
+                method,
+                target,
+                version,
+                status,
+                nbytes,
+                duration,
+                referer,
+                user_agent,
+                timings,
+            )
+        )
+
+    def message(self, text: str) -> None:
+        """Queue a free-form server message (errors, warnings)."""
+        self._put(text)
+
+    def close(self, timeout: float = 2.0) -> None:
+        """Flush queued records and stop the writer thread.
+
+        Args:
+            timeout: Seconds to wait for the queue to drain
+        """
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def stats(self) -> dict[str, int]:
+        """Return access log counters.
+
+        Returns:
+            Dictionary of counter name to value
+        """
+        return {
+            "written": self.written,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+            "queued": self._queue.qsize(),
+        }
+
+    def format(self, item) -> str:
+        """Format a queued record or message as one log line."""
+        if isinstance(item, str):
+            if self.log_format == "json":
+                return json.dumps({"message": item})
+            return item
+
+        when, remote, method, target, version, status, nbytes, duration = item[:8]
+        referer, user_agent, timings = item[8:]
+        if self.log_format == "json":
+            record = {
+                "time": datetime.datetime.fromtimestamp(when, datetime.UTC).isoformat(
+                    timespec="milliseconds"
+                ),
+                "remote": remote,
+                "method": method,
+                "path": target,
+                "protocol": version,
+                "status": status,
+                "bytes": nbytes,
+                "duration_ms": round(duration * 1000, 3),
+                "referer": referer,
+                "user_agent": user_agent,
+            }
+            if timings:
+                record["timing_ms"] = {
+                    phase: round(seconds * 1000, 3) for phase, seconds in timings
+                }
+            return json.dumps(record)
+        timestamp = time.strftime("%d/%b/%Y:%H:%M:%S +0000", time.gmtime(when))
+        line = (
+            f'{remote} - - [{timestamp}] "{method} {target} {version}" '
+            f'{status} {nbytes or "-"} "{referer or "-"}" "{user_agent or "-"}"'
+        )
+        if timings:
+            line += " timing=" + ",".join(
+                f"{phase}:{seconds * 1000:.3f}" for phase, seconds in timings
+            )
+        return line
+
+    def _put(self, item) -> None:
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        """Write queued lines, flushing whenever the queue runs dry."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._write(self.format(item) + "\n")
+                self.written += 1
+                if self._queue.empty():
+                    self._stream.flush()
+            except Exception:  # A bad record or full disk must not kill the thread
+                self.dropped += 1
+        if self._stream is not None:
+            if self.path == "-":
+                self._stream.flush()
+            else:
+                self._stream.close()
+
+    def _write(self, line: str) -> None:
+        if self._stream is None:
+            self._open()
+        if self.path == "-":
+            self._stream.write(line)
+            return
+        data = line.encode("utf-8", "replace")
+        if self.max_bytes and self._size and self._size + len(data) > self.max_bytes:
+            self._rotate()
+        self._stream.write(data)
+        self._size += len(data)
+
+    def _open(self) -> None:
+        if self.path == "-":
+            self._stream = sys.stderr
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._stream = open(self.path, "ab")
+        self._size = self._stream.tell()
+
+    def _rotate(self) -> None:
+        """Shift path.N-1 -> path.N ... path -> path.1 and reopen."""
+        self._stream.close()
+        if self.backups > 0:
+            for index in range(self.backups - 1, 0, -1):
+                source = f"{self.path}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+
+def probe_response(server, path: str) -> tuple[HTTPStatus, bytes]:
+    """Answer a liveness or readiness probe from in-memory state.
+
+    ``/healthz`` succeeds whenever the process can answer at all.
+    ``/readyz`` succeeds once the server has warmed its cache and is
+    listening (``server.ready``), and fails again while it drains.
+
+    Args:
+        server: Server being probed
+        path: HEALTH_PATH or READY_PATH
+
+    Returns:
+        Tuple of (status, body)
+    """
+    if path == HEALTH_PATH:
+        return HTTPStatus.OK, b"ok\n"
+    if getattr(server, "ready", False):
+        return HTTPStatus.OK, b"ready\n"
+    return HTTPStatus.SERVICE_UNAVAILABLE, b"not ready\n"
+
+
+class _MetricsShard:
+    """Counters owned by one thread; only that thread writes to them."""
+
+    __slots__ = (
+        "requests",
+        "latency",
+        "latency_sum",
+        "bytes_sent",
+        "site_requests",
+        "site_latency_sum",
+        "site_bytes_sent",
+    )
+
+    def __init__(self):
+        self.requests: dict[tuple[str, int], int] = {}
+        self.latency: dict[str, list[int]] = {}
+        self.latency_sum: dict[str, float] = {}
+        self.bytes_sent: dict[str, int] = {}
+        self.site_requests: dict[tuple[str, int], int] = {}
+        self.site_latency_sum: dict[str, float] = {}
+        self.site_bytes_sent: dict[str, int] = {}
+
+
+class Metrics:
+    """Request metrics exposed in the Prometheus text format.
+
+    Each thread records into its own shard without taking a lock; a scrape
+    merges the shards. Routes are labelled by ``Route.label`` (the top-level
+    directory under ``pages/``), which keeps label cardinality bounded.
+    With virtual hosts, requests are also counted per site.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        """Initialize the metrics registry.
+
+        Args:
+            buckets: Upper bounds of the latency histogram, in seconds
+        """
+        self.buckets = buckets
+        self._local = threading.local()
+        self._shards: list[_MetricsShard] = []
+        self._lock = threading.Lock()
+
+    def observe(
+        self,
+        route: str,
+        status: int,
+        duration: float,
+        nbytes: int,
+        site: str | None = None,
+    ) -> None:
+        """Record one finished request.
+
+        Args:
+            route: Route label
+            status: Response status code
+            duration: Seconds spent handling the request
+            nbytes: Response body bytes
+            site: Virtual host the request was served from, if any
+        """
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _MetricsShard()
+            with self._lock:
+                self._shards.append(shard)
+
+        key = (route, int(status))
+        shard.requests[key] = shard.requests.get(key, 0) + 1
+        counts = shard.latency.get(route)
+        if counts is None:
+            counts = shard.latency[route] = [0] * (len(self.buckets) + 1)
+        counts[bisect.bisect_left(self.buckets, duration)] += 1
+        shard.latency_sum[route] = shard.latency_sum.get(route, 0.0) + duration
+        shard.bytes_sent[route] = shard.bytes_sent.get(route, 0) + nbytes
+        if site is not None:
+            key = (site, int(status))
+            shard.site_requests[key] = shard.site_requests.get(key, 0) + 1
+            total = shard.site_latency_sum.get(site, 0.0)
+            shard.site_latency_sum[site] = total + duration
+            shard.site_bytes_sent[site] = shard.site_bytes_sent.get(site, 0) + nbytes
+
+    def snapshot(self) -> dict[str, dict]:
+        """Merge every thread's counters.
+
+        Returns:
+            Dictionary with "requests" ((route, status) -> count), "latency"
+            (route -> per-bucket counts, last is +Inf), "latency_sum" and
+            "bytes_sent" (route -> total), and the same per virtual host in
+            "site_requests", "site_latency_sum" and "site_bytes_sent"
+        """
+        requests: dict[tuple[str, int], int] = {}
+        latency: dict[str, list[int]] = {}
+        latency_sum: dict[str, float] = {}
+        bytes_sent: dict[str, int] = {}
+        site_requests: dict[tuple[str, int], int] = {}
+        site_latency_sum: dict[str, float] = {}
+        site_bytes_sent: dict[str, int] = {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for key, count in shard.requests.copy().items():
+                requests[key] = requests.get(key, 0) + count
+            for route, counts in shard.latency.copy().items():
+                merged = latency.setdefault(route, [0] * (len(self.buckets) + 1))
+                for index, count in enumerate(list(counts)):
+                    merged[index] += count
+            for route, total in shard.latency_sum.copy().items():
+                latency_sum[route] = latency_sum.get(route, 0.0) + total
+            for route, total in shard.bytes_sent.copy().items():
+                bytes_sent[route] = bytes_sent.get(route, 0) + total
+            for key, count in shard.site_requests.copy().items():
+                site_requests[key] = site_requests.get(key, 0) + count
+            for site, total in shard.site_latency_sum.copy().items():
+                site_latency_sum[site] = site_latency_sum.get(site, 0.0) + total
+            for site, total in shard.site_bytes_sent.copy().items():
+                site_bytes_sent[site] = site_bytes_sent.get(site, 0) + total
+        return {
+            "requests": requests,
+            "latency": latency,
+            "latency_sum": latency_sum,
+            "bytes_sent": bytes_sent,
+            "site_requests": site_requests,
+            "site_latency_sum": site_latency_sum,
+            "site_bytes_sent": site_bytes_sent,
+        }
+
+    def exposition(self, server) -> bytes:
+        """Render request metrics and the server's gauges for a scrape.
+
+        Args:
+            server: Server whose cache, pool and connection counters to
+                include (any that it lacks are skipped)
+
+        Returns:
+            Prometheus text exposition format (version 0.0.4)
+        """
+        data = self.snapshot()
+        out: list[str] = []
+
+        def metric(name: str, kind: str, help_text: str, samples) -> None:
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                out.append(f"{name}{suffix}{_format_labels(labels)} {value}")
+
+        metric(
+            "portal_requests_total",
+            "counter",
+            "Requests served, by route and status.",
+            [
+                ("", {"route": route, "status": status}, count)
+                for (route, status), count in sorted(data["requests"].items())
+            ],
+        )
+
+        histogram = []
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        for route, counts in sorted(data["latency"].items()):
+            cumulative = 0
+            for bound, count in zip(bounds, counts, strict=True):
+                cumulative += count
+                labels = {"route": route, "le": bound}
+                histogram.append(("_bucket", labels, cumulative))
+            histogram.append(("_sum", {"route": route}, data["latency_sum"][route]))
+            histogram.append(("_count", {"route": route}, cumulative))
+        metric(
+            "portal_request_duration_seconds",
+            "histogram",
+            "Time to handle a request, by route.",
+            histogram,
+        )
+
+        metric(
+            "portal_response_bytes_total",
+            "counter",
+            "Response body bytes sent, by route.",
+            [("", {"route": r}, n) for r, n in sorted(data["bytes_sent"].items())],
+        )
+
+        vhosts = getattr(server, "vhosts", None)
+        if vhosts is not None:
+            metric(
+                "portal_site_requests_total",
+                "counter",
+                "Requests served, by virtual host and status.",
+                [
+                    ("", {"site": site, "status": status}, count)
+                    for (site, status), count in sorted(data["site_requests"].items())
+                ],
+            )
+            metric(
+                "portal_site_request_duration_seconds_total",
+                "counter",
+                "Time spent handling requests, by virtual host.",
+                [
+                    ("", {"site": site}, total)
+                    for site, total in sorted(data["site_latency_sum"].items())
+                ],
+            )
+            metric(
+                "portal_site_response_bytes_total",
+                "counter",
+                "Response body bytes sent, by virtual host.",
+                [
+                    ("", {"site": site}, total)
+                    for site, total in sorted(data["site_bytes_sent"].items())
+                ],
+            )
+
+        open_connections = getattr(server, "open_connections", None)
+        if open_connections is not None:
+            metric(
+                "portal_open_connections",
+                "gauge",
+                "Client connections currently open.",
+                [("", {}, open_connections)],
+            )
+
+        pool_stats = getattr(server, "pool_stats", None)
+        if pool_stats is not None:
+            pool = pool_stats.snapshot()
+            for name, kind, help_text, value in (
+                ("workers", "gauge", "Worker threads.", pool["workers"]),
+                ("workers_busy", "gauge", "Busy worker threads.", pool["busy"]),
+                (
+                    "worker_saturation_ratio",
+                    "gauge",
+                    "Fraction of workers busy.",
+                    pool["busy"] / pool["workers"],
+                ),
+                (
+                    "connections_saturated_total",
+                    "counter",
+                    "Connections accepted while every worker was busy.",
+                    pool["saturated"],
+                ),
+                (
+                    "connections_rejected_total",
+                    "counter",
+                    "Connections rejected with 503 because the queue was full.",
+                    pool["rejected"],
+                ),
+            ):
+                metric(f"portal_{name}", kind, help_text, [("", {}, value)])
+
+        tls = getattr(server, "tls", None)
+        if tls is not None:
+            tls_stats = tls.stats()
+            for name, kind, help_text, value in (
+                (
+                    "handshakes_total",
+                    "counter",
+                    "Completed TLS handshakes.",
+                    tls_stats["handshakes"],
+                ),
+                (
+                    "resumed_total",
+                    "counter",
+                    "TLS handshakes that resumed a session.",
+                    tls_stats["resumed"],
+                ),
+                (
+                    "resumption_ratio",
+                    "gauge",
+                    "Fraction of TLS handshakes that resumed a session.",
+                    tls_stats["resumption_ratio"],
+                ),
+                (
+                    "handshakes_incomplete",
+                    "gauge",
+                    "TLS handshakes started but not completed (failed or running).",
+                    tls_stats["incomplete"],
+                ),
+                (
+                    "certificate_reloads_total",
+                    "counter",
+                    "Certificates reloaded after the files changed.",
+                    tls_stats["reloads"],
+                ),
+                (
+                    "certificate_reload_failures_total",
+                    "counter",
+                    "Changed certificate files that failed to load.",
+                    tls_stats["reload_failures"],
+                ),
+            ):
+                metric(f"portal_tls_{name}", kind, help_text, [("", {}, value)])
+
+        scheduler = getattr(server, "scheduler", None)
+        if scheduler is not None:
+            sched = scheduler.snapshot()
+            metric(
+                "portal_scheduler_waiting",
+                "gauge",
+                "Requests waiting for a scheduler slot.",
+                [("", {}, sched["waiting"])],
+            )
+            metric(
+                "portal_scheduler_admitted_total",
+                "counter",
+                "Requests admitted by the scheduler, by priority class.",
+                [("", {"class": c}, n) for c, n in sched["admitted"].items()],
+            )
+            metric(
+                "portal_scheduler_wait_seconds_total",
+                "counter",
+                "Time requests waited for a scheduler slot, by priority class.",
+                [("", {"class": c}, n) for c, n in sched["wait_seconds"].items()],
+            )
+
+        site_cache = getattr(server, "site_cache", None)
+        if site_cache is not None:
+            cache = site_cache.stats()
+            for name, kind, help_text, value in (
+                ("hits_total", "counter", "Cache hits.", cache["hits"]),
+                ("misses_total", "counter", "Cache misses.", cache["misses"]),
+                ("evictions_total", "counter", "Evictions.", cache["evictions"]),
+                ("hit_ratio", "gauge", "Cache hit ratio.", cache["hit_ratio"]),
+                ("bytes", "gauge", "Bytes held by the cache.", cache["bytes"]),
+                ("entries", "gauge", "Files held by the cache.", cache["entries"]),
+            ):
+                metric(f"portal_cache_{name}", kind, help_text, [("", {}, value)])
+
+        if vhosts is not None:
+            sites = [(DEFAULT_SITE, server)] + [(site.name, site) for site in vhosts]
+            caches = [
+                (name, site.site_cache.stats())
+                for name, site in sites
+                if getattr(site, "site_cache", None) is not None
+            ]
+            for name, kind, help_text, key in (
+                ("hits_total", "counter", "Cache hits, by virtual host.", "hits"),
+                ("misses_total", "counter", "Cache misses, by virtual host.", "misses"),
+                ("bytes", "gauge", "Bytes cached, by virtual host.", "bytes"),
+                ("entries", "gauge", "Files cached, by virtual host.", "entries"),
+            ):
+                metric(
+                    f"portal_site_cache_{name}",
+                    kind,
+                    help_text,
+                    [("", {"site": site}, cache[key]) for site, cache in caches],
+                )
+
+        preloads = getattr(server, "preloads", None)
+        if preloads is not None:
+            hints = preloads.stats()
+            for name, kind, help_text, value in (
+                ("pages", "gauge", "Pages with preload hints.", hints["pages"]),
+                ("rebuilds_total", "counter", "Map rebuilds.", hints["rebuilds"]),
+                (
+                    "early_hints_total",
+                    "counter",
+                    "103 Early Hints responses sent.",
+                    hints["early_hints"],
+                ),
+            ):
+                metric(f"portal_preload_{name}", kind, help_text, [("", {}, value)])
+
+        access_log = getattr(server, "access_log", None)
+        if access_log is not None:
+            metric(
+                "portal_access_log_dropped_total",
+                "counter",
+                "Access log records dropped because the queue was full.",
+                [("", {}, access_log.dropped)],
+            )
+
+        return ("\n".join(out) + "\n").encode("utf-8")
+
+
+def _format_labels(labels: dict) -> str:
+    """Format a label set, escaping values as the text format requires."""
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        value = value.replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class SamplingProfiler:
+    """Wall-clock sampling profiler covering every thread.
+
+    A capture polls ``sys._current_frames()`` from the calling thread;
+    nothing is hooked into the interpreter, so requests run at full speed
+    outside a capture and the sampled threads are never slowed down. One
+    capture runs at a time.
+    """
+
+    max_seconds = 60.0
+    min_interval = 0.001
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        """Whether a capture is running."""
+        return self._lock.locked()
+
+    def capture(self, seconds: float, interval: float = 0.005) -> Counter:
+        """Sample all other threads' stacks for a while.
+
+        Args:
+            seconds: How long to sample
+            interval: Seconds between samples
+
+        Returns:
+            Counter of (thread name, stack) to sample count; a stack is a
+            tuple of (filename, first line, function) from the outermost
+            frame in
+
+        Raises:
+            RuntimeError: Another capture is running
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("a capture is already running")
+        try:
+            samples: Counter = Counter()
+            me = threading.get_ident()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(
+                            (code.co_filename, code.co_firstlineno, code.co_name)
+                        )
+                        frame = frame.f_back
+                    stack.reverse()
+                    samples[(names.get(ident, str(ident)), tuple(stack))] += 1
+                time.sleep(interval)
+            return samples
+        finally:
+            self._lock.release()
+
+
+def collapsed_stacks(samples: Counter) -> str:
+    """Format samples as collapsed stacks for flamegraph.pl or speedscope.
+
+    Each line is ``thread;outer;...;inner count``.
+    """
+    lines = []
+    for (thread, stack), count in sorted(samples.items()):
+        frames = [thread] + [
+            f"{name} ({os.path.basename(filename)}:{line})"
+            for filename, line, name in stack
+        ]
+        lines.append(f"{';'.join(frames)} {count}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def sampled_pstats(samples: Counter, interval: float) -> dict:
+    """Convert samples into the dictionary ``pstats.Stats`` loads.
+
+    Call counts are sample counts and times are samples times interval,
+    so the numbers are estimates; ``marshal.dump`` the result to a file
+    for pstats, snakeviz or gprof2dot.
+    """
+    entries: dict = {}
+    for (_, stack), count in samples.items():
+        seconds = count * interval
+        for depth, func in enumerate(stack):
+            entry = entries.setdefault(func, [0, 0, 0.0, 0.0, {}])
+            leaf = depth == len(stack) - 1
+            entry[1] += count
+            if func not in stack[:depth]:
+                # Count recursive frames once towards cumulative time
+                entry[0] += count
+                entry[3] += seconds
+            if leaf:
+                entry[2] += seconds
+            if depth:
+                caller = entry[4].setdefault(stack[depth - 1], [0, 0, 0.0, 0.0])
+                caller[0] += count
+                caller[1] += count
+                caller[3] += seconds
+                if leaf:
+                    caller[2] += seconds
+    return {
+        func: (cc, nc, tt, ct, {key: tuple(value) for key, value in callers.items()})
+        for func, (cc, nc, tt, ct, callers) in entries.items()
+    }
+
+
+def is_loopback(host: str) -> bool:
+    """Whether a client address is on the loopback interface."""
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    mapped = getattr(address, "ipv4_mapped", None)
+    return (mapped or address).is_loopback
+
+
+def process_memory() -> dict[str, int | None]:
+    """Return the process's resident set size, now and at its peak.
+
+    Values the platform cannot report are None: current RSS needs
+    ``/proc`` (Linux), peak RSS the ``resource`` module (not Windows).
+    """
+    rss = None
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    peak = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KiB, macOS bytes
+        if sys.platform != "darwin":
+            peak *= 1024
+    return {"rss_bytes": rss, "peak_rss_bytes": peak}
+
+
+class HeapTracker:
+    """Switches tracemalloc on and off and diffs heap snapshots.
+
+    tracemalloc slows every allocation down, so it only runs between an
+    explicit start and stop. A saved baseline snapshot lets a later call
+    show what grew in between, for example over several days of uptime.
+    """
+
+    # Allocations made by tracemalloc itself and the import system
+    ignored = (
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._baseline: tuple[float, tracemalloc.Snapshot, int | None] | None = None
+
+    def start(self, frames: int = 1) -> None:
+        """Start tracing allocations, keeping frames of traceback each."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def stop(self) -> None:
+        """Stop tracing and drop the baseline, freeing the traces."""
+        with self._lock:
+            self._baseline = None
+        tracemalloc.stop()
+
+    def report(
+        self, top: int = 10, save_baseline: bool = False, diff: bool = False
+    ) -> dict:
+        """Describe the traced heap.
+
+        Args:
+            top: Number of allocation sites to list
+            save_baseline: Keep this snapshot to diff later ones against
+            diff: Include the growth since the saved baseline
+
+        Returns:
+            JSON-ready dictionary; only ``tracing`` when tracemalloc is off
+        """
+        if not tracemalloc.is_tracing():
+            return {"tracing": False}
+        current, peak = tracemalloc.get_traced_memory()
+        report = {
+            "tracing": True,
+            "frames": tracemalloc.get_traceback_limit(),
+            "current_bytes": current,
+            "peak_bytes": peak,
+        }
+        with self._lock:
+            snapshot = tracemalloc.take_snapshot().filter_traces(self.ignored)
+            report["top"] = [
+                {
+                    "location": _location(stat.traceback),
+                    "size_bytes": stat.size,
+                    "count": stat.count,
+                }
+                for stat in snapshot.statistics("lineno")[:top]
+            ]
+            rss = process_memory()["rss_bytes"]
+            if diff and self._baseline is not None:
+                report["diff"] = self._diff(snapshot, rss, top)
+            if save_baseline:
+                self._baseline = (time.time(), snapshot, rss)
+            report["baseline_saved"] = self._baseline is not None
+        return report
+
+    def _diff(self, snapshot: tracemalloc.Snapshot, rss: int | None, top: int) -> dict:
+        """Compare a snapshot with the baseline (caller holds the lock)."""
+        taken, baseline, baseline_rss = self._baseline
+        stats = snapshot.compare_to(baseline, "lineno")
+        rss_delta = None
+        if rss is not None and baseline_rss is not None:
+            rss_delta = rss - baseline_rss
+        return {
+            "since_seconds": round(time.time() - taken, 3),
+            "rss_delta_bytes": rss_delta,
+            "size_delta_bytes": sum(stat.size_diff for stat in stats),
+            "top": [
+                {
+                    "location": _location(stat.traceback),
+                    "size_delta_bytes": stat.size_diff,
+                    "count_delta": stat.count_diff,
+                    "size_bytes": stat.size,
+                }
+                for stat in stats[:top]
+            ],
+        }
+
+
+def _location(traceback: tracemalloc.Traceback) -> str:
+    frame = traceback[0]
+    return f"{frame.filename}:{frame.lineno}"
+
+
+class AdminEndpoints:
+    """Diagnostics under ADMIN_PREFIX for operators on the server itself.
+
+    Requests from anywhere but loopback are refused, so the endpoints are
+    only reachable from the kiosk machine (or through an SSH tunnel).
+    Handlers may block for the length of a capture; the async engine runs
+    them on an executor thread.
+    """
+
+    max_top = 100
+    max_frames = 64
+
+    def __init__(self):
+        self.profiler = SamplingProfiler()
+        self.heap = HeapTracker()
+
+    def handle(
+        self, server, client: str, path: str, query: str
+    ) -> tuple[HTTPStatus, bytes, str]:
+        """Answer an admin request.
+
+        Args:
+            server: Server the request arrived on
+            client: Client IP address
+            path: URL path, starting with ADMIN_PREFIX
+            query: URL query string
+
+        Returns:
+            Tuple of (status, body, content type)
+        """
+        if not is_loopback(client):
+            body = b"admin endpoints are local only\n"
+            return HTTPStatus.FORBIDDEN, body, TEXT_CONTENT_TYPE
+        params = {name: values[-1] for name, values in parse_qs(query).items()}
+        if path == PROFILE_PATH:
+            if not getattr(server, "concurrent", True):
+                body = b"profiling needs the threaded or async engine\n"
+                return HTTPStatus.NOT_IMPLEMENTED, body, TEXT_CONTENT_TYPE
+            return self.profile(params)
+        if path == MEMORY_PATH:
+            return self.memory(server, params)
+        return HTTPStatus.NOT_FOUND, b"unknown admin endpoint\n", TEXT_CONTENT_TYPE
+
+    def profile(self, params: dict[str, str]) -> tuple[HTTPStatus, bytes, str]:
+        """Run a sampling capture: ``?seconds=5&interval=5&format=collapsed``.
+
+        ``interval`` is in milliseconds; ``format`` is ``collapsed`` or
+        ``pstats`` (marshalled, for ``pstats.Stats``).
+        """
+        try:
+            seconds = float(params.get("seconds", 5))
+            interval = float(params.get("interval", 5)) / 1000
+        except ValueError:
+            return _bad_request("seconds and interval must be numbers")
+        output = params.get("format", "collapsed")
+        if not 0 < seconds <= self.profiler.max_seconds:
+            return _bad_request(
+                f"seconds must be between 0 and {self.profiler.max_seconds:g}"
+            )
+        if not self.profiler.min_interval <= interval <= seconds:
+            return _bad_request("interval must be between 1 ms and the duration")
+        if output not in PROFILE_FORMATS:
+            return _bad_request(f"format must be one of {', '.join(PROFILE_FORMATS)}")
+
+        try:
+            samples = self.profiler.capture(seconds, interval)
+        except RuntimeError as e:
+            return HTTPStatus.CONFLICT, f"{e}\n".encode(), TEXT_CONTENT_TYPE
+        if output == "pstats":
+            body = marshal.dumps(sampled_pstats(samples, interval))
+            return HTTPStatus.OK, body, "application/octet-stream"
+        return HTTPStatus.OK, collapsed_stacks(samples).encode(), TEXT_CONTENT_TYPE
+
+    def memory(self, server, params: dict[str, str]) -> tuple[HTTPStatus, bytes, str]:
+        """Report process, cache and (when tracing) Python heap memory as JSON.
+
+        ``tracemalloc=start`` (with ``frames=N``) or ``tracemalloc=stop``
+        switches tracing, ``top=N`` sets the number of allocation sites
+        listed, ``baseline=1`` saves this snapshot and ``diff=1`` adds the
+        growth since the saved one.
+        """
+        try:
+            top = int(params.get("top", 10))
+            frames = int(params.get("frames", 1))
+        except ValueError:
+            return _bad_request("top and frames must be integers")
+        if not 1 <= top <= self.max_top:
+            return _bad_request(f"top must be between 1 and {self.max_top}")
+        if not 1 <= frames <= self.max_frames:
+            return _bad_request(f"frames must be between 1 and {self.max_frames}")
+        action = params.get("tracemalloc")
+        if action == "start":
+            self.heap.start(frames)
+        elif action == "stop":
+            self.heap.stop()
+        elif action is not None:
+            return _bad_request("tracemalloc must be start or stop")
+
+        report = {
+            "process": process_memory(),
+            "caches": cache_memory(server),
+            "tracemalloc": self.heap.report(
+                top,
+                save_baseline=params.get("baseline") == "1",
+                diff=params.get("diff") == "1",
+            ),
+        }
+        body = json.dumps(report, indent=2).encode() + b"\n"
+        return HTTPStatus.OK, body, "application/json"
+
+
+def cache_memory(server) -> dict[str, dict[str, int]]:
+    """Return the memory held by each of a server's caches and queues."""
+    caches = {}
+    site_cache = getattr(server, "site_cache", None)
+    if site_cache is not None:
+        caches["site"] = site_cache.memory()
+    route_table = getattr(server, "route_table", None)
+    if route_table is not None and route_table is not site_cache:
+        caches["routes"] = route_table.memory()
+    cors = getattr(server, "cors", None)
+    if cors is not None:
+        caches["preflights"] = cors.memory()
+    preloads = getattr(server, "preloads", None)
+    if preloads is not None:
+        caches["preloads"] = preloads.memory()
+    for site in getattr(server, "vhosts", None) or ():
+        if site.site_cache is not None:
+            caches[f"site:{site.name}"] = site.site_cache.memory()
+        if site.route_table is not site.site_cache:
+            caches[f"routes:{site.name}"] = site.route_table.memory()
+        if site.preloads is not None:
+            caches[f"preloads:{site.name}"] = site.preloads.memory()
+    access_log = getattr(server, "access_log", None)
+    if access_log is not None:
+        caches["access_log"] = {"queued": access_log.stats()["queued"]}
+    return caches
+
+
+def _bad_request(message: str) -> tuple[HTTPStatus, bytes, str]:
+    return HTTPStatus.BAD_REQUEST, f"{message}\n".encode(), TEXT_CONTENT_TYPE
+
+
+class RedirectHandler(http.server.SimpleHTTPRequestHandler):
+    """Custom handler that redirects root to pages/ directory.
+
+    Speaks HTTP/1.1 with persistent connections. The server may set
+    ``keepalive_requests`` (requests allowed per connection; 1 disables
+    keep-alive) and ``idle_timeout`` (seconds to wait for the next request).
+    """
+
+    protocol_version = "HTTP/1.1"
+    server_version = "NIAPortal/http.server"
+    # Headers and body go out in separate writes; without TCP_NODELAY the
+    # body waits on the client's delayed ACK (~40 ms) on a kept-alive socket.
+    disable_nagle_algorithm = True
+    # Send cached files from pre-serialized heads (one sendmsg each)
+    preserialize = True
+
+    def __init__(self, *args, **kwargs):
+        self.requests_handled = 0
+        self.route_fs_path: str | None = None
+        self.response_status: int | None = None
+        self.response_length = 0
+        self.route_label = "other"
+        server = args[2] if len(args) > 2 else kwargs.get("server")
+        root = getattr(server, "root", None) or os.getcwd()
+        super().__init__(*args, directory=root, **kwargs)
+
+    def setup(self):
+        """Apply the server's per-connection socket timeout, if any."""
+        self.connections = getattr(self.server, "connections", None)
+        self.timeout = getattr(self.server, "connection_timeout", None)
+        self.keepalive_requests = getattr(self.server, "keepalive_requests", 100)
+        self.idle_timeout = getattr(self.server, "idle_timeout", self.timeout)
+        self.access_log = getattr(self.server, "access_log", None)
+        self.metrics = getattr(self.server, "metrics", None)
+        self.cors = getattr(self.server, "cors", None)
+        self.server_timing = getattr(self.server, "server_timing", False)
+        self.admin = getattr(self.server, "admin", None)
+        self.scheduler = getattr(self.server, "scheduler", None)
+        self.early_hints = getattr(self.server, "early_hints", False)
+        super().setup()
+
+    def handle_one_request(self):
+        """Handle one request, then record its metrics and access log entry."""
+        self.response_status = None
+        self.response_length = 0
+        self.route_label = "other"
+        self.request_start = time.perf_counter()
+        self.request_target = "-"
+        self.cors_headers = ()
+        self.timer = None
+        self.timer_phase = None
+        self.scheduled = False
+        self.site = self.server
+        self.site_prefix = ""
+        self.site_name = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self.scheduled:
+                self.scheduler.release()
+        if self.response_status is None:
+            return
+        timings = None
+        if self.timer is not None:
+            self.timer.mark("write")
+            timings = self.timer.phases
+        duration = time.perf_counter() - self.request_start
+        nbytes = self.response_length
+        if self.command == "HEAD" or self.response_status == HTTPStatus.NOT_MODIFIED:
+            nbytes = 0
+        if self.metrics is not None:
+            self.metrics.observe(
+                self.route_label,
+                self.response_status,
+                duration,
+                nbytes,
+                self.site_name,
+            )
+        if self.access_log is not None:
+            self.access_log.record(
+                self.client_address[0],
+                self.command or "-",
+                self.request_target,
+                self.request_version,
+                self.response_status,
+                nbytes,
+                duration,
+                self.headers.get("Referer") if self.headers else None,
+                self.headers.get("User-Agent") if self.headers else None,
+                timings,
+            )
+
+    def handle(self):
+        """Serve requests until the client closes, a limit is hit or we drain."""
+        self.close_connection = True
+        if self.connections is not None:
+            self.connections.add(self.connection)
+        try:
+            self.handle_one_request()
+            while not self.close_connection and self._wait_for_request():
+                self.handle_one_request()
+        finally:
+            if self.connections is not None:
+                self.connections.discard(self.connection)
+
+    @property
+    def draining(self) -> bool:
+        """Whether the server is draining and connections should close."""
+        return self.connections is not None and self.connections.draining
+
+    def _wait_for_request(self) -> bool:
+        """Wait up to idle_timeout for the next request on this connection."""
+        if self.connections is not None:
+            if not self.connections.set_idle(self.connection, True):
+                return False
+        self.connection.settimeout(self.idle_timeout)
+        try:
+            ready = bool(self.rfile.peek(1))
+        except (TimeoutError, OSError):
+            ready = False
+        self.connection.settimeout(self.timeout)
+        if self.connections is not None:
+            self.connections.set_idle(self.connection, False)
+        return ready
+
+    def parse_request(self):
+        """Count requests so the last one allowed can close the connection."""
+        self.requests_handled += 1
+        self.request_start = time.perf_counter()
+        parsed = super().parse_request()
+        if parsed:
+            self.request_target = self.path
+            if self.cors is not None:
+                self.cors_headers = self.cors.response_headers(
+                    self.headers.get("Origin")
+                )
+            self._select_site()
+            if self.server_timing:
+                self.timer = RequestTimer()
+            if self.scheduler is not None:
+                self._wait_for_slot()
+        return parsed
+
+    def _select_site(self) -> None:
+        """Pick the virtual host (or the server's own root) for this request."""
+        self.site, self.site_path, self.site_prefix, self.site_name = select_site(
+            self.server, self.headers.get("Host"), urlparse(self.path).path
+        )
+        self.directory = self.site.root
+
+    def _wait_for_slot(self) -> None:
+        """Wait for the scheduler to admit this request (released after it)."""
+        priority = classify_request(
+            self.command, urlparse(self.path).path, self.headers
+        )
+        if priority is None:
+            return
+        self.scheduler.acquire(priority)
+        self.scheduled = True
+        if self.timer is not None:
+            self.timer.mark("queue")
+
+    def log_request(self, code="-", size="-"):
+        """Remember the status for the metrics and access log record."""
+        if isinstance(code, int):
+            self.response_status = int(code)
+
+    def log_message(self, format, *args):
+        """Send server messages through the access log queue."""
+        if self.access_log is None:
+            super().log_message(format, *args)
+            return
+        self.access_log.message(
+            f"{self.address_string()} - - [{self.log_date_time_string()}] "
+            f"{format % args}"
+        )
+
+    def send_header(self, keyword, value):
+        """Track Content-Length for the access log; prefix site redirects."""
+        if keyword == "Content-Length":
+            self.response_length = int(value)
+        elif keyword == "Location" and self.site_prefix:
+            value = self.site_prefix + value
+        super().send_header(keyword, value)
+
+    def do_GET(self):
+        """Handle GET and HEAD requests with root redirect logic."""
+        parsed_path = urlparse(self.path)
+        if parsed_path.path == METRICS_PATH and self.metrics is not None:
+            self.route_label = METRICS_PATH
+            body = self.metrics.exposition(self.server)
+            self.send_text(HTTPStatus.OK, body, METRICS_CONTENT_TYPE)
+            return
+        if parsed_path.path in (HEALTH_PATH, READY_PATH):
+            self.route_label = parsed_path.path
+            self.send_text(*probe_response(self.server, parsed_path.path))
+            return
+        if parsed_path.path.startswith(ADMIN_PREFIX) and self.admin is not None:
+            self.route_label = ADMIN_PREFIX
+            self.send_text(
+                *self.admin.handle(
+                    self.server,
+                    self.client_address[0],
+                    parsed_path.path,
+                    parsed_path.query,
+                )
+            )
+            return
+
+        route = self.site.route_table.resolve(self.site_path)
+        self.route_label = route.label
+        if self.timer is not None:
+            self.timer.mark("route")
+
+        if route.kind == ROUTE_REDIRECT:
+            # send_header puts the site prefix on Location itself
+            body = redirect_body(self.site_prefix + route.target)
+            self.send_response(302)
+            self.send_header("Location", route.target)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+            return
+
+        if route.kind == ROUTE_NOT_FOUND:
+            self.send_error(404, "File not found")
+            return
+
+        if self.site.preloads is not None:
+            link = self.site.preloads.link(route, self.site_path, self.site_prefix)
+            if link is not None:
+                self.send_preload_hints(link)
+
+        if route.fs_path is not None:
+            self.path = route.target
+        elif self.site_prefix:
+            self.path = self.path[len(self.site_prefix) :]
+        self.route_fs_path = route.fs_path
+
+        # Call parent method to handle the request
+        if self.command == "HEAD":
+            super().do_HEAD()
+        else:
+            super().do_GET()
+
+    def do_HEAD(self):
+        """Route HEAD requests like GET, so site packs answer them too."""
+        self.do_GET()
+
+    def do_OPTIONS(self):
+        """Answer OPTIONS (CORS preflight) requests without the filesystem."""
+        self.route_label = PREFLIGHT_LABEL
+        if self.cors is None:
+            self.send_error(HTTPStatus.NOT_IMPLEMENTED)
+            return
+        origin = self.headers.get("Origin")
+        if self.preserialize:
+            response = self.cors.preflight(
+                origin, self.server_version, self.connection_headers()
+            )
+            self.log_request(response.status, 0)
+            self.wfile.write(response.head)
+            return
+        self.send_response(HTTPStatus.NO_CONTENT)
+        for name, value in self.cors.preflight_headers(origin):
+            self.send_header(name, value)
+        self.end_headers()
+
+    def send_preload_hints(self, link: str) -> None:
+        """Announce a page's subresources ahead of its body.
+
+        The Link header goes out with the final response (alongside the
+        CORS headers); with ``early_hints`` it is also sent at once in a
+        103 interim response. HTTP/1.0 clients cannot take 1xx responses.
+        """
+        self.cors_headers = self.cors_headers + (("Link", link),)
+        if self.early_hints and self.request_version == "HTTP/1.1":
+            self.wfile.write(self.site.preloads.early_hints_response(link))
+
+    def connection_headers(self) -> tuple[tuple[str, str], ...]:
+        """Return the Connection header for a pre-serialized response.
+
+        Pre-serialized responses skip ``end_headers``, so the keep-alive
+        limit and draining are applied here instead.
+        """
+        if self.requests_handled >= self.keepalive_requests or self.draining:
+            self.close_connection = True
+        return connection_headers(self.request_version, not self.close_connection)
+
+    def send_text(
+        self,
+        status: HTTPStatus,
+        body: bytes,
+        content_type: str = TEXT_CONTENT_TYPE,
+    ):
+        """Send a generated, uncacheable response (metrics, probes)."""
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def send_head(self):
+        """Serve from the site's SiteCache when the file is cacheable."""
+        cache = getattr(self.site, "site_cache", None)
+        entry = None
+        if cache is not None:
+            fs_path = self.route_fs_path or self.translate_path(self.path)
+            entry = cache.get(fs_path)
+            if self.timer is not None:
+                self.timer.mark("cache")
+        if entry is None:
+            # end_headers() closes the phase once the file is open
+            self.timer_phase = "disk"
+            return self.send_file_head()
+
+        if self.preserialize:
+            response = cache.response(
+                entry,
+                self.server_version,
+                self.headers.get("Accept-Encoding"),
+                self.headers.get("If-None-Match"),
+                self.headers.get("If-Modified-Since"),
+                self.cors_headers + self.connection_headers(),
+            )
+            head_only = self.command == "HEAD"
+            if self.timer is None:
+                buffers = response.buffers(head_only)
+            else:
+                self.timer.mark("negotiate")
+                buffers = response.with_header(
+                    "Server-Timing", self.timer.header(), head_only
+                )
+            self.log_request(response.status, sum(map(len, buffers)))
+            self.response_length = len(response.body)
+            send_buffers(self.connection, buffers)
+            return None
+
+        status, headers, body = entry.respond(
+            self.headers.get("Accept-Encoding"),
+            self.headers.get("If-None-Match"),
+            self.headers.get("If-Modified-Since"),
+        )
+        self.timer_phase = "negotiate"
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if status == HTTPStatus.NOT_MODIFIED:
+            return None
+        return io.BytesIO(body)
+
+    def send_file_head(self):
+        """Serve a file from disk, negotiating precompressed siblings.
+
+        Directories (redirects, index pages, listings) are left to
+        SimpleHTTPRequestHandler.
+        """
+        path = self.route_fs_path or self.translate_path(self.path)
+        if path.endswith("/") or os.path.isdir(path):
+            return super().send_head()
+        try:
+            f, st, encoding, vary = open_representation(
+                path, self.headers.get("Accept-Encoding")
+            )
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+        # SimpleHTTPRequestHandler ignores If-Modified-Since next to
+        # If-None-Match; there are no ETags to compare on this path
+        if_modified_since = None
+        if "If-None-Match" not in self.headers:
+            if_modified_since = self.headers.get("If-Modified-Since")
+        try:
+            status, headers = file_response_headers(
+                path, f, st, encoding, vary, if_modified_since
+            )
+            self.send_response(status)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+        except BaseException:
+            f.close()
+            raise
+        if status == HTTPStatus.NOT_MODIFIED:
+            f.close()
+            return None
+        return f
+
+    def copyfile(self, source, outputfile):
+        """Write a response body to the client.
+
+        Cached bodies go out in one write. Files on disk are streamed with
+        ``socket.sendfile``, which uses ``os.sendfile`` (no copy through
+        Python buffers) where the platform supports it and falls back to
+        plain sends elsewhere; anything it rejects falls back to
+        ``shutil.copyfileobj``.
+        """
+        if isinstance(source, io.BytesIO):
+            outputfile.write(source.getvalue())
+            return
+        if outputfile is self.wfile:
+            try:
+                self.connection.sendfile(source)
+                return
+            except (AttributeError, ValueError, io.UnsupportedOperation):
+                pass
+        super().copyfile(source, outputfile)
+
+    def version_string(self):
+        """Return the Server header value."""
+        return self.server_version
+
+    def end_headers(self):
+        """Add CORS and Server-Timing headers; close at the limit or on drain."""
+        for name, value in self.cors_headers:
+            self.send_header(name, value)
+        if self.timer is not None:
+            if self.timer_phase is not None:
+                self.timer.mark(self.timer_phase)
+                self.timer_phase = None
+            self.send_header("Server-Timing", self.timer.header())
+        if not self.close_connection and (
+            self.requests_handled >= self.keepalive_requests or self.draining
+        ):
+            if getattr(self, "request_version", None) == "HTTP/1.1":
+                self.send_header("Connection", "close")
+            self.close_connection = True
+        super().end_headers()
+
+
+class ConnectionTracker:
+    """Open connections of a thread-based server and which of them are idle.
+
+    A connection is idle while its handler waits for the next keep-alive
+    request. Once draining starts, idle connections are shut down and busy
+    ones are closed after their current response.
+    """
+
+    def __init__(self):
+        self.draining = False
+        self._idle: dict[socket.socket, bool] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._idle)
+
+    def add(self, sock: socket.socket) -> None:
+        """Start tracking a busy connection."""
+        with self._lock:
+            self._idle[sock] = False
+
+    def discard(self, sock: socket.socket) -> None:
+        """Stop tracking a connection."""
+        with self._lock:
+            self._idle.pop(sock, None)
+
+    def set_idle(self, sock: socket.socket, idle: bool) -> bool:
+        """Mark a connection idle or busy.
+
+        Returns:
+            False if the connection went idle while draining and should be
+            closed instead of waiting for another request
+        """
+        with self._lock:
+            if idle and self.draining:
+                return False
+            self._idle[sock] = idle
+            return True
+
+    def busy(self) -> int:
+        """Return the number of connections with a request in progress."""
+        with self._lock:
+            return sum(1 for idle in self._idle.values() if not idle)
+
+    def start_draining(self) -> int:
+        """Refuse further keep-alive requests and close idle connections.
+
+        Returns:
+            Number of idle connections closed
+        """
+        with self._lock:
+            self.draining = True
+            idle = [sock for sock, is_idle in self._idle.items() if is_idle]
+        for sock in idle:
+            _shutdown_socket(sock)
+        return len(idle)
+
+    def close_all(self) -> int:
+        """Shut down every remaining connection.
+
+        Returns:
+            Number of connections closed
+        """
+        with self._lock:
+            remaining = list(self._idle)
+        for sock in remaining:
+            _shutdown_socket(sock)
+        return len(remaining)
+
+
+def _shutdown_socket(sock: socket.socket) -> None:
+    """Shut a connection down so the thread blocked on it wakes up."""
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class TLSManager:
+    """The server's one SSLContext, its certificate reloads and counters.
+
+    Every connection is wrapped with the same context, so the certificate
+    is parsed once, the context's session cache and ticket keys are shared
+    by all connections (and by prefork workers, which inherit the context
+    across fork), and a returning console resumes its session with an
+    abbreviated handshake instead of a full one.
+
+    The certificate and key files are checked for changes at most every
+    ``reload_interval`` seconds, from the first handshake after that. A
+    changed pair is loaded into the same context, so new connections get
+    the new certificate and existing sessions stay resumable; a pair that
+    fails to load is counted and the old certificate is kept.
+    """
+
+    def __init__(
+        self,
+        certfile: str,
+        keyfile: str | None = None,
+        ciphers: str = DEFAULT_TLS_CIPHERS,
+        minimum_version: ssl.TLSVersion = ssl.TLSVersion.TLSv1_2,
+        tickets: int = 2,
+        alpn: tuple[str, ...] = ("http/1.1",),
+        reload_interval: float = 30.0,
+    ):
+        """Create the context and load the certificate.
+
+        Args:
+            certfile: PEM certificate chain
+            keyfile: PEM private key (defaults to the certificate file)
+            ciphers: OpenSSL cipher string for TLS 1.2
+            minimum_version: Oldest TLS version accepted
+            tickets: TLS 1.3 session tickets sent per handshake; 0 turns
+                session tickets off (sessions then resume from the cache)
+            alpn: Protocols offered through ALPN, most preferred first
+            reload_interval: Seconds between checks for changed files
+
+        Raises:
+            OSError: The files cannot be read or do not match
+            ssl.SSLError: The cipher string selects no ciphers
+        """
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.reload_interval = reload_interval
+        self.reloads = 0
+        self.reload_failures = 0
+        self._lock = threading.Lock()
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.minimum_version = minimum_version
+        context.set_ciphers(ciphers)
+        context.num_tickets = tickets
+        if tickets == 0:
+            context.options |= ssl.OP_NO_TICKET
+        context.set_alpn_protocols(list(alpn))
+        context.load_cert_chain(certfile, keyfile)
+        # Called for every ClientHello, before the certificate is chosen
+        context.sni_callback = self._client_hello
+        self.context = context
+        self._stamp = self._file_stamp()
+        self._next_check = time.monotonic() + reload_interval
+
+    def wrap(self, sock: socket.socket) -> ssl.SSLSocket:
+        """Wrap an accepted socket; the handshake is left to the caller."""
+        with self._lock:
+            return self.context.wrap_socket(
+                sock, server_side=True, do_handshake_on_connect=False
+            )
+
+    def maybe_reload(self) -> bool:
+        """Reload the certificate if the interval passed and the files changed.
+
+        Returns:
+            True if a new certificate was loaded
+        """
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        with self._lock:
+            if now < self._next_check:
+                return False
+            self._next_check = now + self.reload_interval
+            stamp = self._file_stamp()
+            if stamp == self._stamp:
+                return False
+            self._stamp = stamp
+            try:
+                # Check the pair on a scratch context so a certificate
+                # that doesn't match its key never reaches the live one
+                check = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+                check.load_cert_chain(self.certfile, self.keyfile)
+                self.context.load_cert_chain(self.certfile, self.keyfile)
+            except OSError:
+                self.reload_failures += 1
+                return False
+            self.reloads += 1
+            return True
+
+    def stats(self) -> dict[str, int | float]:
+        """Return handshake, resumption and reload counters.
+
+        Returns:
+            Dictionary with completed handshakes, how many of them resumed
+            a session, handshakes that failed or are still in progress,
+            the resumption ratio and certificate reloads
+        """
+        sessions = self.context.session_stats()
+        completed = sessions["accept_good"]
+        return {
+            "handshakes": completed,
+            "resumed": sessions["hits"],
+            "incomplete": sessions["accept"] - completed,
+            "resumption_ratio": sessions["hits"] / completed if completed else 0.0,
+            "reloads": self.reloads,
+            "reload_failures": self.reload_failures,
+        }
+
+    def _client_hello(self, ssl_object, server_name, context) -> None:
+        try:
+            self.maybe_reload()
+        except Exception:
+            # An exception here would abort the client's handshake
+            pass
+
+    def _file_stamp(self) -> tuple:
+        stamp = []
+        for path in (self.certfile, self.keyfile):
+            if path is None:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                stamp.append(None)
+            else:
+                stamp.append((st.st_mtime_ns, st.st_size, st.st_ino))
+        return tuple(stamp)
+
+
+class PortalTCPServer(socketserver.TCPServer):
+    """TCP server for the thread-based engines that can drain on shutdown."""
+
+    # One thread serves every request (the simple engine)
+    concurrent = False
+
+    def __init__(self, *args, **kwargs):
+        self.connections = ConnectionTracker()
+        self.cors = CorsPolicy()
+        self.server_timing = False
+        self.admin: AdminEndpoints | None = None
+        self.tls: TLSManager | None = None
+        self.preloads: PreloadMap | None = None
+        self.early_hints = False
+        self.root = os.getcwd()
+        self.vhosts: VirtualHosts | None = None
+        self.ready = False
+        super().__init__(*args, **kwargs)
+
+    def get_request(self):
+        """Accept a connection, wrapping it in TLS when serving HTTPS."""
+        request, client_address = super().get_request()
+        if self.tls is not None:
+            request = self.tls.wrap(request)
+        return request, client_address
+
+    def finish_request(self, request, client_address):
+        """Complete the TLS handshake (in the serving thread), then handle."""
+        if isinstance(request, ssl.SSLSocket):
+            try:
+                request.settimeout(getattr(self, "connection_timeout", None))
+                request.do_handshake()
+            except (OSError, ValueError):
+                # Counted as incomplete in TLSManager.stats()
+                return
+        super().finish_request(request, client_address)
+
+    @property
+    def open_connections(self) -> int:
+        """Connections currently open."""
+        return len(self.connections)
+
+    def adopt_socket(self, sock: socket.socket) -> None:
+        """Serve on an inherited listening socket instead of binding one.
+
+        Use with ``bind_and_activate=False`` in place of server_bind() and
+        server_activate(); the socket must already be listening.
+        """
+        self.socket.close()
+        self.socket = sock
+        self.server_address = sock.getsockname()
+
+    def drain(self, timeout: float) -> dict[str, float]:
+        """Stop accepting and let in-flight requests finish.
+
+        Must be called from a different thread than serve_forever(), which
+        returns once the listener is closed.
+
+        Args:
+            timeout: Seconds to wait for in-flight requests before closing
+                their connections anyway
+
+        Returns:
+            Dictionary with the drain time in seconds and the number of
+            in-flight, idle-closed and aborted connections
+        """
+        start = time.monotonic()
+        self.ready = False
+        in_flight = self.connections.busy()
+        idle_closed = self.connections.start_draining()
+        self.shutdown()
+        self.socket.close()
+
+        deadline = start + timeout
+        while self.open_connections and time.monotonic() < deadline:
+            time.sleep(0.01)
+        aborted = self.connections.close_all()
+        return {
+            "seconds": time.monotonic() - start,
+            "in_flight": in_flight,
+            "idle_closed": idle_closed,
+            "aborted": aborted,
+        }
+
+    def handle_error(self, request, client_address):
+        """Stay quiet about connections cut off while draining."""
+        if self.connections.draining and isinstance(sys.exc_info()[1], OSError):
+            return
+        super().handle_error(request, client_address)
+
 
+class PoolStats:
+    """Thread-safe counters describing worker pool saturation."""
 
-class RedirectHandler(http.server.SimpleHTTPRequestHandler):
-    """Custom handler that redirects root to pages/ directory."""
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.busy = 0
+        self.peak_busy = 0
+        self.peak_queued = 0
+        self.accepted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.saturated = 0
+        self._lock = threading.Lock()
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, directory=os.getcwd(), **kwargs)
+    def record_accept(self, queued: int) -> None:
+        """Record a connection handed to the queue."""
+        with self._lock:
+            self.accepted += 1
+            self.peak_queued = max(self.peak_queued, queued)
+            if self.busy >= self.workers:
+                self.saturated += 1
 
-    def do_GET(self):
-        """Handle GET requests with root redirect logic."""
-        parsed_path = urlparse(self.path)
-        path = parsed_path.path
+    def record_reject(self) -> None:
+        """Record a connection turned away because the queue was full."""
+        with self._lock:
+            self.rejected += 1
 
-        # Handle root redirect to pages/
-        if path == "/" or path == "":
-            self.send_response(302)
-            self.send_header("Location", "/pages/")
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(
-                b'Redirecting to <a href="/pages/">NIA Engineering Portal</a>...'
+    def record_start(self) -> None:
+        """Record a worker picking up a connection."""
+        with self._lock:
+            self.busy += 1
+            self.peak_busy = max(self.peak_busy, self.busy)
+
+    def record_finish(self) -> None:
+        """Record a worker finishing a connection."""
+        with self._lock:
+            self.busy -= 1
+            self.completed += 1
+
+    def snapshot(self) -> dict[str, int]:
+        """Return a consistent copy of the counters.
+
+        Returns:
+            Dictionary of counter name to value
+        """
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "busy": self.busy,
+                "peak_busy": self.peak_busy,
+                "peak_queued": self.peak_queued,
+                "accepted": self.accepted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "saturated": self.saturated,
+            }
+
+
+class ThreadPoolHTTPServer(PortalTCPServer):
+    """TCP server that hands connections to a fixed pool of worker threads.
+
+    Accepted connections wait in a bounded queue. When the queue is full the
+    connection is answered with ``503 Service Unavailable`` straight from the
+    accept loop, so a burst of clients can never grow the thread count or
+    memory without bound.
+
+    With a ``scheduler`` (``--priority-slots``) fewer requests than there
+    are workers run at once, and the others wait their turn by priority.
+    """
+
+    allow_reuse_address = True
+    request_queue_size = 128
+    concurrent = True
+
+    REJECT_RESPONSE = (
+        b"HTTP/1.0 503 Service Unavailable\r\n"
+        b"Retry-After: 1\r\n"
+        b"Content-Length: 0\r\n"
+        b"Connection: close\r\n\r\n"
+    )
+
+    def __init__(
+        self,
+        server_address,
+        handler_class,
+        workers: int = 32,
+        queue_size: int = 128,
+        connection_timeout: float | None = 30.0,
+        reuse_port: bool = False,
+        bind_and_activate: bool = True,
+    ):
+        """Initialize the pooled server.
+
+        Args:
+            server_address: (host, port) tuple to bind
+            handler_class: Request handler class
+            workers: Number of worker threads
+            queue_size: Maximum connections waiting for a worker
+            connection_timeout: Per-connection socket read/write timeout
+            reuse_port: Set SO_REUSEPORT so several processes share the port
+            bind_and_activate: Whether to bind and listen immediately
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if queue_size < 1:
+            raise ValueError("queue_size must be at least 1")
+
+        self.connection_timeout = connection_timeout
+        self.allow_reuse_port = reuse_port
+        self.pool_stats = PoolStats(workers, queue_size)
+        self.scheduler: PriorityScheduler | None = None
+        self._requests: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._workers: list[threading.Thread] = []
+        super().__init__(server_address, handler_class, bind_and_activate)
+
+        for index in range(workers):
+            worker = threading.Thread(
+                target=self._worker_loop, name=f"portal-worker-{index}", daemon=True
             )
+            worker.start()
+            self._workers.append(worker)
+
+    def process_request(self, request, client_address):
+        """Queue the connection for a worker instead of handling it inline."""
+        try:
+            self._requests.put_nowait((request, client_address))
+        except queue.Full:
+            self.pool_stats.record_reject()
+            self._reject(request)
             return
+        self.pool_stats.record_accept(self._requests.qsize())
 
-        # Handle pages/ directory requests
-        if path.startswith("/pages/"):
-            # Remove /pages/ prefix and serve from pages directory
-            relative_path = path[7:]  # Remove '/pages/' prefix
-            if not relative_path:
-                relative_path = "index.html"
-
-            # Check if file exists in pages directory
-            pages_path = os.path.join("pages", relative_path)
-            if os.path.exists(pages_path) and os.path.isfile(pages_path):
-                self.path = f"/pages/{relative_path}"
+    def _reject(self, request) -> None:
+        """Answer an over-capacity connection with 503 and close it."""
+        if isinstance(request, ssl.SSLSocket):
+            # A 503 would need a handshake first, in the accept loop
+            self.shutdown_request(request)
+            return
+        try:
+            request.settimeout(1.0)
+            request.sendall(self.REJECT_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def _worker_loop(self) -> None:
+        """Process queued connections until a shutdown sentinel arrives."""
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            request, client_address = item
+            self.pool_stats.record_start()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                self.pool_stats.record_finish()
+
+    @property
+    def open_connections(self) -> int:
+        """Connections being served or waiting for a worker."""
+        return self.pool_stats.busy + self._requests.qsize()
+
+    def server_close(self):
+        """Close the listener and stop the worker threads."""
+        super().server_close()
+        for _ in self._workers:
+            self._requests.put(None)
+        for worker in self._workers:
+            worker.join(timeout=5)
+        self._workers.clear()
+
+
+class AsyncHTTPServer:
+    """Static portal server running on a single asyncio event loop.
+
+    Each connection is a coroutine rather than a thread, so idle keep-alive
+    connections (wall displays hold them open all day) cost only a socket
+    and a small buffer. The routing rules are the same as RedirectHandler.
+    uvloop is used automatically when installed.
+
+    With ``http2`` a connection speaks HTTP/2 when TLS negotiates ``h2``
+    through ALPN, or on cleartext when the client opens with the HTTP/2
+    preface (h2c with prior knowledge); everything else is HTTP/1.1.
+    """
+
+    server_version = "NIAPortal/async"
+    concurrent = True
+    # Send cached files as pre-serialized responses (one write each)
+    preserialize = True
+    max_header_lines = 100
+    max_line_length = 8192
+    chunk_size = 64 * 1024
+    # Bytes per loop.sendfile call; connection_timeout applies to each
+    sendfile_chunk_size = 256 * 1024
+
+    def __init__(
+        self,
+        server_address,
+        root: str | None = None,
+        connection_timeout: float | None = 30.0,
+        idle_timeout: float | None = 300.0,
+        keepalive_requests: int = 100,
+        reuse_port: bool = False,
+        site_cache: SiteCache | None = None,
+        route_table: RouteTable | None = None,
+        sock: socket.socket | None = None,
+        tls: TLSManager | None = None,
+        http2: bool = False,
+    ):
+        """Initialize and bind the server.
+
+        Args:
+            server_address: (host, port) tuple to bind (ignored with sock)
+            root: Site root directory (defaults to the working directory)
+            connection_timeout: Timeout for reading a request, and for each
+                write of a response (a slow download may take longer)
+            idle_timeout: How long a keep-alive connection may sit idle
+            keepalive_requests: Requests served on one connection before
+                it is closed
+            reuse_port: Set SO_REUSEPORT so several processes share the port
+            site_cache: Optional in-memory cache of site files
+            route_table: Precomputed routes (built from root if omitted)
+            sock: Inherited listening socket to serve on instead of binding
+            tls: Serve HTTPS with this manager's context
+            http2: Also speak HTTP/2 (needs the h2 package)
+        """
+        if http2 and h2 is None:
+            raise ValueError("HTTP/2 needs the h2 package")
+        self.root = root or os.getcwd()
+        self.site_cache = site_cache
+        self.route_table = route_table or RouteTable(self.root)
+        self.connection_timeout = connection_timeout
+        self.idle_timeout = idle_timeout
+        self.keepalive_requests = keepalive_requests
+        self.tls = tls
+        self.http2 = http2
+        self.access_log: AccessLog | None = None
+        self.metrics: Metrics | None = None
+        self.cors = CorsPolicy()
+        self.server_timing = False
+        self.admin: AdminEndpoints | None = None
+        self.preloads: PreloadMap | None = None
+        self.early_hints = False
+        self.vhosts: VirtualHosts | None = None
+        self.ready = False
+        self.draining = False
+        self.peak_connections = 0
+        # Open connections, mapped to whether they are idle between requests
+        self._connections: dict[asyncio.StreamWriter, bool] = {}
+        self._server: asyncio.Server | None = None
+        self.loop_name = "uvloop" if uvloop is not None else "asyncio"
+
+        if sock is None:
+            sock = socket.create_server(
+                server_address, backlog=1024, reuse_port=reuse_port
+            )
+        self.socket = sock
+        self.server_address = self.socket.getsockname()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stopped: asyncio.Event | None = None
+        self._ready = threading.Event()
+        self._finished = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.server_close()
+
+    def serve_forever(self) -> None:
+        """Run the event loop until shutdown() is called."""
+        loop_factory = uvloop.new_event_loop if uvloop is not None else None
+        try:
+            with asyncio.Runner(loop_factory=loop_factory) as runner:
+                runner.run(self._serve())
+        finally:
+            self._finished.set()
+
+    def shutdown(self) -> None:
+        """Stop serve_forever() and wait for it to return.
+
+        Must be called from a different thread than serve_forever().
+        """
+        self._ready.wait()
+        self._loop.call_soon_threadsafe(self._stopped.set)
+        self._finished.wait()
+
+    def drain(self, timeout: float) -> dict[str, float]:
+        """Stop accepting, let in-flight requests finish, then stop serving.
+
+        Must be called from a different thread than serve_forever().
+
+        Args:
+            timeout: Seconds to wait for in-flight requests before closing
+                their connections anyway
+
+        Returns:
+            Dictionary with the drain time in seconds and the number of
+            in-flight, idle-closed and aborted connections
+        """
+        self._ready.wait()
+        future = asyncio.run_coroutine_threadsafe(self._drain(timeout), self._loop)
+        stats = future.result()
+        self.shutdown()
+        return stats
+
+    def server_close(self) -> None:
+        """Close the listening socket."""
+        self.socket.close()
+
+    @property
+    def open_connections(self) -> int:
+        """Connections currently open."""
+        return len(self._connections)
+
+    async def _serve(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        tls = {}
+        if self.tls is not None:
+            tls = {
+                "ssl": self.tls.context,
+                "ssl_handshake_timeout": self.connection_timeout,
+            }
+        self._server = await asyncio.start_server(
+            self._handle_connection,
+            sock=self.socket,
+            limit=self.max_line_length,
+            **tls,
+        )
+        self._ready.set()
+        async with self._server:
+            await self._stopped.wait()
+            for writer in list(self._connections):
+                writer.transport.abort()
+
+    async def _drain(self, timeout: float) -> dict[str, float]:
+        start = time.monotonic()
+        self.ready = False
+        self.draining = True
+        self._server.close()
+
+        idle = [writer for writer, is_idle in self._connections.items() if is_idle]
+        in_flight = len(self._connections) - len(idle)
+        for writer in idle:
+            writer.close()
+
+        deadline = start + timeout
+        while self._connections and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        aborted = len(self._connections)
+        for writer in list(self._connections):
+            writer.transport.abort()
+        return {
+            "seconds": time.monotonic() - start,
+            "in_flight": in_flight,
+            "idle_closed": len(idle),
+            "aborted": aborted,
+        }
+
+    async def _handle_connection(self, reader, writer) -> None:
+        # asyncio only sets TCP_NODELAY when the socket's proto is IPPROTO_TCP,
+        # which socket.create_server() leaves as 0; without it the body of a
+        # kept-alive response waits on the client's delayed ACK.
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError:
+                pass
+        self._connections[writer] = True
+        self.peak_connections = max(self.peak_connections, self.open_connections)
+        try:
+            line = None
+            if self.http2:
+                ssl_object = writer.get_extra_info("ssl_object")
+                if ssl_object is not None:
+                    if ssl_object.selected_alpn_protocol() == "h2":
+                        await HTTP2Session(self, reader, writer).run()
+                        return
+                else:
+                    line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                    if line == HTTP2_PREFACE[: len(line)] and line:
+                        rest = len(HTTP2_PREFACE) - len(line)
+                        preface = line + await reader.readexactly(rest)
+                        if preface == HTTP2_PREFACE:
+                            await HTTP2Session(self, reader, writer).run(preface)
+                        return
+            served = 0
+            while served < self.keepalive_requests and not self.draining:
+                served += 1
+                last = served >= self.keepalive_requests
+                self._connections[writer] = True
+                if not await self._handle_request(reader, writer, last, line):
+                    break
+                line = None
+        except (
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            TimeoutError,
+            ConnectionError,
+            ValueError,
+        ):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def _handle_request(
+        self, reader, writer, last: bool = False, line: bytes | None = None
+    ) -> bool:
+        """Read and answer one request.
+
+        Args:
+            reader: Connection stream reader
+            writer: Connection stream writer
+            last: Whether this is the last request allowed on the connection
+            line: Request line, if it has already been read
+
+        Returns:
+            True if the connection should stay open for another request
+        """
+        if line is None:
+            line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+        if not line:
+            return False
+        start = time.perf_counter()
+        self._connections[writer] = False
+
+        try:
+            method, target, version = line.decode("latin-1").split()
+        except ValueError:
+            await self._send_error(writer, HTTPStatus.BAD_REQUEST, "HTTP/1.1")
+            return False
+        if version not in ("HTTP/1.0", "HTTP/1.1"):
+            # As BaseHTTPRequestHandler: 400 unless it is an HTTP version
+            major, _, minor = version.partition("/")[2].partition(".")
+            status = HTTPStatus.HTTP_VERSION_NOT_SUPPORTED
+            if not version.startswith("HTTP/") or not (
+                major.isdecimal() and minor.isdecimal()
+            ):
+                status = HTTPStatus.BAD_REQUEST
+            await self._send_error(writer, status, "HTTP/1.1")
+            return False
+
+        headers = await asyncio.wait_for(
+            self._read_headers(reader), self.connection_timeout
+        )
+        if headers is None:
+            await self._send_error(writer, HTTPStatus.BAD_REQUEST, version)
+            return False
+
+        connection = headers.get("connection", "").lower()
+        if last or self.draining:
+            keep_alive = False
+        elif version == "HTTP/1.1":
+            keep_alive = connection != "close"
+        else:
+            keep_alive = connection == "keep-alive"
+
+        url = urlparse(target)
+        url_path = url.path
+        site, site_path, prefix, site_name = select_site(
+            self, headers.get("host"), url_path
+        )
+        origin = headers.get("origin")
+        cors = self.cors.response_headers(origin)
+        timer = RequestTimer() if self.server_timing else None
+        if method == "OPTIONS":
+            label = PREFLIGHT_LABEL
+            status, nbytes = await self._send_preflight(
+                writer, origin, version, keep_alive
+            )
+        elif method not in ("GET", "HEAD"):
+            keep_alive = False
+            label = "other"
+            status, nbytes = await self._send_error(
+                writer, HTTPStatus.NOT_IMPLEMENTED, version, cors=cors
+            )
+        elif url_path == METRICS_PATH and self.metrics is not None:
+            label = METRICS_PATH
+            body = self.metrics.exposition(self)
+            status, nbytes = await self._send_text(
+                writer,
+                HTTPStatus.OK,
+                body,
+                METRICS_CONTENT_TYPE,
+                version,
+                keep_alive,
+                cors,
+            )
+        elif url_path in (HEALTH_PATH, READY_PATH):
+            label = url_path
+            status, body = probe_response(self, url_path)
+            status, nbytes = await self._send_text(
+                writer,
+                status,
+                body,
+                TEXT_CONTENT_TYPE,
+                version,
+                keep_alive,
+                cors,
+            )
+        elif url_path.startswith(ADMIN_PREFIX) and self.admin is not None:
+            label = ADMIN_PREFIX
+            peer = writer.get_extra_info("peername")
+            # Captures block for seconds: keep them off the event loop
+            loop = asyncio.get_running_loop()
+            status, body, content_type = await loop.run_in_executor(
+                None,
+                self.admin.handle,
+                self,
+                peer[0] if peer else "",
+                url_path,
+                url.query,
+            )
+            status, nbytes = await self._send_text(
+                writer, status, body, content_type, version, keep_alive, cors
+            )
+        else:
+            route = site.route_table.resolve(site_path)
+            label = route.label
+            if timer is not None:
+                timer.mark("route")
+            status, nbytes = await self._respond(
+                writer,
+                method,
+                site_path,
+                route,
+                version,
+                headers,
+                keep_alive,
+                cors,
+                timer,
+                site,
+                prefix,
+            )
+
+        self._record_request(
+            writer,
+            label,
+            method,
+            target,
+            version,
+            headers,
+            status,
+            nbytes,
+            start,
+            timer,
+            site_name,
+        )
+        return keep_alive
+
+    def _record_request(
+        self,
+        writer,
+        label: str,
+        method: str,
+        target: str,
+        version: str,
+        headers: dict[str, str],
+        status: HTTPStatus,
+        nbytes: int,
+        start: float,
+        timer: RequestTimer | None,
+        site: str | None = None,
+    ) -> None:
+        """Record a finished request in the metrics and the access log."""
+        timings = None
+        if timer is not None:
+            timer.mark("write")
+            timings = timer.phases
+        duration = time.perf_counter() - start
+        if self.metrics is not None:
+            self.metrics.observe(label, status, duration, nbytes, site)
+        if self.access_log is not None:
+            peer = writer.get_extra_info("peername")
+            self.access_log.record(
+                peer[0] if peer else "-",
+                method,
+                target,
+                version,
+                status,
+                nbytes,
+                duration,
+                headers.get("referer"),
+                headers.get("user-agent"),
+                timings,
+            )
+
+    async def _read_headers(self, reader) -> dict[str, str] | None:
+        headers = {}
+        for _ in range(self.max_header_lines):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                return headers
+            name, sep, value = line.decode("latin-1").partition(":")
+            if not sep:
+                return None
+            headers[name.strip().lower()] = value.strip()
+        return None
+
+    def _head(
+        self,
+        status: HTTPStatus,
+        version: str,
+        headers: list[tuple[str, str]],
+        keep_alive: bool,
+        cors: tuple[tuple[str, str], ...] = (),
+        timer: RequestTimer | None = None,
+    ) -> bytes:
+        # The client's version only decides the Connection header
+        lines = [
+            f"HTTP/1.1 {status.value} {status.phrase}",
+            f"Server: {self.server_version}",
+            f"Date: {http_date()}",
+        ]
+        lines.extend(f"{name}: {value}" for name, value in headers)
+        lines.extend(f"{name}: {value}" for name, value in cors)
+        if timer is not None:
+            lines.append(f"Server-Timing: {timer.header()}")
+        if version == "HTTP/1.1" and not keep_alive:
+            lines.append("Connection: close")
+        elif version != "HTTP/1.1" and keep_alive:
+            lines.append("Connection: keep-alive")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def _send_error(
+        self,
+        writer,
+        status: HTTPStatus,
+        version: str,
+        keep_alive: bool = False,
+        cors: tuple[tuple[str, str], ...] = (),
+    ) -> tuple[HTTPStatus, int]:
+        body = f"{status.value} {status.phrase}".encode()
+        headers = [
+            ("Content-Type", TEXT_CONTENT_TYPE),
+            ("Content-Length", str(len(body))),
+        ]
+        writer.write(self._head(status, version, headers, keep_alive, cors) + body)
+        await self._drain_writer(writer)
+        return status, len(body)
+
+    async def _send_preflight(
+        self, writer, origin: str | None, version: str, keep_alive: bool
+    ) -> tuple[HTTPStatus, int]:
+        """Answer an OPTIONS request, pre-serialized unless disabled."""
+        if self.preserialize:
+            response = self.cors.preflight(
+                origin, self.server_version, connection_headers(version, keep_alive)
+            )
+            writer.write(response.head)
+        else:
+            headers = list(self.cors.preflight_headers(origin))
+            cors = self.cors.response_headers(origin)
+            status = HTTPStatus.NO_CONTENT
+            writer.write(self._head(status, version, headers, keep_alive, cors))
+        await self._drain_writer(writer)
+        return HTTPStatus.NO_CONTENT, 0
+
+    async def _send_text(
+        self,
+        writer,
+        status: HTTPStatus,
+        body: bytes,
+        content_type: str,
+        version: str,
+        keep_alive: bool,
+        cors: tuple[tuple[str, str], ...] = (),
+    ) -> tuple[HTTPStatus, int]:
+        headers = [
+            ("Content-Type", content_type),
+            ("Content-Length", str(len(body))),
+            ("Cache-Control", "no-store"),
+        ]
+        writer.write(self._head(status, version, headers, keep_alive, cors) + body)
+        await self._drain_writer(writer)
+        return status, len(body)
+
+    async def _respond(
+        self,
+        writer,
+        method: str,
+        url_path: str,
+        route: Route,
+        version: str,
+        headers: dict[str, str],
+        keep_alive: bool,
+        cors: tuple[tuple[str, str], ...] = (),
+        timer: RequestTimer | None = None,
+        site: Site | None = None,
+        prefix: str = "",
+    ) -> tuple[HTTPStatus, int]:
+        """Answer a GET or HEAD request for a resolved route.
+
+        Args:
+            url_path: URL path of the request, within the site
+            site: Virtual host serving the request (the server's own root
+                when omitted)
+            prefix: URL path prefix the site is served under, if any
+
+        Returns:
+            Tuple of (response status, body bytes sent)
+        """
+        head_only = method == "HEAD"
+        if site is None:
+            site = self
+
+        if route.kind == ROUTE_REDIRECT:
+            location = prefix + route.target
+            body = redirect_body(location)
+            headers = [
+                ("Location", location),
+                ("Content-Type", "text/html; charset=utf-8"),
+                ("Content-Length", str(len(body))),
+            ]
+            head = self._head(HTTPStatus.FOUND, version, headers, keep_alive, cors)
+            writer.write(head if head_only else head + body)
+            await self._drain_writer(writer)
+            return HTTPStatus.FOUND, 0 if head_only else len(body)
+
+        if route.kind == ROUTE_NOT_FOUND:
+            return await self._send_error(
+                writer, HTTPStatus.NOT_FOUND, version, keep_alive, cors
+            )
+
+        if site.preloads is not None:
+            link = site.preloads.link(route, url_path, prefix)
+            if link is not None:
+                cors = cors + (("Link", link),)
+                if self.early_hints and version == "HTTP/1.1":
+                    writer.write(site.preloads.early_hints_response(link))
+
+        fs_path = route.fs_path or translate_path(route.target, site.root)
+        entry = None
+        if site.site_cache is not None:
+            entry = site.site_cache.get(fs_path)
+            if timer is not None:
+                timer.mark("cache")
+        if entry is not None and self.preserialize:
+            response = site.site_cache.response(
+                entry,
+                self.server_version,
+                headers.get("accept-encoding"),
+                headers.get("if-none-match"),
+                headers.get("if-modified-since"),
+                cors + connection_headers(version, keep_alive),
+            )
+            if timer is None:
+                writer.writelines(response.buffers(head_only))
             else:
-                # If file doesn't exist, try index.html
-                if os.path.exists(os.path.join("pages", "index.html")):
-                    self.path = "/pages/index.html"
+                timer.mark("negotiate")
+                timing = timer.header()
+                writer.writelines(
+                    response.with_header("Server-Timing", timing, head_only)
+                )
+            await self._drain_writer(writer)
+            return response.status, 0 if head_only else len(response.body)
+        if entry is not None:
+            status, response_headers, body = entry.respond(
+                headers.get("accept-encoding"),
+                headers.get("if-none-match"),
+                headers.get("if-modified-since"),
+            )
+            if timer is not None:
+                timer.mark("negotiate")
+            head = self._head(
+                status, version, response_headers, keep_alive, cors, timer
+            )
+            writer.write(head)
+            if not head_only:
+                writer.write(body)
+            await self._drain_writer(writer)
+            return status, 0 if head_only else len(body)
+
+        if os.path.isdir(fs_path):
+            if not url_path.endswith("/"):
+                location = prefix + url_path + "/"
+                headers = [("Location", location), ("Content-Length", "0")]
+                status = HTTPStatus.MOVED_PERMANENTLY
+                writer.write(self._head(status, version, headers, keep_alive, cors))
+                await self._drain_writer(writer)
+                return status, 0
+            fs_path = os.path.join(fs_path, "index.html")
+
+        try:
+            f, fs, encoding, vary = open_representation(
+                fs_path, headers.get("accept-encoding")
+            )
+        except OSError:
+            return await self._send_error(
+                writer, HTTPStatus.NOT_FOUND, version, keep_alive, cors
+            )
+
+        if_modified_since = None
+        if "if-none-match" not in headers:
+            if_modified_since = headers.get("if-modified-since")
+        with f:
+            status, response_headers = file_response_headers(
+                fs_path, f, fs, encoding, vary, if_modified_since
+            )
+            if timer is not None:
+                timer.mark("disk")
+            head = self._head(
+                status, version, response_headers, keep_alive, cors, timer
+            )
+            writer.write(head)
+            await self._drain_writer(writer)
+            if head_only or status == HTTPStatus.NOT_MODIFIED:
+                return status, 0
+            await self._send_file(writer, f)
+            return status, os.fstat(f.fileno()).st_size
+
+    async def _drain_writer(self, writer) -> None:
+        """Wait for buffered response bytes to be written.
+
+        Raises:
+            TimeoutError: The client did not read them within
+                connection_timeout
+        """
+        await asyncio.wait_for(writer.drain(), self.connection_timeout)
+
+    async def _send_file(self, writer, f) -> None:
+        """Stream a file with loop.sendfile, or in chunks where unsupported.
+
+        asyncio's selector loop uses ``os.sendfile`` for plain TCP sockets and
+        does its own read/write fallback otherwise; loops that do not
+        implement ``sendfile`` at all (uvloop) use the chunked copy. Either
+        way the file goes out in chunks, each bounded by connection_timeout,
+        so a slow client gets the whole file as long as it keeps reading.
+        """
+        loop = asyncio.get_running_loop()
+        size = os.fstat(f.fileno()).st_size
+        offset = 0
+        try:
+            while offset < size:
+                sent = await asyncio.wait_for(
+                    loop.sendfile(
+                        writer.transport, f, offset, self.sendfile_chunk_size
+                    ),
+                    self.connection_timeout,
+                )
+                if not sent:
+                    return
+                offset += sent
+            return
+        except (AttributeError, NotImplementedError):
+            pass
+        f.seek(offset)
+        while chunk := f.read(self.chunk_size):
+            writer.write(chunk)
+            await self._drain_writer(writer)
+
+    async def _build_response(
+        self,
+        method: str,
+        url,
+        headers: dict[str, str],
+        client: str,
+        timer: RequestTimer | None = None,
+        site: Site | None = None,
+        site_path: str | None = None,
+        prefix: str = "",
+    ) -> tuple[
+        str, HTTPStatus, list[tuple[str, str]], bytes | memoryview | io.BufferedReader
+    ]:
+        """Answer a request as parts, for protocols that frame them (HTTP/2).
+
+        Follows the same routes as ``_handle_request``; responses are never
+        pre-serialized because the framing is not HTTP/1.1.
+
+        Args:
+            method: Request method
+            url: Parsed request target
+            headers: Request headers with lower-case names
+            client: Client IP address
+            timer: Phase timer, with ``--server-timing``
+            site: Virtual host serving the request (the server's own root
+                when omitted)
+            site_path: URL path within the site (the request's when omitted)
+            prefix: URL path prefix the site is served under, if any
+
+        Returns:
+            Tuple of (metrics route label, status, headers, body); the body
+            is bytes, a memoryview or an open file that the caller must close
+        """
+        url_path = url.path
+        origin = headers.get("origin")
+        cors = list(self.cors.response_headers(origin))
+        if method == "OPTIONS":
+            preflight = list(self.cors.preflight_headers(origin)) + cors
+            return PREFLIGHT_LABEL, HTTPStatus.NO_CONTENT, preflight, b""
+        if method not in ("GET", "HEAD"):
+            return "other", *_error_parts(HTTPStatus.NOT_IMPLEMENTED, cors)
+        if url_path == METRICS_PATH and self.metrics is not None:
+            body = self.metrics.exposition(self)
+            return METRICS_PATH, *_text_parts(
+                HTTPStatus.OK, body, METRICS_CONTENT_TYPE, cors
+            )
+        if url_path in (HEALTH_PATH, READY_PATH):
+            status, body = probe_response(self, url_path)
+            return url_path, *_text_parts(status, body, TEXT_CONTENT_TYPE, cors)
+        if url_path.startswith(ADMIN_PREFIX) and self.admin is not None:
+            loop = asyncio.get_running_loop()
+            status, body, content_type = await loop.run_in_executor(
+                None, self.admin.handle, self, client, url_path, url.query
+            )
+            return ADMIN_PREFIX, *_text_parts(status, body, content_type, cors)
+
+        if site is None:
+            site = self
+        if site_path is not None:
+            url_path = site_path
+        route = site.route_table.resolve(url_path)
+        if timer is not None:
+            timer.mark("route")
+        if route.kind == ROUTE_REDIRECT:
+            location = prefix + route.target
+            body = redirect_body(location)
+            redirect = [
+                ("Location", location),
+                ("Content-Type", "text/html; charset=utf-8"),
+                ("Content-Length", str(len(body))),
+            ]
+            return route.label, HTTPStatus.FOUND, redirect + cors, body
+        if route.kind == ROUTE_NOT_FOUND:
+            return route.label, *_error_parts(HTTPStatus.NOT_FOUND, cors)
+        if site.preloads is not None:
+            link = site.preloads.link(route, url_path, prefix)
+            if link is not None:
+                cors.append(("Link", link))
+
+        fs_path = route.fs_path or translate_path(route.target, site.root)
+        if site.site_cache is not None:
+            entry = site.site_cache.get(fs_path)
+            if timer is not None:
+                timer.mark("cache")
+            if entry is not None:
+                status, entry_headers, body = entry.respond(
+                    headers.get("accept-encoding"),
+                    headers.get("if-none-match"),
+                    headers.get("if-modified-since"),
+                )
+                if timer is not None:
+                    timer.mark("negotiate")
+                return route.label, status, entry_headers + cors, body
+
+        if os.path.isdir(fs_path):
+            if not url_path.endswith("/"):
+                location = prefix + url_path + "/"
+                moved = [("Location", location), ("Content-Length", "0")]
+                return route.label, HTTPStatus.MOVED_PERMANENTLY, moved + cors, b""
+            fs_path = os.path.join(fs_path, "index.html")
+        try:
+            f, fs, encoding, vary = open_representation(
+                fs_path, headers.get("accept-encoding")
+            )
+        except OSError:
+            return route.label, *_error_parts(HTTPStatus.NOT_FOUND, cors)
+        if_modified_since = None
+        if "if-none-match" not in headers:
+            if_modified_since = headers.get("if-modified-since")
+        status, file_headers = file_response_headers(
+            fs_path, f, fs, encoding, vary, if_modified_since
+        )
+        if timer is not None:
+            timer.mark("disk")
+        if status == HTTPStatus.NOT_MODIFIED:
+            f.close()
+            return route.label, status, file_headers + cors, b""
+        return route.label, status, file_headers + cors, f
+
+
+def _text_parts(
+    status: HTTPStatus, body: bytes, content_type: str, cors: list[tuple[str, str]]
+) -> tuple[HTTPStatus, list[tuple[str, str]], bytes]:
+    """Return the status, headers and body of a generated, uncacheable response."""
+    headers = [
+        ("Content-Type", content_type),
+        ("Content-Length", str(len(body))),
+        ("Cache-Control", "no-store"),
+    ]
+    return status, headers + cors, body
+
+
+def _error_parts(
+    status: HTTPStatus, cors: list[tuple[str, str]]
+) -> tuple[HTTPStatus, list[tuple[str, str]], bytes]:
+    """Return the status, headers and body of an error response."""
+    body = f"{status.value} {status.phrase}".encode()
+    headers = [
+        ("Content-Type", TEXT_CONTENT_TYPE),
+        ("Content-Length", str(len(body))),
+    ]
+    return status, headers + cors, body
+
+
+class HTTP2Session:
+    """One HTTP/2 connection of an AsyncHTTPServer.
+
+    Every request is a stream served by its own task, so the HTML and all
+    of a page's assets share one connection. Response bodies are sent as
+    the peer's flow-control windows allow. Request bodies are read and
+    discarded: the portal only answers GET, HEAD and OPTIONS.
+    """
+
+    read_size = 64 * 1024
+
+    def __init__(self, server: AsyncHTTPServer, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        peer = writer.get_extra_info("peername")
+        self.client = peer[0] if peer else ""
+        config = h2.config.H2Configuration(client_side=False, header_encoding="utf-8")
+        self.conn = h2.connection.H2Connection(config=config)
+        self._streams: dict[int, asyncio.Task] = {}
+        # Set whenever a flow-control window may have opened
+        self._window_open = asyncio.Event()
+
+    async def run(self, preface: bytes = b"") -> None:
+        """Serve streams until the client goes away or the server drains.
+
+        Args:
+            preface: Bytes of the connection already read from the socket
+        """
+        # h2 advertises SETTINGS_MAX_CONCURRENT_STREAMS = 100 by default
+        self.conn.initiate_connection()
+        self._flush()
+        try:
+            if preface and not self._receive(preface):
+                return
+            while True:
+                await self.server._drain_writer(self.writer)
+                if self._streams:
+                    timeout = self.server.connection_timeout
                 else:
-                    self.send_error(404, "File not found")
+                    timeout = self.server.idle_timeout
+                try:
+                    data = await asyncio.wait_for(
+                        self.reader.read(self.read_size), timeout
+                    )
+                except TimeoutError:
+                    self.conn.close_connection()
+                    self._flush()
+                    return
+                if not data or not self._receive(data):
                     return
+        finally:
+            for task in self._streams.values():
+                task.cancel()
 
-        # Call parent method to handle the request
-        super().do_GET()
+    def _flush(self) -> None:
+        data = self.conn.data_to_send()
+        if data:
+            self.writer.write(data)
+
+    def _receive(self, data: bytes) -> bool:
+        """Process bytes from the client; False when the connection is over."""
+        try:
+            events = self.conn.receive_data(data)
+        except h2.exceptions.ProtocolError:
+            self._flush()
+            return False
+        for event in events:
+            if isinstance(event, h2.events.RequestReceived):
+                self._start_stream(event.stream_id, event.headers)
+            elif isinstance(event, h2.events.DataReceived):
+                self.conn.acknowledge_received_data(
+                    event.flow_controlled_length, event.stream_id
+                )
+            elif isinstance(
+                event, (h2.events.WindowUpdated, h2.events.RemoteSettingsChanged)
+            ):
+                self._window_open.set()
+            elif isinstance(event, h2.events.StreamReset):
+                task = self._streams.pop(event.stream_id, None)
+                if task is not None:
+                    task.cancel()
+            elif isinstance(event, h2.events.ConnectionTerminated):
+                self._flush()
+                return False
+        self._flush()
+        return True
+
+    def _start_stream(self, stream_id: int, headers) -> None:
+        if self.server.draining:
+            self.conn.reset_stream(stream_id, h2.errors.ErrorCodes.REFUSED_STREAM)
+            return
+        task = asyncio.create_task(self._serve_stream(stream_id, headers))
+        self._streams[stream_id] = task
+        self.server._connections[self.writer] = False
+        task.add_done_callback(lambda _: self._stream_done(stream_id))
+
+    def _stream_done(self, stream_id: int) -> None:
+        self._streams.pop(stream_id, None)
+        if self._streams or self.writer not in self.server._connections:
+            return
+        self.server._connections[self.writer] = True
+        if self.server.draining:
+            self.conn.close_connection()
+            self._flush()
+            self.writer.close()
+
+    async def _serve_stream(self, stream_id: int, request_headers) -> None:
+        """Answer the request on one stream, then record it."""
+        start = time.perf_counter()
+        headers: dict[str, str] = {}
+        for name, value in request_headers:
+            # Repeated fields (HTTP/2 splits cookies) are combined
+            headers[name] = f"{headers[name]}, {value}" if name in headers else value
+        method = headers.get(":method", "GET")
+        target = headers.get(":path", "/")
+        timer = RequestTimer() if self.server.server_timing else None
+        url = urlparse(target)
+        site, site_path, prefix, site_name = select_site(
+            self.server, headers.get(":authority") or headers.get("host"), url.path
+        )
+        label, status, response_headers, body = await self.server._build_response(
+            method, url, headers, self.client, timer, site, site_path, prefix
+        )
+        nbytes = 0
+        try:
+            fields = [
+                (":status", str(status.value)),
+                ("server", self.server.server_version),
+                ("date", http_date()),
+            ]
+            fields.extend((name.lower(), value) for name, value in response_headers)
+            if timer is not None:
+                fields.append(("server-timing", timer.header()))
+            send_body = method != "HEAD" and body != b""
+            self.conn.send_headers(stream_id, fields, end_stream=not send_body)
+            self._flush()
+            if send_body:
+                if isinstance(body, (bytes, memoryview)):
+                    await self._send_data(stream_id, body, end_stream=True)
+                    nbytes = len(body)
+                else:
+                    while chunk := body.read(self.server.chunk_size):
+                        await self._send_data(stream_id, chunk)
+                        nbytes += len(chunk)
+                    self.conn.end_stream(stream_id)
+                    self._flush()
+        except (h2.exceptions.StreamClosedError, ConnectionError):
+            return
+        except TimeoutError:
+            # The window never opened or the peer stopped reading: end the
+            # stream rather than leave the client waiting on it
+            try:
+                self.conn.reset_stream(stream_id, h2.errors.ErrorCodes.CANCEL)
+            except h2.exceptions.StreamClosedError:
+                pass
+            self._flush()
+            return
+        finally:
+            if not isinstance(body, (bytes, memoryview)):
+                body.close()
+        self.server._record_request(
+            self.writer,
+            label,
+            method,
+            target,
+            "HTTP/2.0",
+            headers,
+            status,
+            nbytes,
+            start,
+            timer,
+            site_name,
+        )
+
+    async def _send_data(
+        self, stream_id: int, data: bytes, end_stream: bool = False
+    ) -> None:
+        """Send body bytes in frames no larger than the flow-control windows.
+
+        Args:
+            stream_id: Stream to send on
+            data: Bytes to send
+            end_stream: Mark the last frame as the end of the response
+        """
+        view = memoryview(data)
+        while view:
+            size = min(
+                len(view),
+                self.conn.local_flow_control_window(stream_id),
+                self.conn.max_outbound_frame_size,
+            )
+            if size <= 0:
+                self._window_open.clear()
+                await asyncio.wait_for(
+                    self._window_open.wait(), self.server.connection_timeout
+                )
+                continue
+            view, chunk = view[size:], bytes(view[:size])
+            self.conn.send_data(stream_id, chunk, end_stream=end_stream and not view)
+            self._flush()
+            await self.server._drain_writer(self.writer)
+
+
+def inherited_socket(args) -> socket.socket | None:
+    """Return the listening socket handed over by the parent process.
+
+    ``--listen-fd`` names the descriptor explicitly; the tray application
+    uses it. Otherwise systemd socket activation is honoured: when
+    ``LISTEN_PID`` is this process, the first of ``LISTEN_FDS`` sockets
+    starts at descriptor 3.
+
+    Args:
+        args: Parsed command line options
+
+    Returns:
+        The inherited socket, or None if the server should bind its own
+
+    Raises:
+        OSError: The descriptor is not an open socket
+        ValueError: The descriptor is not a stream socket
+    """
+    fd = args.listen_fd
+    if fd is None:
+        if os.environ.get("LISTEN_PID") != str(os.getpid()):
+            return None
+        if int(os.environ.get("LISTEN_FDS", "0")) < 1:
+            return None
+        # Don't hand the activation on to processes we start ourselves
+        for name in ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"):
+            os.environ.pop(name, None)
+        fd = SD_LISTEN_FDS_START
+    sock = socket.socket(fileno=fd)
+    if sock.type != socket.SOCK_STREAM:
+        sock.detach()
+        raise ValueError(f"descriptor {fd} is not a stream socket")
+    sock.set_inheritable(False)
+    return sock
+
+
+def create_server(
+    args,
+    handler_class=RedirectHandler,
+    reuse_port: bool = False,
+    sock: socket.socket | None = None,
+    tls: TLSManager | None = None,
+    pack: SitePack | None = None,
+    vhost_packs: dict[str, SitePack] | None = None,
+):
+    """Create the HTTP server for the selected engine.
+
+    Args:
+        args: Parsed command line options
+        handler_class: Request handler class
+        reuse_port: Set SO_REUSEPORT on the listening socket
+        sock: Inherited listening socket to serve on instead of binding
+            args.host and args.port
+        tls: TLS context shared with other processes (created from args
+            when omitted)
+        pack: Site pack shared with other processes (mapped from args
+            when omitted)
+        vhost_packs: ``--vhost`` site packs shared with other processes
+            (mapped from args when omitted)
+
+    Returns:
+        Bound and listening server instance
+    """
+    address = (args.host, args.port)
+    if pack is None:
+        pack = create_site_pack(args)
+    site = create_site(args, DEFAULT_SITE, pack=pack)
+    site_cache = site.site_cache
+    route_table = site.route_table
+    preloads = site.preloads
+    vhosts = create_vhosts(args, vhost_packs)
+    early_hints = args.preload_hints == "early"
+    access_log = create_access_log(args)
+    metrics = Metrics() if args.metrics else None
+    cors = create_cors_policy(args)
+    admin = AdminEndpoints() if args.admin else None
+    if tls is None:
+        tls = create_tls(args)
+    idle_timeout = args.idle_timeout
+    if idle_timeout is None:
+        idle_timeout = DEFAULT_IDLE_TIMEOUTS[args.engine]
+    if args.engine == "async":
+        httpd = AsyncHTTPServer(
+            address,
+            connection_timeout=args.timeout,
+            idle_timeout=idle_timeout,
+            keepalive_requests=args.keepalive_requests,
+            reuse_port=reuse_port,
+            site_cache=site_cache,
+            route_table=route_table,
+            sock=sock,
+            tls=tls,
+            http2=args.http2,
+        )
+        httpd.access_log = access_log
+        httpd.metrics = metrics
+        httpd.cors = cors
+        httpd.server_timing = args.server_timing
+        httpd.admin = admin
+        httpd.preloads = preloads
+        httpd.early_hints = early_hints
+        httpd.vhosts = vhosts
+        httpd.ready = True
+        return httpd
+    if args.engine == "threaded":
+        httpd = ThreadPoolHTTPServer(
+            address,
+            handler_class,
+            workers=args.threads,
+            queue_size=args.queue_size,
+            connection_timeout=args.timeout,
+            reuse_port=reuse_port,
+            bind_and_activate=sock is None,
+        )
+        if sock is not None:
+            httpd.adopt_socket(sock)
+        httpd.keepalive_requests = args.keepalive_requests
+        if args.priority_slots > 0:
+            httpd.scheduler = PriorityScheduler(
+                args.priority_slots, args.priority_aging
+            )
+    else:
+        httpd = PortalTCPServer(address, handler_class, bind_and_activate=False)
+        httpd.allow_reuse_port = reuse_port
+        try:
+            if sock is not None:
+                httpd.adopt_socket(sock)
+            else:
+                httpd.server_bind()
+                httpd.server_activate()
+        except BaseException:
+            httpd.server_close()
+            raise
+        # One thread serves everyone, so a kept-alive connection would block
+        # every other client: close after each response.
+        httpd.connection_timeout = args.timeout
+        httpd.keepalive_requests = 1
+    httpd.idle_timeout = idle_timeout
+    httpd.site_cache = site_cache
+    httpd.route_table = route_table
+    httpd.access_log = access_log
+    httpd.metrics = metrics
+    httpd.cors = cors
+    httpd.server_timing = args.server_timing
+    httpd.admin = admin
+    httpd.preloads = preloads
+    httpd.early_hints = early_hints
+    httpd.vhosts = vhosts
+    httpd.tls = tls
+    # The cache is warm and the socket is listening: ready for traffic
+    httpd.ready = True
+    return httpd
+
+
+def protocol_error(args) -> str | None:
+    """Return why the TLS and HTTP/2 options cannot be used, if they cannot."""
+    if args.http2 and args.engine != "async":
+        return "--http2 needs --engine async"
+    if args.http2 and h2 is None:
+        return "--http2 needs the h2 package (uv sync --extra server)"
+    if args.tls_key and not args.tls_cert:
+        return "--tls-key needs --tls-cert"
+    return None
+
+
+def create_tls(args) -> TLSManager | None:
+    """Create the server's TLS context, or None to serve cleartext.
+
+    ALPN offers ``h2`` ahead of ``http/1.1`` when HTTP/2 is enabled.
+
+    Args:
+        args: Parsed command line options
+
+    Returns:
+        Manager with the certificate loaded, or None without ``--tls-cert``
+
+    Raises:
+        OSError: The certificate or key cannot be loaded
+        ssl.SSLError: The cipher policy selects no ciphers
+    """
+    if not args.tls_cert:
+        return None
+    return TLSManager(
+        args.tls_cert,
+        args.tls_key,
+        ciphers=args.tls_ciphers,
+        minimum_version=TLS_VERSIONS[args.tls_min_version],
+        tickets=args.tls_tickets,
+        alpn=("h2", "http/1.1") if args.http2 else ("http/1.1",),
+        reload_interval=args.tls_reload_interval,
+    )
+
+
+def create_site_pack(args) -> SitePack | None:
+    """Map the site pack to serve from, or None to serve the files on disk.
+
+    Args:
+        args: Parsed command line options
+
+    Returns:
+        Mapped pack, or None without ``--site-pack``
+
+    Raises:
+        OSError: The pack cannot be read
+        ValueError: The file is not a valid pack
+    """
+    if not args.site_pack:
+        return None
+    return SitePack(args.site_pack)
+
+
+def create_cache(args, root: str | None = None) -> SiteCache | None:
+    """Create the in-memory site cache and preload pages/ into it.
+
+    Args:
+        args: Parsed command line options
+        root: Site root directory (defaults to the working directory)
+
+    Returns:
+        Warm cache, or None when caching is disabled
+    """
+    if args.cache_size <= 0:
+        return None
+    cache = SiteCache(
+        max_bytes=int(args.cache_size * 1024 * 1024),
+        max_entry_bytes=int(args.cache_max_file * 1024),
+        revalidate_interval=args.cache_revalidate,
+    )
+    cache.preload(os.path.join(root or os.getcwd(), "pages"))
+    return cache
+
+
+def create_site(
+    args, name: str, root: str | None = None, pack: SitePack | None = None
+) -> Site:
+    """Create one site's route table, cache and preload map.
+
+    Args:
+        args: Parsed command line options
+        name: Site name
+        root: Site root directory (defaults to the working directory)
+        pack: Serve the site from this pack instead of root
+
+    Returns:
+        Site with warm caches
+    """
+    if pack is not None:
+        # The pack is both the route table and the cache
+        site_cache = route_table = pack
+    else:
+        site_cache = create_cache(args, root)
+        route_table = RouteTable(root, refresh_interval=args.cache_revalidate)
+    preloads = None
+    if args.preload_hints != "off":
+        preloads = PreloadMap(root, refresh_interval=args.cache_revalidate, pack=pack)
+    return Site(name, root or os.getcwd(), route_table, site_cache, preloads)
+
+
+def create_vhost_packs(args) -> dict[str, SitePack]:
+    """Map the ``--vhost`` roots that are files as site packs.
+
+    Args:
+        args: Parsed command line options
+
+    Returns:
+        Mapped packs by site name
+
+    Raises:
+        OSError: A site pack cannot be read
+        ValueError: A file is not a valid site pack
+    """
+    return {name: SitePack(root) for name, root in args.vhost if os.path.isfile(root)}
 
-    def end_headers(self):
-        """Add CORS headers for development."""
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
-        super().end_headers()
 
+def create_vhosts(
+    args, packs: dict[str, SitePack] | None = None
+) -> VirtualHosts | None:
+    """Create the virtual hosts served next to the project root.
 
-def main():
+    Args:
+        args: Parsed command line options
+        packs: Site packs of the hosts whose root is a file (mapped from
+            args when omitted)
+
+    Returns:
+        Virtual hosts, or None without ``--vhost``
+
+    Raises:
+        OSError: A site pack cannot be read
+        ValueError: A file is not a valid site pack
+    """
+    if not args.vhost:
+        return None
+    if packs is None:
+        packs = create_vhost_packs(args)
+    sites = [
+        create_site(args, name, root, packs.get(name)) for name, root in args.vhost
+    ]
+    return VirtualHosts(sites)
+
+
+def vhost_error(args) -> str | None:
+    """Return why the ``--vhost`` options cannot be used, if they cannot.
+
+    Site packs are checked when ``create_vhost_packs`` maps them.
+    """
+    names = [name for name, _ in args.vhost]
+    for name in names:
+        if names.count(name) > 1:
+            return f"--vhost {name} is given more than once"
+    for name, root in args.vhost:
+        if not os.path.exists(root):
+            return f"--vhost {name}: {root} not found"
+    return None
+
+
+def site_spec(value: str) -> tuple[str, str]:
+    """Parse a ``NAME=ROOT`` virtual host option value."""
+    name, sep, root = value.partition("=")
+    name = name.strip().lower()
+    if not sep or not root:
+        raise argparse.ArgumentTypeError("expected NAME=ROOT")
+    if not name or not set(name) <= SITE_NAME_CHARS or name.startswith("-"):
+        raise argparse.ArgumentTypeError(
+            f"site name {name!r} may only use a-z, 0-9 and '-'"
+        )
+    if name in RESERVED_SITE_NAMES:
+        raise argparse.ArgumentTypeError(f"site name {name!r} is reserved")
+    return name, root
+
+
+def create_access_log(args) -> AccessLog | None:
+    """Create the access log, or None when it is disabled.
+
+    Args:
+        args: Parsed command line options
+
+    Returns:
+        Running access log
+    """
+    if args.access_log == "off":
+        return None
+    return AccessLog(
+        args.access_log,
+        log_format=args.access_log_format,
+        max_bytes=int(args.access_log_max_size * 1024 * 1024),
+        backups=args.access_log_backups,
+        sample_rate=args.access_log_sample,
+    )
+
+
+def create_cors_policy(args) -> CorsPolicy:
+    """Create the CORS policy from the command line options.
+
+    Args:
+        args: Parsed command line options
+
+    Returns:
+        Policy; one that allows no origins when CORS is disabled
+    """
+    if not args.cors:
+        return CorsPolicy(origins=())
+    return CorsPolicy(
+        origins=args.cors_origin or ("*",),
+        methods=_split_list(args.cors_methods),
+        headers=_split_list(args.cors_headers),
+        max_age=args.cors_max_age,
+    )
+
+
+def _split_list(value: str) -> list[str]:
+    """Split a comma-separated option value."""
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+class PreforkSupervisor:
+    """Run several server processes sharing one port via SO_REUSEPORT.
+
+    The kernel balances new connections across the workers' listening
+    sockets, so the site uses every core instead of one GIL. The parent
+    only supervises: it restarts workers that die and forwards SIGTERM /
+    SIGINT to them on shutdown. Given an inherited listening socket, the
+    workers accept from it directly instead.
+    """
+
+    # A worker that dies sooner than this after starting is crash-looping;
+    # wait before respawning it so a broken tree doesn't spin the CPU.
+    min_uptime = 1.0
+    restart_delay = 1.0
+
+    def __init__(
+        self,
+        args,
+        workers: int,
+        listener: socket.socket | None = None,
+        tls: TLSManager | None = None,
+        pack: SitePack | None = None,
+        vhost_packs: dict[str, SitePack] | None = None,
+    ):
+        """Initialize the supervisor.
+
+        Args:
+            args: Parsed command line options for the workers
+            workers: Number of worker processes
+            listener: Inherited listening socket shared by the workers
+            tls: TLS context the workers inherit, so session tickets
+                issued by one worker resume on any other
+            pack: Site pack the workers inherit, so they share one mapping
+            vhost_packs: ``--vhost`` site packs the workers inherit
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if not hasattr(os, "fork") or (
+            listener is None and not hasattr(socket, "SO_REUSEPORT")
+        ):
+            raise OSError("--workers needs fork() and SO_REUSEPORT (Linux, macOS)")
+
+        self.args = args
+        self.workers = workers
+        self.listener = listener
+        self.tls = tls
+        self.pack = pack
+        self.vhost_packs = vhost_packs
+        self.restarts = 0
+        self._children: dict[int, tuple[int, float]] = {}
+        self._stopping = False
+        self._reservation = None
+        if listener is None:
+            self._reservation = self._reserve_port()
+            # Workers bind the concrete port, which matters with --port 0
+            self.args.port = self._reservation.getsockname()[1]
+
+    def _reserve_port(self) -> socket.socket:
+        """Bind (without listening) to claim the port for this process group."""
+        family = socket.AF_INET6 if ":" in self.args.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        try:
+            sock.bind((self.args.host, self.args.port))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    @property
+    def port(self) -> int:
+        """Port shared by all workers."""
+        return self.args.port
+
+    def run(self) -> int:
+        """Start the workers and supervise them until asked to stop.
+
+        Returns:
+            Process exit code
+        """
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        for slot in range(self.workers):
+            self._spawn(slot)
+
+        while self._children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            slot, started = self._children.pop(pid, (None, 0.0))
+            if slot is None or self._stopping:
+                continue
+
+            print(
+                f"⚠️  Worker {slot} (pid {pid}) exited with status "
+                f"{os.waitstatus_to_exitcode(status)}; restarting"
+            )
+            if time.monotonic() - started < self.min_uptime:
+                time.sleep(self.restart_delay)
+            if not self._stopping:
+                self.restarts += 1
+                self._spawn(slot)
+
+        if self._reservation is not None:
+            self._reservation.close()
+        return 0
+
+    def _spawn(self, slot: int) -> None:
+        # Flush first so buffered output isn't duplicated into the child
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker(slot)
+        self._children[pid] = (slot, time.monotonic())
+        print(f"👷 Worker {slot} started (pid {pid})", flush=True)
+
+    def _run_worker(self, slot: int) -> None:
+        """Serve requests in a forked worker; never returns."""
+        code = 0
+        httpd = None
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            if self._reservation is not None:
+                self._reservation.close()
+            if self.args.access_log not in ("-", "off"):
+                # One file per worker: rotation is not safe across processes
+                base, ext = os.path.splitext(self.args.access_log)
+                self.args.access_log = f"{base}.worker{slot}{ext}"
+            with create_server(
+                self.args,
+                reuse_port=self.listener is None,
+                sock=self.listener,
+                tls=self.tls,
+                pack=self.pack,
+                vhost_packs=self.vhost_packs,
+            ) as httpd:
+                drained = serve(httpd, self.args.drain_timeout)
+            if drained is not None:
+                print(f"🛑 Worker {slot} {format_drain(drained)}", flush=True)
+        except KeyboardInterrupt:
+            pass
+        except BaseException as e:
+            print(f"❌ Worker {slot} failed: {e}", file=sys.stderr)
+            code = 1
+        finally:
+            if httpd is not None and httpd.access_log is not None:
+                httpd.access_log.close()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def _request_stop(self, signum, frame) -> None:
+        """Stop restarting workers and pass the signal on to them."""
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """Parse command line options.
+
+    Args:
+        argv: Argument list (defaults to sys.argv)
+
+    Returns:
+        Parsed options
+    """
+    parser = argparse.ArgumentParser(description="NIA Engineering Portal server")
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=int(os.environ.get("PORT", 9001)),
+        help="Port to listen on (default: $PORT or 9001)",
+    )
+    parser.add_argument("--host", default="", help="Address to bind (default: all)")
+    parser.add_argument(
+        "--listen-fd",
+        type=int,
+        metavar="FD",
+        help="Serve on this inherited listening socket instead of binding "
+        "(default: the systemd socket-activation socket, if any)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="simple",
+        help="Serving engine (default: simple)",
+    )
+    parser.add_argument(
+        "--http2",
+        action="store_true",
+        help="Also speak HTTP/2 in the async engine: over TLS through ALPN, "
+        "or cleartext with prior knowledge (needs the h2 package)",
+    )
+    parser.add_argument(
+        "--tls-cert",
+        metavar="PATH",
+        help="Serve HTTPS with this PEM certificate chain",
+    )
+    parser.add_argument(
+        "--tls-key",
+        metavar="PATH",
+        help="PEM private key for --tls-cert (default: read from the "
+        "certificate file)",
+    )
+    parser.add_argument(
+        "--tls-ciphers",
+        default=DEFAULT_TLS_CIPHERS,
+        metavar="CIPHERS",
+        help=f"OpenSSL cipher list for TLS 1.2 (default: {DEFAULT_TLS_CIPHERS})",
+    )
+    parser.add_argument(
+        "--tls-min-version",
+        choices=TLS_VERSIONS,
+        default="1.2",
+        help="Oldest TLS version accepted (default: 1.2)",
+    )
+    parser.add_argument(
+        "--tls-tickets",
+        type=int,
+        default=2,
+        help="TLS 1.3 session tickets issued per handshake, 0 to disable "
+        "tickets (default: 2)",
+    )
+    parser.add_argument(
+        "--tls-reload-interval",
+        type=float,
+        default=30.0,
+        help="Seconds between checks for a renewed certificate (default: 30)",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=32,
+        help="Worker threads for the threaded engine (default: 32)",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=128,
+        help="Connections allowed to wait for a worker (default: 128)",
+    )
+    parser.add_argument(
+        "--priority-slots",
+        type=int,
+        default=0,
+        help="Requests the threaded engine handles at once, most urgent "
+        "first (navigations, then CSS/JS, then service worker fetches); "
+        "0 for first come, first served (default: 0)",
+    )
+    parser.add_argument(
+        "--priority-aging",
+        type=float,
+        default=0.5,
+        help="Seconds of waiting that raise a request by one priority "
+        "class, so none starve (default: 0.5)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=30.0,
+        help="Per-connection read/write timeout in seconds (default: 30)",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=None,
+        help="Seconds an idle keep-alive connection is kept open "
+        "(default: 300 for async, 5 otherwise)",
+    )
+    parser.add_argument(
+        "--keepalive-requests",
+        type=int,
+        default=100,
+        help="Requests served per keep-alive connection (default: 100)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Server processes sharing the port via SO_REUSEPORT (default: 1)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=float,
+        default=32.0,
+        help="In-memory file cache budget in MiB, 0 to disable (default: 32)",
+    )
+    parser.add_argument(
+        "--cache-max-file",
+        type=float,
+        default=1024.0,
+        help="Largest file kept in the cache, in KiB (default: 1024)",
+    )
+    parser.add_argument(
+        "--cache-revalidate",
+        type=float,
+        default=1.0,
+        help="Seconds between mtime checks of a cached file (default: 1)",
+    )
+    parser.add_argument(
+        "--site-pack",
+        metavar="PATH",
+        help="Serve the site from a pack built by scripts/pack_site.py "
+        "instead of the files on disk",
+    )
+    parser.add_argument(
+        "--vhost",
+        action="append",
+        type=site_spec,
+        default=[],
+        metavar="NAME=ROOT",
+        help="Also serve the site at ROOT (a directory or site pack) under "
+        "/NAME/ and for Host NAME or NAME.*, with its own cache (repeatable)",
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=5.0,
+        help="Seconds in-flight requests may take to finish after SIGTERM "
+        "(default: 5)",
+    )
+    parser.add_argument(
+        "--no-metrics",
+        dest="metrics",
+        action="store_false",
+        help=f"Disable request metrics and the {METRICS_PATH} endpoint",
+    )
+    parser.add_argument(
+        "--cors-origin",
+        action="append",
+        metavar="ORIGIN",
+        help="Origin allowed to read responses cross-origin, e.g. "
+        "http://wallboard:8080; repeat for more (default: * for any)",
+    )
+    parser.add_argument(
+        "--cors-methods",
+        default="GET, HEAD",
+        help="Methods allowed in cross-origin requests (default: GET, HEAD)",
+    )
+    parser.add_argument(
+        "--cors-headers",
+        default="Content-Type",
+        help="Request headers allowed in cross-origin requests "
+        "(default: Content-Type)",
+    )
+    parser.add_argument(
+        "--cors-max-age",
+        type=int,
+        default=7200,
+        help="Seconds browsers may cache a preflight response (default: 7200)",
+    )
+    parser.add_argument(
+        "--no-cors",
+        dest="cors",
+        action="store_false",
+        help="Send no CORS headers",
+    )
+    parser.add_argument(
+        "--no-admin",
+        dest="admin",
+        action="store_false",
+        help=f"Disable the local-only diagnostics under {ADMIN_PREFIX}",
+    )
+    parser.add_argument(
+        "--preload-hints",
+        choices=PRELOAD_HINTS,
+        default="link",
+        help="Announce each page's stylesheets and scripts: in a Link "
+        "rel=preload header (link), also in a 103 Early Hints response first "
+        "(early), or not at all (off) (default: link)",
+    )
+    parser.add_argument(
+        "--server-timing",
+        action="store_true",
+        help="Time each request's phases and send them in a Server-Timing "
+        "header and the access log",
+    )
+    parser.add_argument(
+        "--access-log",
+        default="-",
+        metavar="PATH",
+        help='Access log file, "-" for stderr or "off" (default: -)',
+    )
+    parser.add_argument(
+        "--access-log-format",
+        choices=ACCESS_LOG_FORMATS,
+        default="combined",
+        help="Access log line format (default: combined)",
+    )
+    parser.add_argument(
+        "--access-log-max-size",
+        type=float,
+        default=10.0,
+        help="Rotate the access log file at this size in MiB, 0 to never "
+        "rotate (default: 10)",
+    )
+    parser.add_argument(
+        "--access-log-backups",
+        type=int,
+        default=5,
+        help="Rotated access log files to keep (default: 5)",
+    )
+    parser.add_argument(
+        "--access-log-sample",
+        type=float,
+        default=1.0,
+        help="Fraction of requests to log, 0-1 (default: 1)",
+    )
+    return parser.parse_args(argv)
+
+
+def serve(httpd, drain_timeout: float) -> dict[str, float] | None:
+    """Serve until SIGTERM, then drain gracefully.
+
+    SIGTERM starts ``httpd.drain()`` on a separate thread: the listener is
+    closed, idle keep-alive connections are closed and in-flight requests
+    get up to ``drain_timeout`` seconds to finish. Must run on the main
+    thread. KeyboardInterrupt still stops the server immediately.
+
+    Args:
+        httpd: Server from create_server
+        drain_timeout: Seconds to wait for in-flight requests
+
+    Returns:
+        Drain statistics, or None if the server stopped without draining
+    """
+    drain = {}
+
+    def request_drain(signum, frame):
+        if "thread" in drain:
+            return
+        drain["thread"] = threading.Thread(
+            target=lambda: drain.update(httpd.drain(drain_timeout)),
+            name="portal-drain",
+        )
+        drain["thread"].start()
+
+    previous = signal.signal(signal.SIGTERM, request_drain)
+    try:
+        httpd.serve_forever()
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+    thread = drain.pop("thread", None)
+    if thread is None:
+        return None
+    thread.join()
+    return drain
+
+
+def format_drain(stats: dict[str, float] | None) -> str:
+    """Describe a drain for the shutdown message."""
+    if stats is None:
+        return "stopped"
+    return (
+        f"drained in {stats['seconds'] * 1000:.0f} ms "
+        f"({stats['in_flight']} in flight, {stats['idle_closed']} idle closed, "
+        f"{stats['aborted']} cut off)"
+    )
+
+
+def print_stats(httpd) -> None:
+    """Flush the access log and print the server's counters."""
+    stats = getattr(httpd, "pool_stats", None)
+    if stats is not None:
+        print(f"📊 Pool stats: {stats.snapshot()}")
+    if httpd.site_cache is not None:
+        print(f"📊 Cache stats: {httpd.site_cache.stats()}")
+    if httpd.tls is not None:
+        print(f"📊 TLS stats: {httpd.tls.stats()}")
+    if httpd.access_log is not None:
+        httpd.access_log.close()
+        print(f"📊 Access log stats: {httpd.access_log.stats()}")
+
+
+def print_banner(args, project_root: str, engine: str) -> None:
+    """Print the startup banner."""
+    port = args.port
+    scheme = "https" if args.tls_cert else "http"
+    print("🚀 NIA Engineering Portal Server")
+    print(f"📁 Serving from: {project_root}")
+    print(f"⚙️  Engine: {engine}")
+    if args.http2:
+        print("🔀 HTTP/2: " + ("ALPN h2" if args.tls_cert else "h2c prior knowledge"))
+    if args.workers > 1:
+        print(f"👥 Worker processes: {args.workers}")
+    if args.site_pack:
+        print(f"📦 Site pack: {args.site_pack}")
+    for name, root in args.vhost:
+        print(f"🏢 Virtual host {name}: {root}")
+    print(f"🌐 Server running at: {scheme}://localhost:{port}")
+    print(f"📄 Portal available at: {scheme}://localhost:{port}/pages/")
+    print("⏹️  Press Ctrl+C to stop the server")
+    print("-" * 50)
+
+
+def main(argv=None):
     """Start the HTTP server."""
-    # Get port from environment variable or use default
-    port = int(os.environ.get("PORT", 9001))
+    args = parse_args(argv)
+    error = protocol_error(args)
+    if error is not None:
+        print(f"❌ {error}", file=sys.stderr)
+        sys.exit(1)
+    # Certificate and pack paths are relative to where the server was started
+    if args.tls_cert:
+        args.tls_cert = os.path.abspath(args.tls_cert)
+    if args.tls_key:
+        args.tls_key = os.path.abspath(args.tls_key)
+    if args.site_pack:
+        args.site_pack = os.path.abspath(args.site_pack)
+    args.vhost = [(name, os.path.abspath(root)) for name, root in args.vhost]
+    error = vhost_error(args)
+    if error is not None:
+        print(f"❌ {error}", file=sys.stderr)
+        sys.exit(1)
 
     # Change to the project root directory
     script_dir = os.path.dirname(os.path.abspath(__file__))
     project_root = os.path.dirname(script_dir)
     os.chdir(project_root)
 
+    try:
+        listener = inherited_socket(args)
+    except (OSError, ValueError) as e:
+        print(f"❌ Cannot use the inherited socket: {e}", file=sys.stderr)
+        sys.exit(1)
+    if listener is not None:
+        args.host, args.port = listener.getsockname()[:2]
+
+    # Loaded once, before forking, and shared by every connection
+    try:
+        tls = create_tls(args)
+    except OSError as e:
+        print(f"❌ Cannot set up TLS: {e}", file=sys.stderr)
+        sys.exit(1)
+    try:
+        pack = create_site_pack(args)
+    except (OSError, ValueError) as e:
+        print(f"❌ Cannot open the site pack: {e}", file=sys.stderr)
+        sys.exit(1)
+    try:
+        vhost_packs = create_vhost_packs(args)
+    except (OSError, ValueError) as e:
+        print(f"❌ Cannot open a --vhost site pack: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.workers > 1:
+        try:
+            supervisor = PreforkSupervisor(
+                args, args.workers, listener, tls, pack, vhost_packs
+            )
+        except (OSError, ValueError) as e:
+            print(f"❌ Cannot start worker processes: {e}", file=sys.stderr)
+            sys.exit(1)
+        print_banner(args, project_root, args.engine)
+        sys.exit(supervisor.run())
+
     # Create server
-    with socketserver.TCPServer(("", port), RedirectHandler) as httpd:
-        print("🚀 NIA Engineering Portal Server")
-        print(f"📁 Serving from: {project_root}")
-        print(f"🌐 Server running at: http://localhost:{port}")
-        print(f"📄 Portal available at: http://localhost:{port}/pages/")
-        print("⏹️  Press Ctrl+C to stop the server")
-        print("-" * 50)
+    with create_server(
+        args, sock=listener, tls=tls, pack=pack, vhost_packs=vhost_packs
+    ) as httpd:
+        engine = args.engine
+        if engine == "async":
+            engine = f"async ({httpd.loop_name})"
+        print_banner(args, project_root, engine)
+        if httpd.site_cache is not None:
+            cache_stats = httpd.site_cache.stats()
+            print(
+                f"🗄️  Cached {cache_stats['entries']} files "
+                f"({cache_stats['bytes'] // 1024} KiB)"
+            )
 
         try:
-            httpd.serve_forever()
+            drained = serve(httpd, args.drain_timeout)
         except KeyboardInterrupt:
             print("\n🛑 Server stopped by user")
-            sys.exit(0)
+        else:
+            print(f"🛑 Server {format_drain(drained)}")
+        print_stats(httpd)
+        sys.exit(0)
 
 
 if __name__ == "__main__":
@@ -43,9 +43,13 @@ def test_config_manager(temp_dir: Path) -> ConfigManager:
 
 
 @pytest.fixture
-def test_server_controller(test_config_manager: ConfigManager) -> ServerController:
+def test_server_controller(
+    test_config_manager: ConfigManager, temp_dir: Path
+) -> ServerController:
     """Create a ServerController instance for testing."""
-    return ServerController(test_config_manager)
+    controller = ServerController(test_config_manager)
+    controller.log_dir = temp_dir
+    return controller
 
 
 @pytest.fixture
@@ -0,0 +1,52 @@
+"""
+Unit tests for the asset precompression script (scripts/precompress.py).
+"""
+
+import gzip
+import os
+
+from scripts import precompress
+
+
+class TestPrecompress:
+    """Test cases for precompress_file and iter_assets."""
+
+    def test_writes_smaller_gzip_variant(self, temp_dir):
+        """Test that a compressible file gets a fresh .gz sibling."""
+        source = temp_dir / "common.css"
+        source.write_text("body { color: black; }\n" * 200)
+
+        written = precompress.precompress_file(source)
+
+        variant = temp_dir / "common.css.gz"
+        assert variant in written
+        assert gzip.decompress(variant.read_bytes()) == source.read_bytes()
+        assert variant.stat().st_mtime_ns == source.stat().st_mtime_ns
+
+    def test_skips_incompressible_file(self, temp_dir):
+        """Test that a variant larger than the source is not kept."""
+        source = temp_dir / "tiny.js"
+        source.write_text("x")
+
+        assert precompress.precompress_file(source) == []
+        assert not (temp_dir / "tiny.js.gz").exists()
+
+    def test_up_to_date_variant_is_not_rewritten(self, temp_dir):
+        """Test that a second run leaves fresh variants alone."""
+        source = temp_dir / "index.html"
+        source.write_text("<p>portal</p>\n" * 100)
+        precompress.precompress_file(source)
+
+        assert precompress.precompress_file(source) == []
+        assert precompress.precompress_file(source, force=True) != []
+
+    def test_iter_assets_selects_text_files(self, temp_dir):
+        """Test that only text assets are picked up."""
+        (temp_dir / "a.html").write_text("a")
+        (temp_dir / "b.png").write_bytes(b"\x89PNG")
+        (temp_dir / "a.html.gz").write_bytes(b"")
+        os.mkdir(temp_dir / "js")
+        (temp_dir / "js" / "c.js").write_text("c")
+
+        names = sorted(p.name for p in precompress.iter_assets([temp_dir]))
+        assert names == ["a.html", "c.js"]
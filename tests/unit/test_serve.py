@@ -0,0 +1,2587 @@
+"""
+Unit tests for the portal HTTP server (scripts/serve.py).
+"""
+
+import collections
+import gzip
+import http.client
+import io
+import json
+import marshal
+import os
+import pstats
+import re
+import shutil
+import signal
+import socket
+import ssl
+import subprocess
+import sys
+import threading
+import time
+import types
+from pathlib import Path
+
+import pytest
+
+from scripts import serve
+from tray_app.server_controller import ServerController
+
+SERVE_SCRIPT = Path(__file__).parent.parent.parent / "scripts" / "serve.py"
+PACK_SCRIPT = SERVE_SCRIPT.with_name("pack_site.py")
+
+
+@pytest.fixture
+def site_root(temp_dir, monkeypatch):
+    """Create a minimal portal tree and make it the working directory."""
+    pages = temp_dir / "pages"
+    (pages / "css").mkdir(parents=True)
+    (pages / "index.html").write_text("<html><body>index</body></html>")
+    (pages / "cr21-operator.html").write_text("<html><body>cr21</body></html>")
+    (pages / "css" / "common.css").write_text("body { color: black; }")
+    monkeypatch.chdir(temp_dir)
+    return temp_dir
+
+
+def start_server(argv):
+    """Start a server for the given CLI options on an ephemeral port."""
+    args = serve.parse_args(["--port", "0", "--host", "127.0.0.1", *argv])
+    httpd = serve.create_server(args)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return httpd
+
+
+def stop_server(httpd):
+    """Stop a server started with start_server."""
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def fetch(httpd, path, method="GET", headers=None):
+    """Issue a single request and return (status, headers, body)."""
+    host, port = httpd.server_address[:2]
+    conn = http.client.HTTPConnection(host, port, timeout=5)
+    try:
+        conn.request(method, path, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        conn.close()
+
+
+def wait_for(predicate, timeout=2.0):
+    """Poll until predicate() is true or fail after timeout seconds."""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached in time"
+        time.sleep(0.01)
+
+
+def fetch_h2(httpd, requests, ssl_context=None):
+    """Send (method, path) requests on one HTTP/2 connection.
+
+    Returns:
+        List of (status, headers, body), in request order
+    """
+    host, port = httpd.server_address[:2]
+    sock = socket.create_connection((host, port), timeout=5)
+    if ssl_context is not None:
+        sock = ssl_context.wrap_socket(sock, server_hostname="localhost")
+        assert sock.selected_alpn_protocol() == "h2"
+    config = serve.h2.config.H2Configuration(client_side=True, header_encoding="utf-8")
+    conn = serve.h2.connection.H2Connection(config=config)
+    conn.initiate_connection()
+    responses = {}
+    for method, path in requests:
+        stream_id = conn.get_next_available_stream_id()
+        fields = [
+            (":method", method),
+            (":path", path),
+            (":scheme", "https" if ssl_context else "http"),
+            (":authority", "localhost"),
+        ]
+        conn.send_headers(stream_id, fields, end_stream=True)
+        responses[stream_id] = [{}, b""]
+    pending = set(responses)
+    with sock:
+        sock.sendall(conn.data_to_send())
+        while pending:
+            data = sock.recv(65536)
+            assert data, "server closed the connection"
+            for event in conn.receive_data(data):
+                if isinstance(event, serve.h2.events.ResponseReceived):
+                    responses[event.stream_id][0] = dict(event.headers)
+                elif isinstance(event, serve.h2.events.DataReceived):
+                    responses[event.stream_id][1] += event.data
+                    conn.acknowledge_received_data(
+                        event.flow_controlled_length, event.stream_id
+                    )
+                elif isinstance(event, serve.h2.events.StreamEnded):
+                    pending.discard(event.stream_id)
+                elif isinstance(event, serve.h2.events.StreamReset):
+                    pytest.fail(f"stream {event.stream_id} was reset")
+            sock.sendall(conn.data_to_send())
+    return [
+        (int(headers[":status"]), headers, body) for headers, body in responses.values()
+    ]
+
+
+def make_cert(directory, name="cert"):
+    """Create a self-signed certificate for localhost; return (cert, key)."""
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl not installed")
+    cert, key = directory / f"{name}.pem", directory / f"{name}.key"
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=localhost",
+            "-addext",
+            "subjectAltName=DNS:localhost,IP:127.0.0.1",
+            "-keyout",
+            str(key),
+            "-out",
+            str(cert),
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+@pytest.fixture(scope="module")
+def tls_cert(tmp_path_factory):
+    """Self-signed certificate and key shared by a module's tests."""
+    return make_cert(tmp_path_factory.mktemp("tls"))
+
+
+def tls_get(httpd, context, path="/pages/index.html", session=None):
+    """Fetch a path over a new TLS connection, optionally resuming a session.
+
+    Returns:
+        Tuple of (status, TLS session, whether it was resumed, peer
+        certificate in DER form)
+    """
+    host, port = httpd.server_address[:2]
+    with socket.create_connection((host, port), timeout=5) as raw:
+        with context.wrap_socket(
+            raw, server_hostname="localhost", session=session
+        ) as sock:
+            served = sock.getpeercert(binary_form=True)
+            request = f"GET {path} HTTP/1.1\r\nHost: localhost\r\n"
+            sock.sendall(f"{request}Connection: close\r\n\r\n".encode())
+            response = sock.recv(65536)
+            # TLS 1.3 tickets arrive after the handshake, with the response
+            session = sock.session
+            while data := sock.recv(65536):
+                response += data
+            return int(response.split()[1]), session, sock.session_reused, served
+
+
+def fetch_tls(httpd, context, path):
+    """Issue a single HTTPS request and return (status, headers, body)."""
+    conn = http.client.HTTPSConnection(
+        "localhost", httpd.server_address[1], context=context, timeout=5
+    )
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        conn.close()
+
+
+def tls_client_context(cert, alpn=("h2", "http/1.1")):
+    """Return a client context that trusts the test certificate."""
+    context = ssl.create_default_context(cafile=str(cert))
+    context.set_alpn_protocols(list(alpn))
+    return context
+
+
+needs_h2 = pytest.mark.skipif(serve.h2 is None, reason="h2 not installed")
+
+
+@pytest.fixture(params=["simple", "threaded", "async"])
+def server(request, site_root):
+    """Run the portal server with each engine."""
+    httpd = start_server(["--engine", request.param])
+    yield httpd
+    stop_server(httpd)
+
+
+class TestRouting:
+    """Routing behaviour shared by every engine."""
+
+    def test_root_redirects_to_pages(self, server):
+        """Test that / redirects to /pages/."""
+        status, headers, _ = fetch(server, "/")
+        assert status == 302
+        assert headers["Location"] == "/pages/"
+
+    def test_serves_page(self, server):
+        """Test that an existing page is served."""
+        status, _, body = fetch(server, "/pages/cr21-operator.html")
+        assert status == 200
+        assert b"cr21" in body
+
+    def test_unknown_page_falls_back_to_index(self, server):
+        """Test that unknown files under /pages/ fall back to index.html."""
+        status, _, body = fetch(server, "/pages/missing.html")
+        assert status == 200
+        assert b"index" in body
+
+
+class TestRouteTable:
+    """Test cases for the precomputed route table."""
+
+    def test_resolves_from_index(self, site_root):
+        """Test redirects, indexed files and the index.html fallback."""
+        table = serve.RouteTable(str(site_root))
+        index = str(site_root / "pages" / "index.html")
+
+        assert table.resolve("/") == serve.REDIRECT_ROUTE
+        assert table.resolve("/pages/").fs_path == index
+        assert table.resolve("/pages/css/common.css").fs_path == str(
+            site_root / "pages" / "css" / "common.css"
+        )
+        assert table.resolve("/pages/missing.html").fs_path == index
+
+    def test_missing_paths_are_negatively_cached(self, site_root, monkeypatch):
+        """Test that repeated misses outside pages/ skip the filesystem."""
+        table = serve.RouteTable(str(site_root))
+        assert table.resolve("/wp-login.php").kind == serve.ROUTE_NOT_FOUND
+
+        def fail(path):
+            raise AssertionError(f"unexpected filesystem lookup for {path}")
+
+        monkeypatch.setattr(serve.os.path, "exists", fail)
+        assert table.resolve("/wp-login.php").kind == serve.ROUTE_NOT_FOUND
+        assert table.stats()["negative_hits"] == 1
+
+    def test_new_file_triggers_rebuild(self, site_root):
+        """Test that files added after startup are picked up."""
+        table = serve.RouteTable(str(site_root), refresh_interval=0)
+        new_page = site_root / "pages" / "cr29-operator.html"
+        assert table.resolve("/pages/cr29-operator.html").fs_path != str(new_page)
+
+        new_page.write_text("<html><body>cr29</body></html>")
+        assert table.resolve("/pages/cr29-operator.html").fs_path == str(new_page)
+        assert table.stats()["rebuilds"] == 2
+
+    def test_missing_index_is_not_found(self, temp_dir):
+        """Test that unknown pages 404 when there is no index.html."""
+        (temp_dir / "pages").mkdir()
+        table = serve.RouteTable(str(temp_dir))
+        assert table.resolve("/pages/missing.html").kind == serve.ROUTE_NOT_FOUND
+
+
+class TestSiteCache:
+    """Test cases for the in-memory site cache."""
+
+    def test_preload_and_hit(self, site_root):
+        """Test that preloaded files are served without a miss."""
+        cache = serve.SiteCache()
+        assert cache.preload("pages") == 3
+
+        entry = cache.get("pages/index.html")
+        assert entry.body == b"<html><body>index</body></html>"
+        assert entry.content_type == "text/html"
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 0
+
+    def test_byte_budget_evicts_least_recently_used(self, temp_dir):
+        """Test that the LRU keeps the total size within budget."""
+        for name in ("a", "b", "c"):
+            (temp_dir / name).write_bytes(b"x" * 100)
+        cache = serve.SiteCache(max_bytes=250)
+
+        cache.get(str(temp_dir / "a"))
+        cache.get(str(temp_dir / "b"))
+        cache.get(str(temp_dir / "a"))  # a is now most recently used
+        cache.get(str(temp_dir / "c"))
+
+        stats = cache.stats()
+        assert stats["entries"] == 2
+        assert stats["bytes"] == 200
+        assert stats["evictions"] == 1
+        cache.get(str(temp_dir / "a"))
+        assert cache.stats()["hits"] == 2
+
+    def test_large_files_are_not_cached(self, temp_dir):
+        """Test that files above the per-entry limit bypass the cache."""
+        (temp_dir / "big.bin").write_bytes(b"x" * 2048)
+        cache = serve.SiteCache(max_entry_bytes=1024)
+        assert cache.get(str(temp_dir / "big.bin")) is None
+        assert len(cache) == 0
+
+    def test_mtime_change_invalidates(self, temp_dir):
+        """Test that a modified file is reloaded."""
+        path = temp_dir / "page.html"
+        path.write_text("old")
+        cache = serve.SiteCache(revalidate_interval=0)
+        assert cache.get(str(path)).body == b"old"
+
+        path.write_text("new content")
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 10**9))
+        assert cache.get(str(path)).body == b"new content"
+        assert cache.stats()["invalidations"] == 1
+        assert cache.stats()["bytes"] == len(b"new content")
+
+    def test_deleted_file_is_dropped(self, temp_dir):
+        """Test that a removed file is no longer served from memory."""
+        path = temp_dir / "page.html"
+        path.write_text("gone soon")
+        cache = serve.SiteCache(revalidate_interval=0)
+        assert cache.get(str(path)) is not None
+
+        path.unlink()
+        assert cache.get(str(path)) is None
+        assert cache.stats()["bytes"] == 0
+
+    def test_server_uses_cache(self, server):
+        """Test that responses come from the cache and honour Last-Modified."""
+        status, headers, _ = fetch(server, "/pages/css/common.css")
+        assert status == 200
+        assert server.site_cache.stats()["hits"] >= 1
+
+        status, _, body = fetch(
+            server,
+            "/pages/css/common.css",
+            headers={"If-Modified-Since": headers["Last-Modified"]},
+        )
+        assert status == 304
+        assert body == b""
+
+
+class TestSitePack:
+    """Test cases for packed sites served through mmap."""
+
+    @staticmethod
+    def pack_site(*argv):
+        """Run scripts/pack_site.py and return its output."""
+        result = subprocess.run(
+            [sys.executable, str(PACK_SCRIPT), *argv],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return result.stdout
+
+    @staticmethod
+    def write_pack(path, files):
+        """Pack {URL path: body} with a gzip variant of each body."""
+        entries = [
+            (url, 1_700_000_000 * 10**9, {None: body, "gzip": gzip.compress(body)})
+            for url, body in files.items()
+        ]
+        serve.write_site_pack(str(path), entries)
+        return serve.SitePack(str(path))
+
+    def test_round_trip(self, temp_dir):
+        """Test that bodies, variants, validators and mtimes survive packing."""
+        page = b"<html><body>cr21</body></html>"
+        pack = self.write_pack(
+            temp_dir / "site.pack",
+            {"/pages/cr21.html": page, "/index.html": b"root", "/pages/a/b.css": b""},
+        )
+
+        assert pack.names() == ["/index.html", "/pages/a/b.css", "/pages/cr21.html"]
+        entry = pack.get("/pages/cr21.html")
+        assert isinstance(entry.body, memoryview) and entry.body == page
+        assert entry.etag == serve.make_etag(page)
+        assert gzip.decompress(entry.variants["gzip"]) == page
+        assert entry.variant_etags["gzip"] == serve.make_etag(entry.variants["gzip"])
+        assert entry.content_type == "text/html"
+        assert entry.mtime == 1_700_000_000
+        assert pack.get("/pages/a/b.css").body == b""
+        assert pack.get("/missing") is None
+        assert pack.stats()["hits"] == 2 and pack.stats()["misses"] == 1
+
+    def test_routes_like_the_route_table(self, temp_dir):
+        """Test redirects, labels, directory indexes and the fallback."""
+        pack = self.write_pack(
+            temp_dir / "site.pack",
+            {"/pages/index.html": b"index", "/pages/css/a b.css": b"css"},
+        )
+        index = pack.resolve("/pages/index.html")
+
+        assert pack.resolve("/") == serve.REDIRECT_ROUTE
+        assert pack.resolve("/pages/") == index
+        assert index.label == "/pages/"
+        assert pack.resolve("/pages/css/a%20b.css").label == "/pages/css/"
+        assert pack.resolve("/pages/missing.html") == index
+        assert pack.resolve("/wp-login.php").kind == serve.ROUTE_NOT_FOUND
+
+    def test_rejects_files_that_are_not_packs(self, temp_dir):
+        """Test that empty, foreign and truncated files are refused."""
+        path = temp_dir / "site.pack"
+        path.write_bytes(b"")
+        with pytest.raises(ValueError):
+            serve.SitePack(str(path))
+        path.write_bytes(b"PK\x03\x04" + bytes(60))
+        with pytest.raises(ValueError):
+            serve.SitePack(str(path))
+        self.write_pack(path, {"/index.html": b"x" * 100})
+        path.write_bytes(path.read_bytes()[:-10])
+        with pytest.raises(ValueError, match="truncated"):
+            serve.SitePack(str(path))
+
+    @pytest.mark.parametrize("engine", ["simple", "threaded", "async"])
+    def test_server_needs_no_files_on_disk(self, site_root, engine):
+        """Test that a packed site is served after pages/ is gone."""
+        (site_root / "pages" / "index.html").write_text(
+            '<html><head><link rel="stylesheet" href="css/common.css" />'
+            "</head><body>index</body></html>" + " " * 200
+        )
+        pack_path = site_root / "site.pack"
+        self.pack_site("pages", "--root", str(site_root), "-o", str(pack_path))
+        shutil.rmtree(site_root / "pages")
+
+        httpd = start_server(["--engine", engine, "--site-pack", str(pack_path)])
+        try:
+            status, headers, body = fetch(httpd, "/pages/")
+            _, _, fallback = fetch(httpd, "/pages/missing.html")
+            gzipped = fetch(httpd, "/pages/", headers={"Accept-Encoding": "gzip"})
+            not_modified = fetch(
+                httpd, "/pages/", headers={"If-None-Match": headers["ETag"]}
+            )
+            head = fetch(httpd, "/pages/css/common.css", "HEAD")
+        finally:
+            stop_server(httpd)
+
+        assert status == 200 and body.startswith(b"<html><head>")
+        assert headers["Link"] == "</pages/css/common.css>; rel=preload; as=style"
+        assert fallback == body
+        assert gzip.decompress(gzipped[2]) == body
+        assert not_modified[0] == 304
+        assert head[0] == 200 and head[2] == b""
+        assert head[1]["Content-Length"] == "22"
+
+    def test_pack_site_skips_precompressed_siblings(self, site_root):
+        """Test that the build packs sources with their own variants."""
+        css = site_root / "pages" / "css" / "common.css"
+        css.write_text("body { color: black; }\n" * 50)
+        (site_root / "pages" / "css" / "common.css.gz").write_bytes(b"stale")
+        archive = gzip.compress(b"log lines")
+        (site_root / "pages" / "logs.txt.gz").write_bytes(archive)
+        (site_root / "index.html").write_text("x")
+        pack_path = site_root / "build" / "site.pack"
+
+        output = self.pack_site("--root", str(site_root))
+        assert "Packed 5 files" in output
+
+        pack = serve.SitePack(str(pack_path))
+        assert "/pages/css/common.css.gz" not in pack
+        assert pack.get("/pages/logs.txt.gz").body == archive
+        assert "/index.html" in pack
+        entry = pack.get("/pages/css/common.css")
+        assert gzip.decompress(entry.variants["gzip"]) == css.read_bytes()
+        assert pack.get("/index.html").variants == {}
+
+
+class TestPrecompressedVariants:
+    """Test cases for Accept-Encoding negotiation."""
+
+    def test_select_encoding(self):
+        """Test q-values, wildcards and preference order."""
+        available = {"br": b"", "gzip": b""}
+        assert serve.select_encoding("gzip, deflate, br", available) == "br"
+        assert serve.select_encoding("gzip", available) == "gzip"
+        assert serve.select_encoding("br;q=0, gzip;q=0.5", available) == "gzip"
+        assert serve.select_encoding("*", {"gzip": b""}) == "gzip"
+        assert serve.select_encoding("identity", available) is None
+        assert serve.select_encoding(None, available) is None
+        assert serve.select_encoding("gzip", {}) is None
+
+    def test_serves_gzip_variant(self, server, site_root):
+        """Test that a fresh .gz sibling is sent with Vary and Content-Encoding."""
+        source = site_root / "pages" / "cr21-operator.html"
+        variant = site_root / "pages" / "cr21-operator.html.gz"
+        variant.write_bytes(gzip.compress(source.read_bytes()))
+        server.site_cache.clear()
+
+        status, headers, body = fetch(
+            server, "/pages/cr21-operator.html", headers={"Accept-Encoding": "gzip"}
+        )
+        assert status == 200
+        assert headers["Content-Encoding"] == "gzip"
+        assert headers["Vary"] == "Accept-Encoding"
+        assert gzip.decompress(body) == source.read_bytes()
+
+        status, headers, body = fetch(server, "/pages/cr21-operator.html")
+        assert "Content-Encoding" not in headers
+        assert headers["Vary"] == "Accept-Encoding"
+        assert body == source.read_bytes()
+
+    @pytest.mark.parametrize("engine", ["simple", "threaded", "async"])
+    def test_serves_variants_with_cache_disabled(self, site_root, engine):
+        """Test that files read from disk are negotiated too."""
+        source = site_root / "pages" / "cr21-operator.html"
+        (site_root / "pages" / "cr21-operator.html.gz").write_bytes(
+            gzip.compress(source.read_bytes())
+        )
+        stale = site_root / "pages" / "cr21-operator.html.br"
+        stale.write_bytes(b"old")
+        os.utime(stale, ns=(0, 0))
+        httpd = start_server(["--engine", engine, "--cache-size", "0"])
+        try:
+            accept = {"Accept-Encoding": "br, gzip"}
+            gzipped = fetch(httpd, "/pages/cr21-operator.html", headers=accept)
+            identity = fetch(httpd, "/pages/cr21-operator.html")
+            plain = fetch(httpd, "/pages/css/common.css", headers=accept)
+        finally:
+            stop_server(httpd)
+
+        status, headers, body = gzipped
+        assert status == 200
+        assert headers["Content-Encoding"] == "gzip"
+        assert headers["Vary"] == "Accept-Encoding"
+        assert headers["Content-Type"].startswith("text/html")
+        assert gzip.decompress(body) == source.read_bytes()
+        status, headers, body = identity
+        assert "Content-Encoding" not in headers
+        assert headers["Vary"] == "Accept-Encoding"
+        assert body == source.read_bytes()
+        status, headers, _ = plain
+        assert status == 200
+        assert "Content-Encoding" not in headers and "Vary" not in headers
+
+    def test_stale_variant_is_ignored(self, site_root):
+        """Test that a variant older than its source is not served."""
+        source = site_root / "pages" / "index.html"
+        variant = site_root / "pages" / "index.html.gz"
+        variant.write_bytes(gzip.compress(b"old"))
+        os.utime(variant, ns=(0, 0))
+
+        entry = serve.SiteCache().get(str(source))
+        assert entry.variants == {}
+        assert entry.representation("gzip") == (source.read_bytes(), [])
+
+    def test_raw_gzip_file_is_not_labelled_html(self):
+        """Test that requesting a .gz file directly is typed as an archive."""
+        assert serve.guess_content_type("index.html.gz") == "application/gzip"
+
+
+class TestConditionalRequests:
+    """Test cases for ETag / Last-Modified validation."""
+
+    def test_etag_is_stable_content_hash(self, site_root):
+        """Test that the ETag depends only on content."""
+        first = serve.SiteCache().get("pages/index.html")
+        second = serve.SiteCache().get("pages/index.html")
+        assert first.etag == second.etag
+        assert first.etag.startswith('"') and first.etag.endswith('"')
+        assert first.etag != serve.SiteCache().get("pages/cr21-operator.html").etag
+
+    def test_etag_matches(self):
+        """Test If-None-Match list, wildcard and weak comparison."""
+        assert serve.etag_matches('"a", "b"', '"b"')
+        assert serve.etag_matches('W/"b"', '"b"')
+        assert serve.etag_matches("*", '"b"')
+        assert not serve.etag_matches('"a"', '"b"')
+
+    def test_if_none_match_returns_304(self, server):
+        """Test that a matching ETag gets an empty 304 with validators."""
+        status, headers, _ = fetch(server, "/pages/index.html")
+        assert status == 200
+        etag = headers["ETag"]
+        assert "Last-Modified" in headers
+
+        status, headers, body = fetch(
+            server, "/pages/index.html", headers={"If-None-Match": etag}
+        )
+        assert status == 304
+        assert headers["ETag"] == etag
+        assert body == b""
+
+    def test_if_none_match_takes_precedence(self, server):
+        """Test that a stale ETag wins over a current If-Modified-Since."""
+        _, headers, _ = fetch(server, "/pages/index.html")
+        status, _, body = fetch(
+            server,
+            "/pages/index.html",
+            headers={
+                "If-None-Match": '"stale"',
+                "If-Modified-Since": headers["Last-Modified"],
+            },
+        )
+        assert status == 200
+        assert b"index" in body
+
+    @pytest.mark.parametrize("engine", ["simple", "threaded", "async"])
+    def test_if_modified_since_with_cache_disabled(self, site_root, engine):
+        """Test that files read from disk answer If-Modified-Since with 304."""
+        httpd = start_server(["--engine", engine, "--cache-size", "0"])
+        try:
+            _, headers, _ = fetch(httpd, "/pages/index.html")
+            current = {"If-Modified-Since": headers["Last-Modified"]}
+            not_modified = fetch(httpd, "/pages/index.html", headers=current)
+            old = {"If-Modified-Since": "Thu, 01 Jan 1970 00:00:00 GMT"}
+            modified = fetch(httpd, "/pages/index.html", headers=old)
+            etag = {**current, "If-None-Match": '"stale"'}
+            precedence = fetch(httpd, "/pages/index.html", headers=etag)
+        finally:
+            stop_server(httpd)
+
+        assert "ETag" not in headers
+        status, headers, body = not_modified
+        assert status == 304
+        assert body == b""
+        assert "Last-Modified" in headers
+        assert modified[0] == 200 and b"index" in modified[2]
+        assert precedence[0] == 200
+
+    def test_variants_have_distinct_etags(self, site_root):
+        """Test that each content-coding gets its own strong ETag."""
+        source = site_root / "pages" / "index.html"
+        (site_root / "pages" / "index.html.gz").write_bytes(
+            gzip.compress(source.read_bytes())
+        )
+        entry = serve.SiteCache().get(str(source))
+
+        _, identity, _ = entry.respond()
+        _, gzipped, _ = entry.respond("gzip")
+        identity, gzipped = dict(identity), dict(gzipped)
+        assert identity["ETag"] != gzipped["ETag"]
+
+        status, headers, body = entry.respond("gzip", gzipped["ETag"])
+        assert status == 304
+        assert dict(headers)["Vary"] == "Accept-Encoding"
+        assert body == b""
+
+
+class TestSerializedResponses:
+    """Test cases for pre-serialized cached responses."""
+
+    def test_serialize_response(self):
+        """Test the wire format and the head-only buffers."""
+        body = b"ok"
+        response = serve.serialize_response(
+            serve.HTTPStatus.OK,
+            [("Content-Length", "2")],
+            body,
+            "NIAPortal/test",
+            "Sat, 17 Oct 2026 12:00:00 GMT",
+        )
+        (head,) = response.buffers(head_only=True)
+        assert head.startswith(b"HTTP/1.1 200 OK\r\nServer: NIAPortal/test\r\n")
+        assert b"Content-Length: 2\r\n" in head
+        assert head.endswith(b"\r\n\r\n")
+        assert response.buffers() == (head, b"ok")
+        assert response.buffers()[1] is body
+
+    def test_response_is_reused_and_references_the_body(self, site_root):
+        """Test that a response is serialized once without copying the body."""
+        cache = serve.SiteCache()
+        entry = cache.get(str(site_root / "pages" / "index.html"))
+        before = cache.stats()["bytes"]
+
+        first = cache.response(entry, "NIAPortal/test")
+        assert cache.response(entry, "NIAPortal/test") is first
+        assert first.body is entry.body
+        assert cache.stats()["bytes"] == before
+
+        not_modified = cache.response(entry, "NIAPortal/test", None, entry.etag)
+        assert not_modified.status == serve.HTTPStatus.NOT_MODIFIED
+        assert not_modified.buffers() == (not_modified.head,)
+        assert not_modified.head.endswith(b"\r\n\r\n")
+
+    def test_variants_leave_the_budget_unchanged(self, server, site_root):
+        """Test that serving many representations does not grow the cache."""
+        source = site_root / "pages" / "cr21-operator.html"
+        variant = site_root / "pages" / "cr21-operator.html.gz"
+        variant.write_bytes(gzip.compress(source.read_bytes()))
+        server.site_cache.clear()
+        fetch(server, "/pages/cr21-operator.html")
+        before = server.site_cache.stats()
+        etag = fetch(server, "/pages/cr21-operator.html")[1]["ETag"]
+
+        for headers in (
+            {"Accept-Encoding": "gzip"},
+            {"If-None-Match": etag},
+            {"Origin": "http://a"},
+            {"Connection": "close"},
+        ):
+            assert fetch(server, "/pages/cr21-operator.html", headers=headers)[0] in (
+                200,
+                304,
+            )
+        fetch(server, "/pages/cr21-operator.html", "HEAD")
+
+        after = server.site_cache.stats()
+        assert after["bytes"] == before["bytes"]
+        assert after["evictions"] == 0
+        entry = server.site_cache.get(os.path.abspath(source))
+        # identity, gzip and 304, plus the per-connection variants
+        assert len(entry.responses) >= 3
+        memory = server.site_cache.memory()
+        assert memory["bytes"] == memory["bodies"] + memory["variants"]
+
+    def test_send_buffers_survives_partial_sends(self):
+        """Test that every byte arrives when sendmsg sends only part of it."""
+        head, body = b"HTTP/1.1 200 OK\r\n\r\n", os.urandom(1 << 20)
+        left, right = socket.socketpair()
+        received = bytearray()
+
+        def drain():
+            while chunk := right.recv(65536):
+                received.extend(chunk)
+
+        reader = threading.Thread(target=drain)
+        reader.start()
+        try:
+            left.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+            serve.send_buffers(left, (head, memoryview(body)))
+        finally:
+            left.close()
+            reader.join(timeout=5)
+            right.close()
+        assert bytes(received) == head + body
+
+    def test_cached_get_and_head(self, server):
+        """Test cached GET and HEAD responses on every engine."""
+        status, headers, body = fetch(server, "/pages/cr21-operator.html")
+        assert status == 200
+        assert body == b"<html><body>cr21</body></html>"
+        assert headers["Access-Control-Allow-Origin"] == "*"
+        assert "Date" in headers
+
+        origin = {"Origin": "http://wallboard:8080"}
+        _, headers, body = fetch(server, "/pages/cr21-operator.html", headers=origin)
+        assert headers["Access-Control-Allow-Origin"] == "*"
+        assert body == b"<html><body>cr21</body></html>"
+
+        status, headers, body = fetch(server, "/pages/cr21-operator.html", "HEAD")
+        assert status == 200
+        assert headers["Content-Length"] == "30"
+        assert body == b""
+
+    def test_closing_responses_are_serialized_too(self, server):
+        """Test that HTTP/1.0 and last responses use a Connection: close copy."""
+        host, port = server.server_address[:2]
+        for version in ("HTTP/1.0", "HTTP/1.1"):
+            with socket.create_connection((host, port), timeout=5) as sock:
+                sock.sendall(
+                    f"GET /pages/cr21-operator.html {version}\r\n"
+                    "Host: x\r\nConnection: close\r\n\r\n".encode()
+                )
+                data = b""
+                while chunk := sock.recv(65536):
+                    data += chunk
+            assert data.startswith(b"HTTP/1.1 200 OK\r\n")
+            assert data.count(b"Connection: close\r\n") == 1
+            assert data.endswith(b"<html><body>cr21</body></html>")
+
+        entry = server.site_cache.get(os.path.abspath("pages/cr21-operator.html"))
+        cors = serve.CorsPolicy().response_headers(None)
+        assert [key[3] for key in entry.responses] == [cors + serve.CONNECTION_CLOSE]
+
+    def test_connection_headers(self):
+        """Test the Connection header chosen for each version and outcome."""
+        assert serve.connection_headers("HTTP/1.1", True) == ()
+        assert serve.connection_headers("HTTP/1.1", False) == serve.CONNECTION_CLOSE
+        assert serve.connection_headers("HTTP/1.0", False) == serve.CONNECTION_CLOSE
+        assert serve.connection_headers("HTTP/1.0", True) == (
+            serve.CONNECTION_KEEP_ALIVE
+        )
+
+
+class TestCors:
+    """Test cases for the CORS policy and OPTIONS preflights."""
+
+    PREFLIGHT = {
+        "Origin": "http://wallboard:8080",
+        "Access-Control-Request-Method": "GET",
+    }
+
+    def test_preflight_on_every_engine(self, server):
+        """Test that OPTIONS is answered with a cacheable preflight."""
+        host, port = server.server_address[:2]
+        conn = http.client.HTTPConnection(host, port, timeout=5)
+        try:
+            conn.request("OPTIONS", "/pages/index.html", headers=self.PREFLIGHT)
+            response = conn.getresponse()
+            assert response.read() == b""
+            assert response.status == 204
+            assert response.getheader("Access-Control-Allow-Origin") == "*"
+            assert response.getheader("Access-Control-Allow-Methods") == "GET, HEAD"
+            assert response.getheader("Access-Control-Max-Age") == "7200"
+            assert response.getheader("Allow") == "GET, HEAD, OPTIONS"
+            if isinstance(server, serve.ThreadPoolHTTPServer):
+                assert not response.will_close
+        finally:
+            conn.close()
+
+    def test_preflight_does_not_touch_the_filesystem(self, server):
+        """Test that preflights for missing paths succeed too."""
+        status, headers, _ = fetch(server, "/no/such/file", "OPTIONS", self.PREFLIGHT)
+        assert status == 204
+        assert headers["Access-Control-Allow-Origin"] == "*"
+
+    @pytest.mark.parametrize("origins", [[], ["--cors-origin", "http://a"]])
+    @pytest.mark.parametrize("engine", ["simple", "threaded", "async"])
+    def test_responses_are_cache_consistent(self, site_root, engine, origins):
+        """Test that a copy cached without Origin is valid for a CORS request.
+
+        Any-origin responses must carry the grant whether or not Origin is
+        sent; origin-specific ones must say they vary on it.
+        """
+        httpd = start_server(["--engine", engine, *origins])
+        try:
+            path = "/pages/css/common.css"
+            _, same_origin, _ = fetch(httpd, path)
+            _, cross_origin, _ = fetch(httpd, path, headers={"Origin": "http://a"})
+        finally:
+            stop_server(httpd)
+
+        if origins:
+            assert same_origin["Vary"] == cross_origin["Vary"] == "Origin"
+            assert "Access-Control-Allow-Origin" not in same_origin
+            assert cross_origin["Access-Control-Allow-Origin"] == "http://a"
+        else:
+            assert same_origin["Access-Control-Allow-Origin"] == "*"
+            assert cross_origin["Access-Control-Allow-Origin"] == "*"
+
+    def test_restricted_origins(self):
+        """Test that only listed origins are granted access."""
+        policy = serve.CorsPolicy(origins=["http://wallboard:8080"], max_age=60)
+        allowed = dict(policy.response_headers("http://wallboard:8080"))
+        assert allowed == {
+            "Access-Control-Allow-Origin": "http://wallboard:8080",
+            "Vary": "Origin",
+        }
+        assert policy.response_headers("http://evil.example") == (("Vary", "Origin"),)
+        assert policy.response_headers(None) == (("Vary", "Origin"),)
+
+        denied = policy.preflight("http://evil.example", "test").head
+        assert b"Access-Control-Allow-Origin" not in denied
+        assert b"Access-Control-Allow-Methods" not in denied
+        granted = policy.preflight("http://wallboard:8080", "test").head
+        assert b"Access-Control-Max-Age: 60\r\n" in granted
+
+    def test_preflight_is_serialized_once(self):
+        """Test that the same preflight response is reused."""
+        policy = serve.CorsPolicy()
+        first = policy.preflight("http://a", "test")
+        assert policy.preflight("http://b", "test") is first
+        assert policy.preflight(None, "test") is not first
+
+    def test_cached_responses_are_keyed_by_cors_headers(self, site_root):
+        """Test that pre-serialized responses carry the request's CORS headers."""
+        cache = serve.SiteCache()
+        entry = cache.get(str(site_root / "pages" / "index.html"))
+        cors = serve.CorsPolicy().response_headers("http://a")
+
+        plain = cache.response(entry, "test")
+        cross = cache.response(entry, "test", extra_headers=cors)
+        assert serve.CorsPolicy().response_headers(None) is cors
+        assert cross is not plain
+        assert b"Access-Control-Allow-Origin: *\r\n" in cross.head
+        assert b"Access-Control-Allow-Origin" not in plain.head
+
+    @pytest.mark.parametrize("engine", ["threaded", "async"])
+    def test_cors_can_be_disabled(self, site_root, engine):
+        """Test that --no-cors sends no CORS headers but still answers OPTIONS."""
+        httpd = start_server(["--engine", engine, "--no-cors"])
+        try:
+            status, headers, _ = fetch(httpd, "/pages/", "OPTIONS", self.PREFLIGHT)
+            _, get_headers, _ = fetch(httpd, "/pages/", headers=self.PREFLIGHT)
+        finally:
+            stop_server(httpd)
+        assert status == 204
+        assert headers["Allow"] == "GET, HEAD, OPTIONS"
+        assert "Access-Control-Allow-Origin" not in headers
+        assert "Access-Control-Allow-Origin" not in get_headers
+
+    def test_policy_options(self):
+        """Test that the command line options configure the policy."""
+        args = serve.parse_args(
+            ["--cors-origin", "http://a", "--cors-origin", "http://b"]
+            + ["--cors-methods", "GET", "--cors-headers", "X-Id, Content-Type"]
+        )
+        policy = serve.create_cors_policy(args)
+        assert policy.origins == {"http://a", "http://b"}
+        assert policy.methods == ("GET",)
+        assert policy.headers == ("X-Id", "Content-Type")
+
+
+class TestServerTiming:
+    """Test cases for --server-timing phase breakdowns."""
+
+    @staticmethod
+    def phases(header):
+        """Parse a Server-Timing header into {phase: milliseconds}."""
+        result = {}
+        for metric in header.split(", "):
+            name, _, duration = metric.partition(";dur=")
+            result[name] = float(duration)
+        return result
+
+    @pytest.mark.parametrize("engine", ["simple", "threaded", "async"])
+    def test_header_on_cached_and_disk_responses(self, site_root, engine):
+        """Test that cached and uncached files report their phases."""
+        (site_root / "pages" / "big.bin").write_bytes(b"x" * 4096)
+        httpd = start_server(
+            ["--engine", engine, "--server-timing", "--cache-max-file", "1"]
+        )
+        try:
+            _, cached, _ = fetch(httpd, "/pages/index.html")
+            _, head, body = fetch(httpd, "/pages/index.html", "HEAD")
+            _, disk, _ = fetch(httpd, "/pages/big.bin")
+        finally:
+            stop_server(httpd)
+
+        assert list(self.phases(cached["Server-Timing"])) == [
+            "route",
+            "cache",
+            "negotiate",
+        ]
+        assert "Server-Timing" in head and body == b""
+        assert list(self.phases(disk["Server-Timing"])) == ["route", "cache", "disk"]
+        assert all(value >= 0 for value in self.phases(disk["Server-Timing"]).values())
+
+    def test_off_by_default(self, server):
+        """Test that no timing header is sent unless enabled."""
+        _, headers, _ = fetch(server, "/pages/index.html")
+        assert "Server-Timing" not in headers
+
+    @pytest.mark.parametrize("engine", ["threaded", "async"])
+    def test_access_log_includes_write_phase(self, site_root, temp_dir, engine):
+        """Test that the access log gets every phase, including the write."""
+        log_path = temp_dir / "access.log"
+        httpd = start_server(
+            ["--engine", engine, "--server-timing", "--access-log", str(log_path)]
+            + ["--access-log-format", "json"]
+        )
+        try:
+            fetch(httpd, "/pages/index.html")
+            wait_for(lambda: httpd.open_connections == 0)
+        finally:
+            stop_server(httpd)
+            httpd.access_log.close()
+
+        fields = json.loads(log_path.read_text().splitlines()[0])
+        assert list(fields["timing_ms"]) == ["route", "cache", "negotiate", "write"]
+
+    def test_combined_log_timing_field(self, temp_dir):
+        """Test the timing suffix of combined log lines."""
+        record = (0.0, "10.0.0.5", "GET", "/pages/", "HTTP/1.1", 200, 512, 0.002)
+        record += (None, None, [("route", 0.0001), ("write", 0.0012)])
+        log = serve.AccessLog(str(temp_dir / "access.log"))
+        line = log.format(record)
+        log.close()
+        assert line.endswith('"-" "-" timing=route:0.100,write:1.200')
+
+    def test_with_header_inserts_before_body(self):
+        """Test that a per-request header is spliced into a serialized response."""
+        response = serve.serialize_response(
+            serve.HTTPStatus.OK, [("Content-Length", "2")], b"ok", "test"
+        )
+        head, body = response.with_header("Server-Timing", "route;dur=0.010")
+        assert head.endswith(b"Server-Timing: route;dur=0.010\r\n\r\n")
+        assert body == b"ok"
+        (head,) = response.with_header("Server-Timing", "x", head_only=True)
+        assert head.endswith(b"Server-Timing: x\r\n\r\n")
+        assert b"Server-Timing" not in response.head
+
+
+class TestPreloadHints:
+    """Test cases for Link preload headers and 103 Early Hints."""
+
+    LINK = (
+        "</pages/css/common.css>; rel=preload; as=style, "
+        "</pages/js/performance.js>; rel=preload; as=script"
+    )
+
+    @pytest.fixture
+    def page(self, site_root):
+        """Add a page that references a stylesheet and a script."""
+        (site_root / "pages" / "js").mkdir()
+        (site_root / "pages" / "js" / "performance.js").write_text("// js")
+        page = site_root / "pages" / "b23.html"
+        page.write_text(
+            '<html><head><script src="js/performance.js"></script>'
+            '<link rel="stylesheet" href="css/common.css" />'
+            '<link rel="stylesheet" href="https://cdn.example/x.css" />'
+            '<link rel="stylesheet" href="css/missing.css" />'
+            '<link rel="icon" href="css/common.css" /></head>'
+            '<body><script src="js/performance.js#dup"></script></body></html>'
+        )
+        return page
+
+    def test_map_lists_local_stylesheets_then_scripts(self, site_root, page):
+        """Test that only existing same-origin files are listed, once each."""
+        table = serve.RouteTable(str(site_root))
+        preloads = serve.PreloadMap(str(site_root))
+
+        route = table.resolve("/pages/b23.html")
+        assert preloads.link(route, "/pages/b23.html") == self.LINK
+        index = table.resolve("/pages/")
+        assert preloads.link(index, "/pages/") is None
+        assert preloads.stats() == {"pages": 1, "rebuilds": 1, "early_hints": 0}
+
+    def test_fallback_page_gets_no_link(self, site_root, page):
+        """Test that a page served for a URL elsewhere is not announced."""
+        (site_root / "pages" / "index.html").write_text(page.read_text())
+        table = serve.RouteTable(str(site_root))
+        preloads = serve.PreloadMap(str(site_root))
+
+        assert preloads.link(table.resolve("/pages/"), "/pages/") == self.LINK
+        fallback = table.resolve("/pages/cr21/missing.html")
+        assert preloads.link(fallback, "/pages/cr21/missing.html") is None
+
+    def test_changed_page_is_reparsed(self, site_root, page):
+        """Test that edits to a page are picked up."""
+        table = serve.RouteTable(str(site_root))
+        preloads = serve.PreloadMap(str(site_root), refresh_interval=0)
+        route = table.resolve("/pages/b23.html")
+
+        page.write_text('<link rel="stylesheet" href="css/common.css" />')
+        stat = page.stat()
+        os.utime(page, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        assert preloads.link(route, "/pages/b23.html") == (
+            "</pages/css/common.css>; rel=preload; as=style"
+        )
+        assert preloads.stats()["rebuilds"] == 2
+
+    def test_link_header_on_every_engine(self, page, server):
+        """Test that pages carry the header on cached and repeat responses."""
+        for _ in range(2):
+            status, headers, _ = fetch(server, "/pages/b23.html")
+            assert status == 200
+            assert headers["Link"] == self.LINK
+        _, headers, _ = fetch(server, "/pages/css/common.css")
+        assert "Link" not in headers
+
+    @pytest.mark.parametrize("engine", ["simple", "threaded", "async"])
+    def test_early_hints_precede_the_response(self, site_root, page, engine):
+        """Test the 103 interim response, and that HTTP/1.0 gets none."""
+        httpd = start_server(["--engine", engine, "--preload-hints", "early"])
+        host, port = httpd.server_address[:2]
+        replies = {}
+        try:
+            for version in ("HTTP/1.1", "HTTP/1.0"):
+                with socket.create_connection((host, port), timeout=5) as sock:
+                    sock.sendall(
+                        f"GET /pages/b23.html {version}\r\nHost: x\r\n"
+                        "Connection: close\r\n\r\n".encode()
+                    )
+                    data = b""
+                    while chunk := sock.recv(65536):
+                        data += chunk
+                replies[version] = data.decode()
+            metrics = fetch(httpd, "/metrics")[2].decode()
+        finally:
+            stop_server(httpd)
+
+        hints, _, final = replies["HTTP/1.1"].partition("\r\n\r\n")
+        assert hints == f"HTTP/1.1 103 Early Hints\r\nLink: {self.LINK}"
+        assert final.startswith("HTTP/1.1 200 OK\r\n")
+        assert f"Link: {self.LINK}\r\n" in final
+        assert replies["HTTP/1.0"].split("\r\n", 1)[0].endswith(" 200 OK")
+        assert "portal_preload_early_hints_total 1" in metrics
+
+    def test_hints_can_be_disabled(self, site_root, page):
+        """Test that --preload-hints off sends no Link header."""
+        httpd = start_server(["--preload-hints", "off"])
+        try:
+            _, headers, _ = fetch(httpd, "/pages/b23.html")
+        finally:
+            stop_server(httpd)
+        assert "Link" not in headers
+        assert httpd.preloads is None
+
+    @needs_h2
+    def test_http2_response_carries_link(self, site_root, page):
+        """Test that HTTP/2 responses get the header too."""
+        httpd = start_server(["--engine", "async", "--http2"])
+        try:
+            [(status, headers, _)] = fetch_h2(httpd, [("GET", "/pages/b23.html")])
+        finally:
+            stop_server(httpd)
+        assert status == 200
+        assert headers["link"] == self.LINK
+
+
+class TestVirtualHosts:
+    """Test cases for serving several site roots from one server."""
+
+    @pytest.fixture
+    def chamber(self, site_root):
+        """Add a second site root next to the project's pages/."""
+        pages = site_root / "chamber" / "pages"
+        (pages / "css").mkdir(parents=True)
+        (pages / "index.html").write_text(
+            '<html><head><link rel="stylesheet" href="css/chamber.css" />'
+            "</head><body>chamber</body></html>"
+        )
+        (pages / "css" / "chamber.css").write_text("body { color: red; }")
+        return site_root / "chamber"
+
+    def test_select_by_prefix_then_host(self, site_root, chamber):
+        """Test that a path prefix wins over the Host header."""
+        site = serve.create_site(serve.parse_args([]), "chamber", str(chamber))
+        vhosts = serve.VirtualHosts([site])
+
+        assert vhosts.select("x", "/chamber/pages/") == (
+            site,
+            "/pages/",
+            "/chamber",
+        )
+        assert vhosts.select(None, "/chamber") == (site, "/", "/chamber")
+        for host in ("chamber", "CHAMBER:8000", "chamber.portal.local."):
+            assert vhosts.select(host, "/pages/") == (site, "/pages/", "")
+        for host in (None, "portal.local", "[::1]:8000", "chambers"):
+            assert vhosts.select(host, "/pages/") is None
+
+    def test_ip_address_hosts_select_no_site(self, site_root, chamber):
+        """Test that an IP literal is not matched label by label."""
+        site = serve.create_site(serve.parse_args([]), "127", str(chamber))
+        vhosts = serve.VirtualHosts([site])
+
+        for host in ("127.0.0.1", "127.0.0.1:8000", "[::1]"):
+            assert vhosts.select(host, "/pages/") is None
+        assert vhosts.select("127.portal.local", "/pages/") == (site, "/pages/", "")
+
+    def test_site_spec_validation(self):
+        """Test that names must be usable as a host label and URL prefix."""
+        assert serve.site_spec("Chamber=/srv/chamber") == ("chamber", "/srv/chamber")
+        for value in ("chamber", "chamber=", "a_b=/x", "-a=/x", "pages=/x"):
+            with pytest.raises(serve.argparse.ArgumentTypeError):
+                serve.site_spec(value)
+
+    def test_vhost_errors(self, site_root, chamber):
+        """Test that repeated names and missing roots are reported."""
+        args = serve.parse_args(["--vhost", "a=chamber", "--vhost", "a=chamber"])
+        assert "more than once" in serve.vhost_error(args)
+        args = serve.parse_args(["--vhost", "a=missing"])
+        assert "not found" in serve.vhost_error(args)
+        assert serve.vhost_error(serve.parse_args(["--vhost", "a=chamber"])) is None
+
+    def test_vhost_packs_are_mapped_once(self, site_root, chamber):
+        """Test that a pack is validated when mapped, and the mapping reused."""
+        (site_root / "bad.pack").write_bytes(b"nope")
+        with pytest.raises(ValueError, match="not a site pack"):
+            serve.create_vhost_packs(serve.parse_args(["--vhost", "a=bad.pack"]))
+
+        entries = [("/pages/index.html", 1_700_000_000 * 10**9, {None: b"a"})]
+        serve.write_site_pack(str(site_root / "a.pack"), entries)
+        args = serve.parse_args(["--vhost", "a=a.pack", "--vhost", "b=chamber"])
+        packs = serve.create_vhost_packs(args)
+        assert list(packs) == ["a"]
+        vhosts = serve.create_vhosts(args, packs)
+        assert vhosts.sites["a"].route_table is packs["a"]
+        assert isinstance(vhosts.sites["b"].route_table, serve.RouteTable)
+
+    @pytest.mark.parametrize("engine", ["simple", "threaded", "async"])
+    def test_sites_are_served_apart(self, site_root, chamber, engine):
+        """Test routing, redirects, links, caches and metrics per site."""
+        httpd = start_server(["--engine", engine, "--vhost", "chamber=chamber"])
+        try:
+            default = fetch(httpd, "/pages/")
+            prefixed = fetch(httpd, "/chamber/pages/")
+            by_host = fetch(httpd, "/pages/", headers={"Host": "chamber.local"})
+            redirect = fetch(httpd, "/chamber/")
+            css = fetch(httpd, "/chamber/pages/css/chamber.css")
+            fallback = fetch(httpd, "/chamber/pages/css/common.css")
+            # Requests are counted after the response is sent
+            wait_for(lambda: httpd.open_connections == 0)
+            metrics = fetch(httpd, "/metrics")[2].decode()
+        finally:
+            stop_server(httpd)
+
+        assert default[2] == b"<html><body>index</body></html>"
+        assert prefixed[2].endswith(b"<body>chamber</body></html>")
+        assert by_host[2] == prefixed[2]
+        assert redirect[0] == 302
+        assert redirect[1]["Location"] == "/chamber/pages/"
+        assert b'href="/chamber/pages/"' in redirect[2]
+        assert int(redirect[1]["Content-Length"]) == len(redirect[2])
+        assert prefixed[1]["Link"] == (
+            "</chamber/pages/css/chamber.css>; rel=preload; as=style"
+        )
+        assert by_host[1]["Link"] == "</pages/css/chamber.css>; rel=preload; as=style"
+        assert css[2] == b"body { color: red; }"
+        # The default site's stylesheet is not visible from the chamber site
+        assert fallback[2] == prefixed[2]
+
+        chamber_site = httpd.vhosts.sites["chamber"]
+        assert chamber_site.site_cache is not httpd.site_cache
+        assert chamber_site.site_cache.stats()["entries"] == 2
+        assert httpd.site_cache.stats()["entries"] == 3
+        assert 'portal_site_requests_total{site="chamber",status="200"} 4' in metrics
+        assert 'portal_site_requests_total{site="chamber",status="302"} 1' in metrics
+        assert 'portal_site_requests_total{site="default",status="200"} 1' in metrics
+        assert 'portal_site_cache_entries{site="chamber"} 2' in metrics
+        assert 'portal_site_response_bytes_total{site="chamber"}' in metrics
+
+    def test_site_pack_root(self, site_root):
+        """Test that a vhost root can be a site pack, kept apart by memory."""
+        body = b"<html><body>remote</body></html>"
+        entries = [("/pages/index.html", 1_700_000_000 * 10**9, {None: body})]
+        serve.write_site_pack(str(site_root / "remote.pack"), entries)
+        httpd = start_server(["--engine", "async", "--vhost", "remote=remote.pack"])
+        try:
+            status, _, data = fetch(httpd, "/remote/pages/anything.html")
+        finally:
+            stop_server(httpd)
+
+        assert (status, data) == (200, body)
+        memory = serve.cache_memory(httpd)
+        assert memory["site:remote"]["mapped"] > 0
+        assert "routes:remote" not in memory
+        assert "site" in memory
+
+    def test_without_vhosts_nothing_changes(self, site_root):
+        """Test that no site label or site metrics appear by default."""
+        httpd = start_server([])
+        try:
+            fetch(httpd, "/pages/")
+            metrics = fetch(httpd, "/metrics")[2].decode()
+        finally:
+            stop_server(httpd)
+        assert httpd.vhosts is None
+        assert "portal_site_" not in metrics
+
+    @needs_h2
+    def test_http2_selects_by_prefix(self, site_root, chamber):
+        """Test that HTTP/2 requests are routed to the prefixed site."""
+        httpd = start_server(
+            ["--engine", "async", "--http2", "--vhost", "chamber=chamber"]
+        )
+        try:
+            [(status, headers, body)] = fetch_h2(httpd, [("GET", "/chamber/")])
+        finally:
+            stop_server(httpd)
+        assert status == 302
+        assert headers["location"] == "/chamber/pages/"
+        assert b'href="/chamber/pages/"' in body
+        assert int(headers["content-length"]) == len(body)
+
+
+class TestKeepAlive:
+    """Test cases for HTTP/1.1 persistent connections."""
+
+    def test_redirect_has_content_length(self, server):
+        """Test that the hand-written redirect body is delimited."""
+        status, headers, body = fetch(server, "/")
+        assert status == 302
+        assert int(headers["Content-Length"]) == len(body)
+
+    @pytest.mark.parametrize("engine", ["threaded", "async"])
+    def test_connection_is_reused_until_limit(self, site_root, engine):
+        """Test that requests share a connection up to --keepalive-requests."""
+        httpd = start_server(["--engine", engine, "--keepalive-requests", "3"])
+        try:
+            conn = http.client.HTTPConnection(*httpd.server_address[:2], timeout=5)
+            closes = []
+            for _ in range(3):
+                conn.request("GET", "/pages/index.html")
+                response = conn.getresponse()
+                response.read()
+                assert response.status == 200
+                closes.append(response.will_close)
+            assert closes == [False, False, True]
+            conn.close()
+        finally:
+            stop_server(httpd)
+
+    def test_simple_engine_closes_after_each_response(self, site_root):
+        """Test that the single-threaded engine never holds a connection."""
+        httpd = start_server(["--engine", "simple"])
+        try:
+            _, headers, _ = fetch(httpd, "/pages/index.html")
+            assert headers["Connection"] == "close"
+        finally:
+            stop_server(httpd)
+
+    def test_shipped_configuration_keeps_connections_alive(self):
+        """Test serve.py as the tray app and make serve run it, end to end."""
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+
+        process = subprocess.Popen(
+            [sys.executable, str(SERVE_SCRIPT), "--engine", ServerController.engine]
+            + ["--host", "127.0.0.1", "--port", str(port), "--access-log", "off"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_for(lambda: _accepts(port), timeout=10)
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.connect()
+            sock = conn.sock
+            paths = ("/pages/", "/pages/css/common.css", "/pages/js/performance.js")
+            for path in paths:
+                conn.request("GET", path)
+                response = conn.getresponse()
+                response.read()
+                assert response.status == 200
+                assert not response.will_close
+            assert conn.sock is sock
+            conn.close()
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+
+    def test_idle_connection_is_closed(self, site_root):
+        """Test that an idle keep-alive connection is dropped after the timeout."""
+        httpd = start_server(["--engine", "threaded", "--idle-timeout", "0.2"])
+        try:
+            sock = socket.create_connection(httpd.server_address[:2], timeout=5)
+            sock.sendall(b"GET /pages/index.html HTTP/1.1\r\nHost: x\r\n\r\n")
+            data = b""
+            while b"index</body>" not in data:
+                data += sock.recv(65536)
+            start = time.monotonic()
+            assert sock.recv(65536) == b""
+            assert time.monotonic() - start < 3
+            sock.close()
+        finally:
+            stop_server(httpd)
+
+
+class TestSendfile:
+    """Test cases for streaming uncached files."""
+
+    @pytest.fixture
+    def large_file(self, site_root):
+        """Create a file larger than the default per-entry cache limit."""
+        data = os.urandom(3 * 1024 * 1024 + 17)
+        (site_root / "firmware.bin").write_bytes(data)
+        return data
+
+    def test_large_file_is_streamed_intact(self, server, large_file):
+        """Test that a file too large to cache is sent byte for byte."""
+        status, headers, body = fetch(server, "/firmware.bin")
+        assert status == 200
+        assert int(headers["Content-Length"]) == len(large_file)
+        assert body == large_file
+        assert server.site_cache.stats()["entries"] == 3  # pages only
+
+    def test_threaded_engine_uses_socket_sendfile(
+        self, site_root, large_file, monkeypatch
+    ):
+        """Test that the handler hands file bodies to socket.sendfile."""
+        calls = []
+        original = socket.socket.sendfile
+
+        def spy(sock, file, *args, **kwargs):
+            calls.append(file.name)
+            return original(sock, file, *args, **kwargs)
+
+        monkeypatch.setattr(socket.socket, "sendfile", spy)
+        httpd = start_server(["--engine", "threaded"])
+        try:
+            assert fetch(httpd, "/firmware.bin")[2] == large_file
+            assert calls and calls[0].endswith("firmware.bin")
+        finally:
+            stop_server(httpd)
+
+    def test_falls_back_when_sendfile_is_unsupported(
+        self, site_root, large_file, monkeypatch
+    ):
+        """Test that an unsupported sendfile falls back to a buffered copy."""
+
+        def unsupported(sock, file, *args, **kwargs):
+            raise io.UnsupportedOperation("sendfile")
+
+        monkeypatch.setattr(socket.socket, "sendfile", unsupported)
+        httpd = start_server(["--engine", "threaded", "--cache-size", "0"])
+        try:
+            assert fetch(httpd, "/firmware.bin")[2] == large_file
+            assert fetch(httpd, "/pages/index.html")[0] == 200
+        finally:
+            stop_server(httpd)
+
+
+class TestAccessLog:
+    """Test cases for the queued access log."""
+
+    def test_combined_and_json_formats(self, temp_dir):
+        """Test both line formats for one record."""
+        record = (0.0, "10.0.0.5", "GET", "/pages/", "HTTP/1.1", 200, 512, 0.002)
+        record += (None, "curl/8.0", None)
+
+        unused = str(temp_dir / "access.log")
+        combined = serve.AccessLog(unused, "combined")
+        line = combined.format(record)
+        combined.close()
+        assert line == (
+            '10.0.0.5 - - [01/Jan/1970:00:00:00 +0000] "GET /pages/ HTTP/1.1" '
+            '200 512 "-" "curl/8.0"'
+        )
+
+        as_json = serve.AccessLog(unused, "json")
+        fields = json.loads(as_json.format(record))
+        as_json.close()
+        assert fields["status"] == 200
+        assert fields["bytes"] == 512
+        assert fields["duration_ms"] == 2.0
+        assert fields["time"] == "1970-01-01T00:00:00.000+00:00"
+        assert "timing_ms" not in fields
+
+    def test_rotation(self, temp_dir):
+        """Test that the file is rotated at max_bytes, keeping backups."""
+        path = temp_dir / "logs" / "access.log"
+        log = serve.AccessLog(str(path), max_bytes=200, backups=2)
+        for _ in range(20):
+            log.message("x" * 50)
+        log.close()
+
+        assert path.exists()
+        assert (temp_dir / "logs" / "access.log.1").exists()
+        assert (temp_dir / "logs" / "access.log.2").exists()
+        assert not (temp_dir / "logs" / "access.log.3").exists()
+        assert path.stat().st_size <= 200
+        assert log.stats()["written"] == 20
+
+    def test_sampling(self, temp_dir):
+        """Test that a zero sample rate logs nothing."""
+        path = temp_dir / "access.log"
+        log = serve.AccessLog(str(path), sample_rate=0.0)
+        log.record("127.0.0.1", "GET", "/", "HTTP/1.1", 302, 0, 0.001)
+        log.close()
+        assert log.stats()["sampled_out"] == 1
+        assert not path.exists()
+
+    def test_stalled_writer_drops_instead_of_blocking(self, temp_dir):
+        """Test that a full queue drops records without waiting."""
+        release = threading.Event()
+
+        class StalledLog(serve.AccessLog):
+            def _write(self, line):
+                release.wait(5)
+
+        log = StalledLog(str(temp_dir / "access.log"), queue_size=2)
+        start = time.monotonic()
+        for _ in range(50):
+            log.record("127.0.0.1", "GET", "/", "HTTP/1.1", 302, 0, 0.001)
+        assert time.monotonic() - start < 1.0
+        assert log.stats()["dropped"] >= 47
+        release.set()
+        log.close()
+
+    @pytest.mark.parametrize("engine", ["simple", "threaded", "async"])
+    def test_server_writes_json_records(self, site_root, engine):
+        """Test that every engine logs requests through the queue."""
+        path = site_root / "access.log"
+        httpd = start_server(
+            ["--engine", engine, "--access-log", str(path)]
+            + ["--access-log-format", "json"]
+        )
+        try:
+            fetch(httpd, "/pages/cr21-operator.html", headers={"User-Agent": "t"})
+            # Records are written after the response; keep them in order
+            wait_for(lambda: httpd.open_connections == 0)
+            fetch(httpd, "/")
+        finally:
+            stop_server(httpd)
+            httpd.access_log.close()
+
+        records = [json.loads(line) for line in path.read_text().splitlines()]
+        assert [(r["path"], r["status"]) for r in records] == [
+            ("/pages/cr21-operator.html", 200),
+            ("/", 302),
+        ]
+        assert records[0]["bytes"] == 30
+        assert records[0]["user_agent"] == "t"
+        assert records[0]["method"] == "GET"
+
+
+class TestMetrics:
+    """Test cases for request metrics and the /metrics endpoint."""
+
+    def test_shards_are_merged(self):
+        """Test that counters recorded on several threads are summed."""
+        metrics = serve.Metrics(buckets=(0.01, 0.1))
+        metrics.observe("/pages/", 200, 0.005, 100)
+        worker = threading.Thread(
+            target=metrics.observe, args=("/pages/", 200, 0.05, 50)
+        )
+        worker.start()
+        worker.join()
+
+        data = metrics.snapshot()
+        assert data["requests"] == {("/pages/", 200): 2}
+        assert data["latency"]["/pages/"] == [1, 1, 0]
+        assert data["bytes_sent"]["/pages/"] == 150
+
+    def test_exposition_format(self):
+        """Test cumulative histogram buckets and label escaping."""
+        metrics = serve.Metrics(buckets=(0.01, 0.1))
+        metrics.observe("/pages/", 200, 0.005, 100)
+        metrics.observe("/pages/", 200, 0.5, 100)
+        metrics.observe('a"b', 404, 0.001, 0)
+
+        text = metrics.exposition(types.SimpleNamespace()).decode()
+        assert "# TYPE portal_request_duration_seconds histogram" in text
+        assert 'portal_requests_total{route="/pages/",status="200"} 2' in text
+        assert 'portal_requests_total{route="a\\"b",status="404"} 1' in text
+        assert (
+            'portal_request_duration_seconds_bucket{route="/pages/",le="0.1"} 1'
+        ) in text
+        assert (
+            'portal_request_duration_seconds_bucket{route="/pages/",le="+Inf"} 2'
+        ) in text
+        assert 'portal_request_duration_seconds_count{route="/pages/"} 2' in text
+        assert "portal_cache_hits_total" not in text
+
+    def test_route_labels(self, site_root):
+        """Test that routes are labelled by top-level directory."""
+        table = serve.RouteTable(str(site_root))
+        assert table.resolve("/").label == "/"
+        assert table.resolve("/pages/cr21-operator.html").label == "/pages/"
+        assert table.resolve("/pages/css/common.css").label == "/pages/css/"
+        assert table.resolve("/nope.php").label == "not_found"
+
+    def test_metrics_endpoint(self, server):
+        """Test that every engine serves request, cache and connection metrics."""
+        fetch(server, "/pages/css/common.css")
+        fetch(server, "/pages/css/common.css")
+        # Requests are recorded once the handler finishes with the connection
+        wait_for(lambda: server.open_connections == 0)
+        status, headers, body = fetch(server, "/metrics")
+        text = body.decode()
+
+        assert status == 200
+        assert headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert 'portal_requests_total{route="/pages/css/",status="200"} 2' in text
+        assert 'portal_response_bytes_total{route="/pages/css/"} 44' in text
+        assert "portal_cache_hit_ratio " in text
+        if hasattr(server, "open_connections"):
+            assert "portal_open_connections 1" in text
+
+    def test_metrics_can_be_disabled(self, site_root):
+        """Test that --no-metrics serves /metrics as an ordinary path."""
+        httpd = start_server(["--engine", "threaded", "--no-metrics"])
+        try:
+            status, _, _ = fetch(httpd, "/metrics")
+        finally:
+            stop_server(httpd)
+        assert status == 404
+
+
+class TestProbes:
+    """Test cases for the /healthz and /readyz endpoints."""
+
+    def test_probes_answer_on_every_engine(self, server):
+        """Test that a started server is live and ready."""
+        status, _, body = fetch(server, "/healthz")
+        assert (status, body) == (200, b"ok\n")
+        status, headers, body = fetch(server, "/readyz")
+        assert (status, body) == (200, b"ready\n")
+        assert headers["Cache-Control"] == "no-store"
+
+    def test_not_ready_returns_503(self, server):
+        """Test that /readyz fails while the server is not ready."""
+        server.ready = False
+        assert fetch(server, "/readyz")[0] == 503
+        assert fetch(server, "/healthz")[0] == 200
+
+
+class TestProfiler:
+    """Test cases for the sampling profiler and /admin/profile."""
+
+    def test_capture_samples_other_threads(self):
+        """Test that a busy thread's stack shows up in the samples."""
+        stop = threading.Event()
+
+        def spin():
+            while not stop.is_set():
+                pass
+
+        worker = threading.Thread(target=spin, name="spinner")
+        worker.start()
+        try:
+            samples = serve.SamplingProfiler().capture(0.1, 0.002)
+        finally:
+            stop.set()
+            worker.join()
+
+        spinner = [stack for (name, stack) in samples if name == "spinner"]
+        assert spinner
+        assert all("spin" in [name for _, _, name in stack] for stack in spinner)
+        assert "MainThread" not in {name for name, _ in samples}
+
+    def test_one_capture_at_a_time(self):
+        """Test that a second concurrent capture is refused."""
+        profiler = serve.SamplingProfiler()
+        first = threading.Thread(target=profiler.capture, args=(0.3,))
+        first.start()
+        wait_for(lambda: profiler.busy)
+        try:
+            with pytest.raises(RuntimeError):
+                profiler.capture(0.1)
+        finally:
+            first.join()
+
+    def test_collapsed_stacks(self):
+        """Test the flamegraph.pl line format."""
+        stack = (("/srv/serve.py", 10, "handle"), ("/srv/serve.py", 20, "send"))
+        samples = collections.Counter({("worker-0", stack): 3})
+        assert serve.collapsed_stacks(samples) == (
+            "worker-0;handle (serve.py:10);send (serve.py:20) 3\n"
+        )
+
+    def test_sampled_pstats_loads(self, temp_dir):
+        """Test that the pstats output is readable by the pstats module."""
+        outer, inner = ("a.py", 1, "outer"), ("a.py", 5, "inner")
+        samples = collections.Counter({("t", (outer, inner)): 3, ("t", (outer,)): 1})
+        path = temp_dir / "portal.pstats"
+        path.write_bytes(marshal.dumps(serve.sampled_pstats(samples, 0.01)))
+
+        stats = pstats.Stats(str(path)).stats
+        cc, nc, tt, ct, callers = stats[inner]
+        assert (cc, nc) == (3, 3)
+        assert tt == pytest.approx(0.03) and ct == pytest.approx(0.03)
+        assert callers[outer][0] == 3
+        assert stats[outer][2] == pytest.approx(0.01)
+        assert stats[outer][3] == pytest.approx(0.04)
+
+    @pytest.mark.parametrize(
+        "host,expected",
+        [
+            ("127.0.0.1", True),
+            ("::1", True),
+            ("::ffff:127.0.0.1", True),
+            ("10.0.0.5", False),
+            ("", False),
+        ],
+    )
+    def test_is_loopback(self, host, expected):
+        """Test which client addresses count as local."""
+        assert serve.is_loopback(host) is expected
+
+    def test_remote_clients_are_refused(self):
+        """Test that admin endpoints only answer loopback clients."""
+        status, _, _ = serve.AdminEndpoints().handle(
+            None, "10.0.0.5", serve.PROFILE_PATH, "seconds=1"
+        )
+        assert status == 403
+
+    @pytest.mark.parametrize(
+        "query", ["seconds=0", "seconds=61", "seconds=x", "format=svg", "interval=0"]
+    )
+    def test_invalid_parameters(self, query):
+        """Test that bad capture parameters are rejected up front."""
+        status, _, _ = serve.AdminEndpoints().handle(
+            None, "127.0.0.1", serve.PROFILE_PATH, query
+        )
+        assert status == 400
+
+    @pytest.mark.parametrize("engine", ["threaded", "async"])
+    def test_profile_endpoint(self, site_root, engine):
+        """Test a capture over HTTP in both output formats."""
+        httpd = start_server(["--engine", engine])
+        try:
+            query = "?seconds=0.1&interval=2"
+            status, headers, body = fetch(httpd, serve.PROFILE_PATH + query)
+            assert status == 200
+            assert headers["Content-Type"] == "text/plain; charset=utf-8"
+            assert all(
+                re.fullmatch(r".+ \d+", line) for line in body.decode().splitlines()
+            )
+            status, headers, body = fetch(
+                httpd, serve.PROFILE_PATH + query + "&format=pstats"
+            )
+            assert status == 200
+            assert headers["Content-Type"] == "application/octet-stream"
+            dump = site_root / "portal.pstats"
+            dump.write_bytes(body)
+            assert isinstance(pstats.Stats(str(dump)).stats, dict)
+        finally:
+            stop_server(httpd)
+
+    def test_simple_engine_refuses_captures(self, site_root):
+        """Test that the single-threaded engine is not blocked by a capture."""
+        httpd = start_server(["--engine", "simple"])
+        try:
+            status, _, body = fetch(httpd, serve.PROFILE_PATH + "?seconds=5")
+        finally:
+            stop_server(httpd)
+        assert status == 501
+        assert b"threaded or async" in body
+        assert not httpd.admin.profiler.busy
+
+    def test_admin_can_be_disabled(self, site_root):
+        """Test that --no-admin leaves /admin/ to the file server."""
+        httpd = start_server(["--engine", "threaded", "--no-admin"])
+        try:
+            status, _, _ = fetch(httpd, serve.PROFILE_PATH)
+        finally:
+            stop_server(httpd)
+        assert status == 404
+
+
+class TestMemory:
+    """Test cases for the memory breakdown and /admin/memory."""
+
+    def test_site_cache_breakdown(self, site_root):
+        """Test that bodies add up to the total, beside the serialized heads."""
+        cache = serve.SiteCache()
+        cache.preload("pages")
+        entry = cache.get("pages/index.html")
+        response = cache.response(entry, "NIAPortal/test")
+
+        memory = cache.memory()
+        assert memory["entries"] == 3
+        assert memory["responses"] == len(response.head)
+        assert memory["bodies"] + memory["variants"] == memory["bytes"]
+
+    def test_process_memory(self):
+        """Test that RSS is reported where /proc is available."""
+        memory = serve.process_memory()
+        if os.path.exists("/proc/self/statm"):
+            assert memory["rss_bytes"] > 0
+        assert memory["peak_rss_bytes"] is None or memory["peak_rss_bytes"] > 0
+
+    def test_heap_diff_shows_growth(self):
+        """Test that allocations after the baseline show up in the diff."""
+        heap = serve.HeapTracker()
+        heap.start()
+        try:
+            assert heap.report(save_baseline=True)["baseline_saved"]
+            grown = [bytearray(1024) for _ in range(512)]
+            report = heap.report(top=5, diff=True)
+        finally:
+            heap.stop()
+        assert report["diff"]["size_delta_bytes"] >= 512 * 1024
+        assert report["diff"]["top"][0]["location"].startswith(__file__)
+        assert len(grown) == 512
+        assert heap.report() == {"tracing": False}
+
+    @pytest.mark.parametrize(
+        "query", ["top=0", "top=101", "frames=x", "tracemalloc=pause"]
+    )
+    def test_invalid_parameters(self, query):
+        """Test that bad parameters are rejected before tracing changes."""
+        status, _, _ = serve.AdminEndpoints().handle(
+            None, "127.0.0.1", serve.MEMORY_PATH, query
+        )
+        assert status == 400
+
+    @pytest.mark.parametrize("engine", ["threaded", "async"])
+    def test_memory_endpoint(self, site_root, engine):
+        """Test a start, baseline, diff and stop cycle over HTTP."""
+        httpd = start_server(["--engine", engine])
+        try:
+            status, headers, body = fetch(httpd, serve.MEMORY_PATH)
+            assert status == 200
+            assert headers["Content-Type"] == "application/json"
+            report = json.loads(body)
+            assert report["tracemalloc"] == {"tracing": False}
+            assert report["caches"]["site"]["entries"] == 3
+            assert {"routes", "preflights", "access_log"} <= set(report["caches"])
+
+            fetch(httpd, serve.MEMORY_PATH + "?tracemalloc=start&baseline=1")
+            _, _, body = fetch(httpd, serve.MEMORY_PATH + "?diff=1&top=3")
+            traced = json.loads(body)["tracemalloc"]
+            assert traced["tracing"] and traced["baseline_saved"]
+            assert len(traced["diff"]["top"]) <= 3
+
+            _, _, body = fetch(httpd, serve.MEMORY_PATH + "?tracemalloc=stop")
+            assert json.loads(body)["tracemalloc"] == {"tracing": False}
+        finally:
+            stop_server(httpd)
+            serve.tracemalloc.stop()
+
+
+class TestThreadPoolServer:
+    """Test cases for the threaded engine."""
+
+    def test_stalled_client_does_not_block_others(self, site_root):
+        """Test that an idle connection does not hold up other clients."""
+        httpd = start_server(["--engine", "threaded", "--threads", "2"])
+        try:
+            stalled = socket.create_connection(httpd.server_address[:2])
+            try:
+                start = time.monotonic()
+                status, _, _ = fetch(httpd, "/pages/index.html")
+                assert status == 200
+                assert time.monotonic() - start < 2
+            finally:
+                stalled.close()
+        finally:
+            stop_server(httpd)
+
+    def test_full_queue_rejects_with_503(self, site_root):
+        """Test that connections beyond the queue are rejected, not queued."""
+        httpd = start_server(
+            ["--engine", "threaded", "--threads", "1", "--queue-size", "1"]
+        )
+        address = httpd.server_address[:2]
+        held = []
+        try:
+            # One connection occupies the worker, one fills the queue
+            held.append(socket.create_connection(address))
+            wait_for(lambda: httpd.pool_stats.snapshot()["busy"] == 1)
+            held.append(socket.create_connection(address))
+            wait_for(lambda: httpd.pool_stats.snapshot()["accepted"] == 2)
+
+            status, headers, _ = fetch(httpd, "/pages/index.html")
+            assert status == 503
+            assert headers["Retry-After"] == "1"
+
+            stats = httpd.pool_stats.snapshot()
+            assert stats["rejected"] == 1
+            assert stats["saturated"] >= 1
+            assert stats["peak_busy"] == 1
+        finally:
+            for sock in held:
+                sock.close()
+            stop_server(httpd)
+
+    def test_invalid_pool_size(self, site_root):
+        """Test that an empty pool is rejected."""
+        with pytest.raises(ValueError):
+            serve.ThreadPoolHTTPServer(
+                ("127.0.0.1", 0), serve.RedirectHandler, workers=0
+            )
+
+
+class TestPriorityScheduler:
+    """Test cases for request classification and the priority scheduler."""
+
+    @pytest.mark.parametrize(
+        "method,path,headers,expected",
+        [
+            ("GET", "/pages/cr30.html", {"Sec-Fetch-Dest": "document"}, "navigation"),
+            ("GET", "/pages/", {}, "navigation"),
+            ("GET", "/pages/css/common.css", {"Sec-Fetch-Dest": "style"}, "critical"),
+            ("GET", "/pages/js/app.js", {}, "critical"),
+            ("GET", "/pages/cr30.html", {"Sec-Fetch-Dest": "empty"}, "precache"),
+            ("GET", "/pages/sw.js", {"Service-Worker": "script"}, "precache"),
+            ("GET", "/pages/b23.html", {"Sec-Purpose": "prefetch"}, "precache"),
+            ("GET", "/metrics", {}, "api"),
+            ("OPTIONS", "/pages/index.html", {}, "api"),
+            ("GET", "/healthz", {}, None),
+        ],
+    )
+    def test_classify_request(self, method, path, headers, expected):
+        """Test which class each kind of request falls into."""
+        priority = serve.classify_request(method, path, headers)
+        if expected is None:
+            assert priority is None
+        else:
+            assert serve.PRIORITY_CLASSES[priority] == expected
+
+    def _admit_in_order(self, scheduler, priorities, pause=0.0):
+        """Queue requests behind a held slot and return the admission order."""
+        order = []
+        lock = threading.Lock()
+
+        def request(priority):
+            scheduler.acquire(priority)
+            with lock:
+                order.append(priority)
+            scheduler.release()
+
+        scheduler.acquire(serve.PRIORITY_NAVIGATION)
+        threads = []
+        for count, priority in enumerate(priorities, start=1):
+            thread = threading.Thread(target=request, args=(priority,))
+            thread.start()
+            threads.append(thread)
+            wait_for(lambda count=count: scheduler.snapshot()["waiting"] == count)
+            time.sleep(pause)
+        scheduler.release()
+        for thread in threads:
+            thread.join(timeout=5)
+        return order
+
+    def test_urgent_requests_go_first(self):
+        """Test that waiting requests are admitted most urgent class first."""
+        scheduler = serve.PriorityScheduler(slots=1, aging=10.0)
+        order = self._admit_in_order(
+            scheduler,
+            [serve.PRIORITY_API, serve.PRIORITY_PRECACHE, serve.PRIORITY_NAVIGATION],
+        )
+        assert order == [
+            serve.PRIORITY_NAVIGATION,
+            serve.PRIORITY_PRECACHE,
+            serve.PRIORITY_API,
+        ]
+        snapshot = scheduler.snapshot()
+        assert snapshot["active"] == 0
+        assert snapshot["peak_waiting"] == 3
+        assert snapshot["admitted"]["navigation"] == 2
+
+    def test_long_waiters_are_not_starved(self):
+        """Test that aging lets an old precache fetch pass a new navigation."""
+        scheduler = serve.PriorityScheduler(slots=1, aging=0.05)
+        order = self._admit_in_order(
+            scheduler,
+            [serve.PRIORITY_PRECACHE, serve.PRIORITY_NAVIGATION],
+            pause=0.2,
+        )
+        assert order == [serve.PRIORITY_PRECACHE, serve.PRIORITY_NAVIGATION]
+
+    def test_threaded_engine_schedules_requests(self, site_root):
+        """Test that requests are classified and timed through the scheduler."""
+        httpd = start_server(
+            ["--engine", "threaded", "--priority-slots", "2", "--server-timing"]
+        )
+        try:
+            status, headers, _ = fetch(
+                httpd, "/pages/index.html", headers={"Sec-Fetch-Dest": "document"}
+            )
+            assert status == 200
+            assert headers["Server-Timing"].startswith("queue;dur=")
+            fetch(httpd, "/healthz")
+            wait_for(lambda: httpd.open_connections == 0)
+            _, _, body = fetch(httpd, "/metrics")
+        finally:
+            stop_server(httpd)
+        text = body.decode()
+        assert 'portal_scheduler_admitted_total{class="navigation"} 1' in text
+        assert 'portal_scheduler_admitted_total{class="api"} 1' in text
+        assert "portal_scheduler_waiting 0" in text
+
+    def test_other_engines_ignore_priority_slots(self, site_root):
+        """Test that the option only applies to the threaded engine."""
+        httpd = start_server(["--engine", "async", "--priority-slots", "2"])
+        try:
+            assert getattr(httpd, "scheduler", None) is None
+        finally:
+            stop_server(httpd)
+
+    def test_invalid_slots(self):
+        """Test that a scheduler needs at least one slot."""
+        with pytest.raises(ValueError):
+            serve.PriorityScheduler(slots=0)
+
+
+class TestAsyncServer:
+    """Test cases for the asyncio engine."""
+
+    @pytest.mark.parametrize(
+        ("line", "status"),
+        [
+            ("GET /metrics garbage", b"400"),
+            ("GET /pages/ HTTP/x.y", b"400"),
+            ("GET /nope HTTP/9.9", b"505"),
+            ("GET /pages/ HTTP/2.0", b"505"),
+        ],
+    )
+    def test_rejects_unsupported_versions(self, site_root, line, status):
+        """Test that the request's version is checked, never echoed."""
+        httpd = start_server(["--engine", "async"])
+        try:
+            with socket.create_connection(httpd.server_address[:2], timeout=5) as sock:
+                sock.sendall(f"{line}\r\nHost: x\r\n\r\n".encode())
+                data = b""
+                while chunk := sock.recv(65536):
+                    data += chunk
+        finally:
+            stop_server(httpd)
+        assert data.startswith(b"HTTP/1.1 " + status + b" ")
+        assert b"Connection: close\r\n" in data
+
+    def test_status_line_is_http_1_1(self, site_root):
+        """Test that HTTP/1.0 requests get an HTTP/1.1 status line."""
+        httpd = start_server(["--engine", "async"])
+        try:
+            with socket.create_connection(httpd.server_address[:2], timeout=5) as sock:
+                sock.sendall(b"GET /missing.txt HTTP/1.0\r\n\r\n")
+                data = sock.recv(65536)
+        finally:
+            stop_server(httpd)
+        assert data.startswith(b"HTTP/1.1 404 ")
+
+    def test_keep_alive_reuses_connection(self, site_root):
+        """Test that HTTP/1.1 requests share one connection."""
+        httpd = start_server(["--engine", "async"])
+        try:
+            conn = http.client.HTTPConnection(*httpd.server_address[:2], timeout=5)
+            for path in ("/pages/index.html", "/pages/css/common.css"):
+                conn.request("GET", path)
+                response = conn.getresponse()
+                response.read()
+                assert response.status == 200
+            assert response.getheader("Content-Type") == "text/css"
+            assert httpd.open_connections == 1
+            conn.close()
+        finally:
+            stop_server(httpd)
+
+    def test_head_has_no_body(self, site_root):
+        """Test that HEAD returns headers only."""
+        httpd = start_server(["--engine", "async"])
+        try:
+            status, headers, body = fetch(httpd, "/pages/index.html", "HEAD")
+            assert status == 200
+            assert int(headers["Content-Length"]) > 0
+            assert body == b""
+        finally:
+            stop_server(httpd)
+
+    def test_many_idle_connections(self, site_root):
+        """Test that idle connections do not tie up the server."""
+        httpd = start_server(["--engine", "async"])
+        address = httpd.server_address[:2]
+        idle = [socket.create_connection(address) for _ in range(200)]
+        try:
+            wait_for(lambda: httpd.open_connections == 200)
+            status, _, _ = fetch(httpd, "/pages/cr21-operator.html")
+            assert status == 200
+        finally:
+            for sock in idle:
+                sock.close()
+            stop_server(httpd)
+
+    def test_unsupported_method(self, site_root):
+        """Test that methods other than GET/HEAD are rejected."""
+        httpd = start_server(["--engine", "async"])
+        try:
+            status, _, _ = fetch(httpd, "/pages/index.html", "DELETE")
+            assert status == 501
+        finally:
+            stop_server(httpd)
+
+    @pytest.mark.parametrize("cache_size", ["0", "64"])
+    def test_slow_download_outlasts_timeout(self, site_root, cache_size):
+        """Test that the timeout bounds each write, not the whole response."""
+        body = os.urandom(4 * 1024 * 1024)
+        (site_root / "pages" / "big.bin").write_bytes(body)
+        httpd = start_server(
+            ["--engine", "async", "--timeout", "0.5", "--cache-size", cache_size]
+        )
+        httpd.sendfile_chunk_size = 64 * 1024
+        try:
+            sock = socket.create_connection(httpd.server_address[:2], timeout=5)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16 * 1024)
+            sock.sendall(b"GET /pages/big.bin HTTP/1.1\r\nHost: x\r\n\r\n")
+            received = b""
+            started = time.monotonic()
+            while chunk := sock.recv(256 * 1024):
+                received += chunk
+                if received.endswith(body[-1024:]):
+                    break
+                time.sleep(0.01)
+            sock.close()
+            assert time.monotonic() - started > 0.5
+            assert received.endswith(body)
+        finally:
+            stop_server(httpd)
+
+
+class TestHTTP2:
+    """Test cases for TLS and HTTP/2 in the async engine."""
+
+    @pytest.mark.parametrize(
+        "argv",
+        [
+            ["--engine", "threaded", "--http2"],
+            ["--engine", "simple", "--http2"],
+            ["--engine", "async", "--tls-key", "key.pem"],
+        ],
+    )
+    def test_protocol_errors(self, argv):
+        """Test that unusable TLS and HTTP/2 options are reported."""
+        assert serve.protocol_error(serve.parse_args(argv)) is not None
+
+    def test_http2_needs_h2(self, monkeypatch):
+        """Test that the async engine refuses HTTP/2 without the h2 package."""
+        monkeypatch.setattr(serve, "h2", None)
+        args = serve.parse_args(["--engine", "async", "--http2"])
+        assert "h2" in serve.protocol_error(args)
+        with pytest.raises(ValueError):
+            serve.AsyncHTTPServer(("127.0.0.1", 0), http2=True)
+
+    def test_tls_http1(self, site_root, tls_cert):
+        """Test HTTPS with ALPN choosing http/1.1 when HTTP/2 is off."""
+        cert, key = tls_cert
+        httpd = start_server(
+            ["--engine", "async", "--tls-cert", str(cert), "--tls-key", str(key)]
+        )
+        try:
+            context = tls_client_context(cert)
+            conn = http.client.HTTPSConnection(
+                "localhost", httpd.server_address[1], context=context, timeout=5
+            )
+            try:
+                conn.request("GET", "/pages/index.html")
+                response = conn.getresponse()
+                assert response.status == 200
+                assert response.read() == b"<html><body>index</body></html>"
+                assert conn.sock.selected_alpn_protocol() == "http/1.1"
+            finally:
+                conn.close()
+        finally:
+            stop_server(httpd)
+
+    @needs_h2
+    def test_h2c_prior_knowledge(self, site_root):
+        """Test that one cleartext HTTP/2 connection serves a whole page."""
+        httpd = start_server(["--engine", "async", "--http2"])
+        try:
+            responses = fetch_h2(
+                httpd,
+                [
+                    ("GET", "/pages/index.html"),
+                    ("GET", "/pages/css/common.css"),
+                    ("GET", "/"),
+                    ("GET", "/pages/missing.html"),
+                    ("GET", "/missing.txt"),
+                    ("HEAD", "/pages/cr21-operator.html"),
+                ],
+            )
+        finally:
+            stop_server(httpd)
+        page, css, root, fallback, missing, head = responses
+        assert page[0] == 200 and page[2] == b"<html><body>index</body></html>"
+        assert css[1]["content-type"].startswith("text/css")
+        assert root[0] == 302 and root[1]["location"] == "/pages/"
+        assert fallback[:1] + fallback[2:] == page[:1] + page[2:]
+        assert missing[0] == 404
+        assert head[0] == 200 and head[2] == b""
+        assert head[1]["content-length"] == str(len("<html><body>cr21</body></html>"))
+
+    @needs_h2
+    def test_h2_over_tls(self, site_root, tls_cert):
+        """Test that ALPN negotiates h2 on an HTTPS connection."""
+        cert, key = tls_cert
+        httpd = start_server(
+            [
+                "--engine",
+                "async",
+                "--http2",
+                "--tls-cert",
+                str(cert),
+                "--tls-key",
+                str(key),
+            ]
+        )
+        try:
+            [(status, _, body)] = fetch_h2(
+                httpd, [("GET", "/pages/index.html")], tls_client_context(cert)
+            )
+        finally:
+            stop_server(httpd)
+        assert status == 200
+        assert body == b"<html><body>index</body></html>"
+
+    @needs_h2
+    def test_http1_still_served(self, site_root):
+        """Test that HTTP/1.1 clients are unaffected by --http2."""
+        httpd = start_server(["--engine", "async", "--http2"])
+        try:
+            status, _, body = fetch(httpd, "/pages/index.html")
+        finally:
+            stop_server(httpd)
+        assert status == 200
+        assert body == b"<html><body>index</body></html>"
+
+    @needs_h2
+    def test_large_body_respects_flow_control(self, site_root):
+        """Test a body larger than the default 64 KiB stream window."""
+        big = os.urandom(300 * 1024)
+        (site_root / "pages" / "big.bin").write_bytes(big)
+        httpd = start_server(["--engine", "async", "--http2", "--cache-size", "0"])
+        try:
+            [(status, _, body)] = fetch_h2(httpd, [("GET", "/pages/big.bin")])
+        finally:
+            stop_server(httpd)
+        assert status == 200
+        assert body == big
+
+    @needs_h2
+    def test_stalled_stream_is_reset(self, site_root):
+        """Test that a stream whose window never opens is reset, not left open."""
+        httpd = start_server(["--engine", "async", "--http2", "--timeout", "0.3"])
+        h2 = serve.h2
+        config = h2.config.H2Configuration(client_side=True, header_encoding="utf-8")
+        conn = h2.connection.H2Connection(config=config)
+        conn.local_settings = h2.settings.Settings(
+            client=True,
+            initial_values={h2.settings.SettingCodes.INITIAL_WINDOW_SIZE: 0},
+        )
+        conn.initiate_connection()
+        fields = [
+            (":method", "GET"),
+            (":path", "/pages/index.html"),
+            (":scheme", "http"),
+            (":authority", "localhost"),
+        ]
+        conn.send_headers(1, fields, end_stream=True)
+        reset = None
+        try:
+            with socket.create_connection(httpd.server_address[:2], timeout=5) as sock:
+                sock.sendall(conn.data_to_send())
+                while reset is None and (data := sock.recv(65536)):
+                    for event in conn.receive_data(data):
+                        if isinstance(event, h2.events.StreamReset):
+                            reset = event
+                    sock.sendall(conn.data_to_send())
+        finally:
+            stop_server(httpd)
+        assert reset is not None
+        assert reset.stream_id == 1
+        assert reset.error_code == h2.errors.ErrorCodes.CANCEL
+
+
+class TestTLS:
+    """Test cases for TLS termination, resumption and certificate reloads."""
+
+    def tls_args(self, cert, key, *extra):
+        return ["--tls-cert", str(cert), "--tls-key", str(key), *extra]
+
+    @pytest.mark.parametrize("engine", ["simple", "threaded", "async"])
+    def test_https_and_resumption(self, site_root, tls_cert, engine):
+        """Test that a second connection resumes the first one's session."""
+        cert, key = tls_cert
+        httpd = start_server(["--engine", engine, *self.tls_args(cert, key)])
+        try:
+            context = tls_client_context(cert, alpn=("http/1.1",))
+            status, session, reused, _ = tls_get(httpd, context)
+            assert status == 200 and not reused
+            status, _, reused, _ = tls_get(httpd, context, session=session)
+            assert status == 200 and reused
+            stats = httpd.tls.stats()
+            _, _, body = fetch_tls(httpd, context, "/metrics")
+        finally:
+            stop_server(httpd)
+        assert stats["handshakes"] == 2
+        assert stats["resumed"] == 1
+        assert stats["resumption_ratio"] == 0.5
+        assert b"portal_tls_resumed_total 1" in body
+
+    def test_one_context_per_server(self, site_root, tls_cert):
+        """Test that the context is loaded once and shared with the workers."""
+        cert, key = tls_cert
+        args = serve.parse_args(["--engine", "threaded", *self.tls_args(cert, key)])
+        tls = serve.create_tls(args)
+        assert tls.context.minimum_version == ssl.TLSVersion.TLSv1_2
+        args.port, args.host = 0, "127.0.0.1"
+        httpd = serve.create_server(args, tls=tls)
+        try:
+            assert httpd.tls is tls
+        finally:
+            httpd.server_close()
+
+    def test_certificate_reload(self, site_root, temp_dir):
+        """Test that renewed files are picked up and broken ones are not."""
+        first_cert, first_key = make_cert(temp_dir, "first")
+        second_cert, second_key = make_cert(temp_dir, "second")
+        cert, key = temp_dir / "live.pem", temp_dir / "live.key"
+        shutil.copy(first_cert, cert)
+        shutil.copy(first_key, key)
+        httpd = start_server(
+            [
+                "--engine",
+                "threaded",
+                *self.tls_args(cert, key, "--tls-reload-interval", "0"),
+            ]
+        )
+        try:
+            context = ssl.create_default_context(cafile=str(first_cert))
+            context.load_verify_locations(cafile=str(second_cert))
+            _, _, _, served = tls_get(httpd, context)
+            assert served == ssl.PEM_cert_to_DER_cert(first_cert.read_text())
+
+            # Replace both files, as certbot does when it renews
+            shutil.copy(second_cert, temp_dir / "new.pem")
+            shutil.copy(second_key, temp_dir / "new.key")
+            os.replace(temp_dir / "new.pem", cert)
+            os.replace(temp_dir / "new.key", key)
+            tls_get(httpd, context)  # this handshake triggers the reload
+            _, _, _, served = tls_get(httpd, context)
+            assert served == ssl.PEM_cert_to_DER_cert(second_cert.read_text())
+
+            cert.write_text("not a certificate")
+            tls_get(httpd, context)
+            status, _, _, served = tls_get(httpd, context)
+            assert status == 200
+            assert served == ssl.PEM_cert_to_DER_cert(second_cert.read_text())
+            stats = httpd.tls.stats()
+        finally:
+            stop_server(httpd)
+        assert stats["reloads"] == 1
+        assert stats["reload_failures"] == 1
+
+    def test_cipher_policy(self, tls_cert):
+        """Test the cipher, version and ticket options."""
+        cert, key = tls_cert
+        args = serve.parse_args(
+            self.tls_args(
+                cert,
+                key,
+                "--tls-ciphers",
+                "ECDHE+AESGCM",
+                "--tls-min-version",
+                "1.3",
+                "--tls-tickets",
+                "0",
+            )
+        )
+        context = serve.create_tls(args).context
+        assert context.minimum_version == ssl.TLSVersion.TLSv1_3
+        assert context.options & ssl.OP_NO_TICKET
+        assert all(
+            "CHACHA20" not in c["name"]
+            for c in context.get_ciphers()
+            if c["protocol"] == "TLSv1.2"
+        )
+        args.tls_ciphers = "NO-SUCH-CIPHER"
+        with pytest.raises(ssl.SSLError):
+            serve.create_tls(args)
+
+    def test_old_tls_versions_are_refused(self, site_root, tls_cert):
+        """Test that a client limited to TLS 1.2 fails against a 1.3 minimum."""
+        cert, key = tls_cert
+        httpd = start_server(
+            [
+                "--engine",
+                "threaded",
+                *self.tls_args(cert, key, "--tls-min-version", "1.3"),
+            ]
+        )
+        try:
+            context = tls_client_context(cert, alpn=("http/1.1",))
+            context.maximum_version = ssl.TLSVersion.TLSv1_2
+            with pytest.raises(ssl.SSLError):
+                tls_get(httpd, context)
+            wait_for(lambda: httpd.open_connections == 0)
+        finally:
+            stop_server(httpd)
+
+
+class TestGracefulDrain:
+    """Test cases for draining connections on SIGTERM."""
+
+    @pytest.mark.parametrize("engine", ["simple", "threaded", "async"])
+    def test_drain_finishes_in_flight_and_closes_idle(self, site_root, engine):
+        """Test that in-flight requests complete and idle ones are closed."""
+        httpd = start_server(["--engine", engine, "--access-log", "off"])
+        host, port = httpd.server_address[:2]
+        idle = None
+        if engine != "simple":
+            idle = http.client.HTTPConnection(host, port, timeout=5)
+            idle.request("GET", "/pages/index.html")
+            idle.getresponse().read()
+        busy = socket.create_connection((host, port), timeout=5)
+        busy.sendall(b"GET /pages/cr21-operator.html HTTP/1.1\r\nHost: x\r\n")
+        wait_for(lambda: _connection_states(httpd) == (1, 1 if idle else 0))
+
+        result = {}
+        drainer = threading.Thread(target=lambda: result.update(httpd.drain(5)))
+        drainer.start()
+        try:
+            wait_for(lambda: not httpd.ready)
+            busy.sendall(b"\r\n")
+            response = b""
+            while chunk := busy.recv(4096):
+                response += chunk
+            drainer.join(5)
+        finally:
+            busy.close()
+            httpd.server_close()
+
+        assert response.startswith(b"HTTP/1.1 200 OK")
+        assert b"Connection: close" in response
+        assert response.endswith(b"cr21</body></html>")
+        assert result["aborted"] == 0
+        assert result["in_flight"] == 1
+        assert result["idle_closed"] == (1 if idle else 0)
+        assert not _accepts(port)
+        if idle is not None:
+            assert idle.sock.recv(1) == b""
+            idle.close()
+
+    def test_deadline_cuts_off_stalled_requests(self, site_root):
+        """Test that requests still running at the deadline are aborted."""
+        httpd = start_server(["--engine", "threaded", "--access-log", "off"])
+        stalled = socket.create_connection(httpd.server_address[:2], timeout=5)
+        stalled.sendall(b"GET /pages/ HTTP/1.1\r\n")
+        wait_for(lambda: httpd.open_connections == 1)
+        try:
+            result = httpd.drain(0.2)
+            assert stalled.recv(1) == b""
+        finally:
+            stalled.close()
+            httpd.server_close()
+        assert result["aborted"] == 1
+        assert result["seconds"] >= 0.2
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="needs SIGTERM")
+    def test_sigterm_drains_and_exits(self):
+        """Test that serve.py drains and exits cleanly on SIGTERM."""
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+
+        process = subprocess.Popen(
+            [sys.executable, "-u", str(SERVE_SCRIPT), "--engine", "threaded"]
+            + ["--host", "127.0.0.1", "--port", str(port), "--access-log", "off"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        try:
+            wait_for(lambda: _accepts(port), timeout=10)
+            # A served request means serve() has installed its SIGTERM handler
+            address = types.SimpleNamespace(server_address=("127.0.0.1", port))
+            assert fetch(address, "/healthz")[0] == 200
+            process.send_signal(signal.SIGTERM)
+            output, _ = process.communicate(timeout=10)
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        assert process.returncode == 0
+        assert re.search(r"Server drained in \d+ ms", output)
+
+
+class TestPreforkSupervisor:
+    """Test cases for --workers prefork mode."""
+
+    @pytest.mark.skipif(
+        not hasattr(socket, "SO_REUSEPORT") or sys.platform == "win32",
+        reason="prefork mode needs fork() and SO_REUSEPORT",
+    )
+    def test_workers_share_port_and_restart(self):
+        """Test that workers serve one port and dead workers are replaced."""
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+
+        process = subprocess.Popen(
+            [sys.executable, "-u", str(SERVE_SCRIPT), "--workers", "2"]
+            + ["--host", "127.0.0.1", "--port", str(port)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        try:
+            pids = []
+            while len(pids) < 2:
+                line = process.stdout.readline()
+                assert line, "server exited before starting workers"
+                match = re.search(r"Worker \d+ started \(pid (\d+)\)", line)
+                if match:
+                    pids.append(int(match.group(1)))
+
+            address = types.SimpleNamespace(server_address=("127.0.0.1", port))
+            wait_for(lambda: _accepts(port), timeout=5)
+            assert fetch(address, "/pages/index.html")[0] == 200
+
+            os.kill(pids[0], signal.SIGKILL)
+            while True:
+                line = process.stdout.readline()
+                assert line, "server exited instead of restarting the worker"
+                if "started" in line:
+                    break
+            assert fetch(address, "/pages/index.html")[0] == 200
+
+            process.terminate()
+            assert process.wait(timeout=10) == 0
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+
+
+class TestInheritedSocket:
+    """Test cases for serving on a listening socket handed over by a parent."""
+
+    @pytest.mark.parametrize("engine", ["simple", "threaded", "async"])
+    def test_engines_serve_on_given_socket(self, site_root, engine):
+        """Test that every engine accepts on the socket instead of binding."""
+        listener = socket.create_server(("127.0.0.1", 0))
+        port = listener.getsockname()[1]
+        args = serve.parse_args(["--engine", engine, "--access-log", "off"])
+        httpd = serve.create_server(args, sock=listener)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        try:
+            assert httpd.server_address[:2] == ("127.0.0.1", port)
+            assert fetch(httpd, "/pages/index.html")[0] == 200
+        finally:
+            stop_server(httpd)
+        assert listener.fileno() == -1
+
+    def test_listen_fd_option(self):
+        """Test that --listen-fd wraps the descriptor as a stream socket."""
+        listener = socket.create_server(("127.0.0.1", 0))
+        args = serve.parse_args(["--listen-fd", str(os.dup(listener.fileno()))])
+        sock = serve.inherited_socket(args)
+        try:
+            assert sock.getsockname() == listener.getsockname()
+            assert sock.type == socket.SOCK_STREAM
+            assert not sock.get_inheritable()
+        finally:
+            sock.close()
+            listener.close()
+
+    def test_listen_fd_rejects_datagram_socket(self):
+        """Test that a non-stream descriptor is refused."""
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp:
+            args = serve.parse_args(["--listen-fd", str(udp.fileno())])
+            with pytest.raises(ValueError, match="not a stream socket"):
+                serve.inherited_socket(args)
+
+    def test_socket_activation_for_another_process_is_ignored(self, monkeypatch):
+        """Test that LISTEN_FDS only applies when LISTEN_PID is this process."""
+        monkeypatch.setenv("LISTEN_PID", str(os.getpid() + 1))
+        monkeypatch.setenv("LISTEN_FDS", "1")
+        assert serve.inherited_socket(serve.parse_args([])) is None
+        assert os.environ["LISTEN_FDS"] == "1"
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="needs pass_fds")
+    @pytest.mark.parametrize("workers", ["1", "2"])
+    def test_child_serves_inherited_socket(self, workers):
+        """Test that serve.py answers on a socket bound by its parent."""
+        listener = socket.create_server(("127.0.0.1", 0))
+        port = listener.getsockname()[1]
+        try:
+            process = subprocess.Popen(
+                [sys.executable, "-u", str(SERVE_SCRIPT), "--workers", workers]
+                + ["--listen-fd", str(listener.fileno()), "--access-log", "off"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                pass_fds=(listener.fileno(),),
+            )
+        finally:
+            listener.close()
+        try:
+            # The port was listening all along, so the first request just
+            # waits in the backlog until the server starts accepting
+            address = types.SimpleNamespace(server_address=("127.0.0.1", port))
+            assert fetch(address, "/pages/index.html")[0] == 200
+            process.terminate()
+            output, _ = process.communicate(timeout=10)
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        assert process.returncode == 0
+        assert f"http://localhost:{port}" in output
+
+
+def _connection_states(httpd):
+    """Return (busy, idle) connection counts of a running server."""
+    if isinstance(httpd, serve.AsyncHTTPServer):
+        states = list(httpd._connections.values())
+    else:
+        states = list(httpd.connections._idle.values())
+    return states.count(False), states.count(True)
+
+
+def _accepts(port):
+    """Return True if something is listening on the local port."""
+    try:
+        socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+        return True
+    except OSError:
+        return False
@@ -2,8 +2,14 @@
 Unit tests for the ServerController class.
 """
 
+import os
+import socket
+import subprocess
+import urllib.error
 from unittest.mock import Mock, patch
 
+import pytest
+
 from tray_app.server_controller import ServerController
 
 
@@ -57,13 +63,17 @@ class TestServerController:
         controller = ServerController(test_config_manager)
         assert controller.get_port() == test_config_manager.get_port()
 
+    @patch("urllib.request.urlopen")
     @patch("subprocess.Popen")
-    def test_start_server_success(self, mock_popen, test_server_controller):
+    def test_start_server_success(
+        self, mock_popen, mock_urlopen, test_server_controller
+    ):
         """Test successful server start."""
         # Mock successful server process
         mock_process = Mock()
         mock_process.poll.return_value = None
         mock_popen.return_value = mock_process
+        mock_urlopen.return_value.__enter__.return_value.status = 200
 
         result = test_server_controller.start_server()
 
@@ -71,6 +81,109 @@ class TestServerController:
         assert test_server_controller.is_running is True
         assert test_server_controller.server_process == mock_process
 
+    @pytest.mark.skipif(os.name != "posix", reason="needs pass_fds")
+    @patch("urllib.request.urlopen")
+    @patch("subprocess.Popen")
+    def test_start_server_passes_listening_socket(
+        self, mock_popen, mock_urlopen, test_server_controller
+    ):
+        """Test that the controller binds the port and hands it to serve.py."""
+        test_server_controller.pass_listener = True
+        seen = {}
+
+        def spawn(command, **kwargs):
+            fd = int(command[command.index("--listen-fd") + 1])
+            seen["pass_fds"] = kwargs["pass_fds"]
+            with socket.socket(fileno=os.dup(fd)) as inherited:
+                seen["port"] = inherited.getsockname()[1]
+                seen["listening"] = inherited.getsockopt(
+                    socket.SOL_SOCKET, socket.SO_ACCEPTCONN
+                )
+            seen["fd"] = fd
+            process = Mock()
+            process.poll.return_value = None
+            return process
+
+        mock_popen.side_effect = spawn
+        mock_urlopen.return_value.__enter__.return_value.status = 200
+
+        assert test_server_controller.start_server() is True
+        assert seen["pass_fds"] == (seen["fd"],)
+        assert seen["listening"]
+        assert seen["port"] >= test_server_controller.get_port()
+        ready_url = mock_urlopen.call_args[0][0]
+        assert ready_url == f"http://127.0.0.1:{seen['port']}/readyz"
+        # The parent's copy is closed once the child has inherited it
+        with pytest.raises(OSError):
+            os.fstat(seen["fd"])
+
+    def test_bind_listener_refuses_port_in_use(self, test_server_controller):
+        """Test that a port someone else listens on is reported as taken."""
+        with socket.create_server(("", 0)) as taken:
+            port = taken.getsockname()[1]
+            assert test_server_controller.bind_listener(port) is None
+
+    @patch("urllib.request.urlopen")
+    @patch("subprocess.Popen")
+    def test_start_server_uses_bundled_site_pack(
+        self, mock_popen, mock_urlopen, test_server_controller, temp_dir
+    ):
+        """Test that a bundled site pack is served instead of pages/."""
+        mock_popen.return_value.poll.return_value = None
+        mock_urlopen.return_value.__enter__.return_value.status = 200
+        test_server_controller.site_pack = temp_dir / "site.pack"
+        test_server_controller.site_pack.write_bytes(b"")
+
+        assert test_server_controller.start_server() is True
+        command = mock_popen.call_args[0][0]
+        pack = command[command.index("--site-pack") + 1]
+        assert pack == str(temp_dir / "site.pack")
+
+    @patch("urllib.request.urlopen")
+    @patch("subprocess.Popen")
+    def test_start_server_without_site_pack(
+        self, mock_popen, mock_urlopen, test_server_controller, temp_dir
+    ):
+        """Test that a source checkout serves pages/ from disk."""
+        mock_popen.return_value.poll.return_value = None
+        mock_urlopen.return_value.__enter__.return_value.status = 200
+        test_server_controller.site_pack = temp_dir / "site.pack"
+
+        assert test_server_controller.start_server() is True
+        assert "--site-pack" not in mock_popen.call_args[0][0]
+
+    @patch("urllib.request.urlopen")
+    @patch("subprocess.Popen")
+    def test_start_server_uses_threaded_engine(
+        self, mock_popen, mock_urlopen, test_server_controller
+    ):
+        """Test that the tray app runs the engine that keeps connections open."""
+        mock_popen.return_value.poll.return_value = None
+        mock_urlopen.return_value.__enter__.return_value.status = 200
+
+        assert test_server_controller.start_server() is True
+        command = mock_popen.call_args[0][0]
+        assert command[command.index("--engine") + 1] == "threaded"
+
+    @patch("urllib.request.urlopen")
+    @patch("subprocess.Popen")
+    def test_start_server_never_pipes_output(
+        self, mock_popen, mock_urlopen, test_server_controller, temp_dir
+    ):
+        """Test that serve.py logs to files, since nothing reads its pipes."""
+        mock_popen.return_value.poll.return_value = None
+        mock_urlopen.return_value.__enter__.return_value.status = 200
+
+        assert test_server_controller.start_server() is True
+        command = mock_popen.call_args[0][0]
+        kwargs = mock_popen.call_args[1]
+        access_log = command[command.index("--access-log") + 1]
+        assert access_log == str(temp_dir / "nia_server_access.log")
+        assert kwargs["stdout"].name == str(temp_dir / "nia_server.log")
+        assert kwargs["stdout"].closed
+        assert kwargs["stderr"] == subprocess.STDOUT
+        assert subprocess.PIPE not in kwargs.values()
+
     @patch("subprocess.Popen")
     def test_start_server_failure(self, mock_popen, test_server_controller):
         """Test server start failure."""
@@ -84,6 +197,53 @@ class TestServerController:
         assert result is False
         assert test_server_controller.is_running is False
 
+    @patch("urllib.request.urlopen")
+    @patch("subprocess.Popen")
+    def test_start_server_kills_server_that_never_gets_ready(
+        self, mock_popen, mock_urlopen, test_server_controller
+    ):
+        """Test that a server stuck before /readyz does not keep the port."""
+        process = mock_popen.return_value
+        process.poll.return_value = None
+        process.wait.side_effect = [subprocess.TimeoutExpired("serve.py", 1), 0]
+        mock_urlopen.side_effect = urllib.error.URLError("connection refused")
+        test_server_controller.ready_timeout = 0.1
+
+        assert test_server_controller.start_server() is False
+
+        process.terminate.assert_called_once()
+        process.kill.assert_called_once()
+        assert process.wait.call_args_list[0].kwargs == {
+            "timeout": test_server_controller.stop_timeout
+        }
+        assert test_server_controller.server_process is None
+        assert test_server_controller.is_running is False
+
+    @patch("urllib.request.urlopen")
+    def test_wait_until_ready_polls_readyz(self, mock_urlopen, test_server_controller):
+        """Test that startup waits for /readyz instead of a fixed sleep."""
+        ready = Mock(status=200)
+        mock_urlopen.return_value.__enter__.side_effect = [
+            urllib.error.URLError("connection refused"),
+            ready,
+        ]
+        test_server_controller.server_process = Mock()
+        test_server_controller.server_process.poll.return_value = None
+
+        assert test_server_controller._wait_until_ready(9091) is True
+        assert mock_urlopen.call_args[0][0] == "http://127.0.0.1:9091/readyz"
+        assert mock_urlopen.call_count == 2
+
+    @patch("urllib.request.urlopen")
+    def test_wait_until_ready_times_out(self, mock_urlopen, test_server_controller):
+        """Test that a server that never becomes ready is reported as failed."""
+        mock_urlopen.side_effect = urllib.error.URLError("connection refused")
+        test_server_controller.ready_timeout = 0.2
+        test_server_controller.server_process = Mock()
+        test_server_controller.server_process.poll.return_value = None
+
+        assert test_server_controller._wait_until_ready(9091) is False
+
     def test_stop_server_when_not_running(self, test_server_controller):
         """Test stopping server when not running."""
         result = test_server_controller.stop_server()
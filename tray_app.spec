@@ -1,13 +1,24 @@
 # -*- mode: python ; coding: utf-8 -*-
 
+import os
+
 block_cipher = None
 
+# scripts/pack_site.py (make pack) writes the whole site into one file;
+# bundling it instead of the pages/ tree leaves the frozen app one file to
+# unpack at startup rather than hundreds. The server maps it in place.
+SITE_PACK = os.path.join('build', 'site.pack')
+if os.path.exists(SITE_PACK):
+    site_datas = [(SITE_PACK, '.')]
+else:
+    site_datas = [('pages', 'pages')]
+
 a = Analysis(
     ['tray_app/main.py'],
     pathex=[],
     binaries=[],
     datas=[
-        ('pages', 'pages'),
+        *site_datas,
         ('tray_app/config.json', '.'),
     ],
     hiddenimports=[
@@ -9,6 +9,8 @@ import socket
 import subprocess
 import threading
 import time
+import urllib.error
+import urllib.request
 import webbrowser
 from collections.abc import Callable
 from pathlib import Path
@@ -19,6 +21,21 @@ logger = logging.getLogger(__name__)
 class ServerController:
     """Manages the web server process."""
 
+    # Seconds to wait for a new server to report ready on /readyz
+    ready_timeout = 15.0
+    ready_poll_interval = 0.05
+    # Seconds to wait after SIGTERM before killing; longer than serve.py's
+    # default --drain-timeout so in-flight page loads can finish
+    stop_timeout = 10.0
+    # Bind the port here and hand the listening socket to serve.py, so it
+    # can't be taken between our check and the server's own bind. Windows
+    # can't pass sockets through Popen; serve.py binds $PORT itself there.
+    pass_listener = os.name == "posix"
+    listen_backlog = 128
+    # serve.py's default simple engine closes the connection after every
+    # response; the worker pool keeps page loads on one connection
+    engine = "threaded"
+
     def __init__(self, config_manager):
         """Initialize server controller.
 
@@ -34,6 +51,12 @@ class ServerController:
         # Get the project root directory
         self.project_root = Path(__file__).parent.parent
         self.serve_script = self.project_root / "scripts" / "serve.py"
+        # Frozen builds bundle the site as one pack (make pack), not pages/
+        self.site_pack = self.project_root / "site.pack"
+        # serve.py's logs go next to the tray app's own log. Nothing reads
+        # the child's pipes, so its output must never go to one: a full
+        # pipe would block the server.
+        self.log_dir = Path.cwd()
 
     def set_status_callback(self, callback: Callable) -> None:
         """Set callback function for status updates.
@@ -68,6 +91,25 @@ class ServerController:
         except OSError:
             return False
 
+    def bind_listener(self, port: int) -> socket.socket | None:
+        """Bind and listen on a port for serve.py to inherit.
+
+        Args:
+            port: Port number to bind
+
+        Returns:
+            Listening socket, or None if the port is in use
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            # Same address serve.py binds by default: all interfaces
+            sock.bind(("", port))
+            sock.listen(self.listen_backlog)
+        except OSError:
+            sock.close()
+            return None
+        return sock
+
     def find_available_port(self, start_port: int) -> int:
         """Find an available port starting from the given port.
 
@@ -97,9 +139,16 @@ class ServerController:
             return True
 
         port = self.config_manager.get_port()
+        listener = None
 
-        # Check if port is available
-        if not self.is_port_available(port):
+        if self.pass_listener:
+            listener = self._claim_port(port)
+            if listener is None:
+                logger.error("No available ports found")
+                self._notify_status("error")
+                return False
+            port = listener.getsockname()[1]
+        elif not self.is_port_available(port):
             logger.warning(f"Port {port} is not available, finding alternative")
             available_port = self.find_available_port(port)
             if available_port != port:
@@ -115,31 +164,53 @@ class ServerController:
             env = os.environ.copy()
             env["PORT"] = str(port)
 
+            command = ["uv", "run", "python", str(self.serve_script)]
+            command += ["--engine", self.engine]
+            pass_fds = ()
+            if listener is not None:
+                command += ["--listen-fd", str(listener.fileno())]
+                pass_fds = (listener.fileno(),)
+            if self.site_pack.is_file():
+                command += ["--site-pack", str(self.site_pack)]
+            # serve.py rotates its access log itself
+            access_log = self.log_dir / "nia_server_access.log"
+            command += ["--access-log", str(access_log)]
+
             # Start the server process
-            self.server_process = subprocess.Popen(
-                ["uv", "run", "python", str(self.serve_script)],
-                cwd=str(self.project_root),
-                env=env,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-            )
+            output = None
+            try:
+                # Startup banner and tracebacks
+                output = open(self.log_dir / "nia_server.log", "ab")
+                self.server_process = subprocess.Popen(
+                    command,
+                    cwd=str(self.project_root),
+                    env=env,
+                    stdin=subprocess.DEVNULL,
+                    stdout=output,
+                    stderr=subprocess.STDOUT,
+                    pass_fds=pass_fds,
+                )
+            finally:
+                # The child holds its own copies of the log and socket now
+                if output is not None:
+                    output.close()
+                if listener is not None:
+                    listener.close()
 
             # Start monitoring thread
             self.server_thread = threading.Thread(target=self._monitor_server)
             self.server_thread.daemon = True
             self.server_thread.start()
 
-            # Wait a moment for server to start
-            time.sleep(1)
-
-            if self.server_process.poll() is None:
+            if self._wait_until_ready(port):
                 self.is_running = True
                 logger.info(f"Server started on port {port}")
                 self._notify_status("running")
                 return True
             else:
                 logger.error("Server failed to start")
+                # A server that never became ready would keep the port
+                self._kill_server()
                 self._notify_status("error")
                 return False
 
@@ -148,6 +219,49 @@ class ServerController:
             self._notify_status("error")
             return False
 
+    def _claim_port(self, start_port: int) -> socket.socket | None:
+        """Bind the first free port from start_port upwards.
+
+        Args:
+            start_port: Preferred port
+
+        Returns:
+            Listening socket, or None if every port is taken
+        """
+        for port in range(start_port, 65536):
+            listener = self.bind_listener(port)
+            if listener is not None:
+                if port != start_port:
+                    logger.info(f"Port {start_port} is not available, using {port}")
+                return listener
+        return None
+
+    def _wait_until_ready(self, port: int) -> bool:
+        """Poll the server's /readyz endpoint until it can take traffic.
+
+        Args:
+            port: Port the server is listening on
+
+        Returns:
+            True once /readyz answers 200, False if the process exits or
+            ready_timeout passes first
+        """
+        url = f"http://127.0.0.1:{port}/readyz"
+        deadline = time.monotonic() + self.ready_timeout
+        while time.monotonic() < deadline:
+            if self.server_process.poll() is not None:
+                return False
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return True
+            except (urllib.error.URLError, OSError):
+                pass  # Not listening yet, or 503 while warming up
+            time.sleep(self.ready_poll_interval)
+
+        logger.error(f"Server did not become ready within {self.ready_timeout}s")
+        return False
+
     def stop_server(self) -> bool:
         """Stop the web server.
 
@@ -161,9 +275,9 @@ class ServerController:
         try:
             self.server_process.terminate()
 
-            # Wait for graceful shutdown
+            # Wait for serve.py to drain in-flight requests
             try:
-                self.server_process.wait(timeout=5)
+                self.server_process.wait(timeout=self.stop_timeout)
             except subprocess.TimeoutExpired:
                 logger.warning("Server did not stop gracefully, forcing kill")
                 self.server_process.kill()
@@ -179,6 +293,19 @@ class ServerController:
             self._notify_status("error")
             return False
 
+    def _kill_server(self) -> None:
+        """Stop a server process that is not in service and forget it."""
+        process, self.server_process = self.server_process, None
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout=self.stop_timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning("Server did not stop gracefully, forcing kill")
+            process.kill()
+            process.wait()
+
     def _monitor_server(self) -> None:
         """Monitor server process in background thread."""
         try: